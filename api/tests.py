@@ -769,3 +769,136 @@ class APIPaginationTestCase(APITestCase):
                 assert "previous" in res_json.keys()
                 assert "results" in res_json.keys()
                 assert not len("results") > 100
+
+
+class APIViewSetsTestCase(APITestCase):
+    """Test case to test that the viewsets of the API can be imported and
+    fetch the users with their access state."""
+
+    def test_users_viewsets_querysets(self):
+        """Tests that the users viewsets annotate the access state of the
+        users, Adherent and Club included.
+        """
+        from users.api import views
+
+        for viewset, model in (
+            (views.UserViewSet, users.User),
+            (views.AdherentViewSet, users.Adherent),
+            (views.ClubViewSet, users.Club),
+        ):
+            assert viewset.queryset.model is model
+            assert "end_adhesion_date" in viewset.queryset.query.annotations
+
+
+class APIRadiusTestCase(APITestCase):
+    """Test case to test the endpoints used by the rlm_rest module of
+    freeradius.
+
+    Attributes:
+        superuser: A superuser (with all permissions) used for the tests and
+            initialized at the beggining of this test case.
+    """
+
+    superuser = None
+
+    @classmethod
+    def setUpTestData(cls):
+        # A user with all the rights
+        cls.superuser = users.User.objects.create_superuser(
+            "apisuperuser3",
+            "apisuperuser3",
+            "apisuperuser3@example.net",
+            "apisuperuser3",
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.superuser.delete()
+        super(APIRadiusTestCase, cls).tearDownClass()
+
+    def test_authorize_unknown_user(self):
+        """Tests that an authorize request for an unknown user from an unknown
+        NAS is rejected with a Unauthorized (401) response.
+        """
+        self.client.force_authenticate(self.superuser)
+        response = self.client.post(
+            "/api/radius/authorize",
+            {
+                "User-Name": {"type": "string", "value": ["unknown"]},
+                "Calling-Station-Id": {"type": "string", "value": ["00:00:00:00:00:01"]},
+            },
+            format="json",
+        )
+        assert response.status_code == codes.unauthorized
+
+    def test_post_auth_unknown_nas(self):
+        """Tests that a post-auth request from an unknown NAS is accepted
+        without attributes with a No Content (204) response.
+        """
+        self.client.force_authenticate(self.superuser)
+        response = self.client.post(
+            "/api/radius/post-auth", {"NAS-Identifier": "unknown"}, format="json"
+        )
+        assert response.status_code == codes.no_content
+
+
+class APIDNSZonesTestCase(APITestCase):
+    """Test case to test the conditional requests of the DNS zones
+    endpoints.
+
+    Attributes:
+        superuser: A superuser (with all permissions) used for the tests and
+            initialized at the beggining of this test case.
+    """
+
+    superuser = None
+
+    @classmethod
+    def setUpTestData(cls):
+        # A user with all the rights
+        cls.superuser = users.User.objects.create_superuser(
+            "apisuperuser4",
+            "apisuperuser4",
+            "apisuperuser4@example.net",
+            "apisuperuser4",
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.superuser.delete()
+        super(APIDNSZonesTestCase, cls).tearDownClass()
+
+    def test_zones_not_modified(self):
+        """Tests that the zones are not sent again, with a Not Modified (304)
+        response, when the ETag of the previous response is given.
+        """
+        self.client.force_authenticate(self.superuser)
+        for url in ("/api/machines/dns-zones", "/api/machines/dns-reverse-zones"):
+            with self.subTest(url=url):
+                response = self.client.get(url, format="json")
+                assert response.status_code == codes.ok
+                etag = response["ETag"]
+                response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+                assert response.status_code == codes.not_modified
+
+    def test_zones_filter(self):
+        """Tests that the zones are filtered by name with ?zones=."""
+        self.client.force_authenticate(self.superuser)
+        response = self.client.get(
+            "/api/machines/dns-zones?zones=unknown.example.net", format="json"
+        )
+        assert response.status_code == codes.ok
+        assert json.loads(response.content.decode())["count"] == 0
+
+    def test_zones_etag_depends_on_page(self):
+        """Tests that the ETag of a page of zones does not match another
+        page or page size."""
+        self.client.force_authenticate(self.superuser)
+        url = "/api/machines/dns-zones"
+        etag = self.client.get(url, format="json")["ETag"]
+        for params in ("?page=2", "?page_size=1"):
+            with self.subTest(params=params):
+                response = self.client.get(
+                    url + params, format="json", HTTP_IF_NONE_MATCH=etag
+                )
+                assert response.status_code != codes.not_modified
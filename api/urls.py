@@ -65,4 +65,8 @@ for _url, view, name in urls_functional_view:
 # TOKEN AUTHENTICATION
 router.register_view(r"token-auth", views.ObtainExpiringAuthToken)
 
+# FREERADIUS RLM_REST
+router.register_view(r"radius/authorize", views.RadiusAuthorizeView)
+router.register_view(r"radius/post-auth", views.RadiusPostAuthView)
+
 urlpatterns = [url(r"^", include(router.urls))]
@@ -32,11 +32,19 @@ from django.conf import settings
 from django.db.models import Q
 from django.contrib.auth.models import Group
 from rest_framework import viewsets, generics, views
+from rest_framework.authentication import BasicAuthentication
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.parsers import FormParser, JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from machines.models import Nas
+from users.models import User
+from re2o import radius
+
 from . import serializers
+from .authentication import ExpiringTokenAuthentication
 from .pagination import PageSizedPagination
 from .permissions import ACLPermission
 
@@ -67,3 +75,81 @@ class ObtainExpiringAuthToken(ObtainAuthToken):
         return Response(
             {"token": token.key, "expiration": token.created + token_duration}
         )
+
+
+class RadiusView(views.APIView):
+    """Exposes the RADIUS decisions to the rlm_rest module of freeradius.
+
+    The request attributes are posted as sent by rlm_rest (json or form
+    body). The answer follows the rlm_rest conventions: 204 for an accept
+    without attributes, 200 with the reply and control attributes and 401
+    (with the reply attributes) for a reject. The view holds no state between
+    requests, so that it can be served by any number of workers.
+
+    The basic authentication is allowed because rlm_rest can't send a token.
+    """
+
+    # The view answers to every RADIUS request: no session, no browsable API
+    authentication_classes = (BasicAuthentication, ExpiringTokenAuthentication)
+    parser_classes = (JSONParser, FormParser)
+    renderer_classes = (JSONRenderer,)
+    permission_classes = (ACLPermission,)
+    perms_map = {"POST": [User.can_view_all, Nas.can_view_all]}
+    # The function of re2o.radius called by the view
+    decision = None
+
+    STATUS_CODES = {"OK": 204, "UPDATED": 200, "REJECT": 401}
+
+    @staticmethod
+    def request_attributes(data):
+        """Get the RADIUS attributes of a request as a dict of strings.
+
+        rlm_rest sends {"attribute": {"type": ..., "value": [...]}} with a json
+        body and attribute=value with a form body.
+        """
+        attributes = {}
+        for key, value in data.items():
+            if isinstance(value, dict):
+                value = value.get("value")
+            if isinstance(value, list):
+                value = value[0] if value else ""
+            # Beware: the scalar values may be quoted
+            attributes[key] = str(value).replace('"', "")
+        return attributes
+
+    @staticmethod
+    def response_attributes(reply, control):
+        """Format the reply and control attributes for rlm_rest."""
+        attributes = {}
+        for section, section_attributes in (("reply", reply), ("control", control)):
+            for attribute, value in section_attributes:
+                key = "%s:%s" % (section, attribute)
+                attributes.setdefault(key, []).append(str(value))
+        return dict(
+            (key, {"op": ":=", "value": values[0]})
+            if len(values) == 1
+            else (key, {"op": "+=", "value": values})
+            for key, values in attributes.items()
+        )
+
+    def post(self, request, *args, **kwargs):
+        code, reply, control = self.decision(self.request_attributes(request.data))
+        if code == "OK":
+            return Response(status=self.STATUS_CODES[code])
+        if code == "REJECT":
+            control = ()
+        return Response(
+            self.response_attributes(reply, control), status=self.STATUS_CODES[code]
+        )
+
+
+class RadiusAuthorizeView(RadiusView):
+    """Exposes the RADIUS authorize decision, see RadiusView."""
+
+    decision = staticmethod(radius.authorize)
+
+
+class RadiusPostAuthView(RadiusView):
+    """Exposes the RADIUS post-auth decision, see RadiusView."""
+
+    decision = staticmethod(radius.post_auth)
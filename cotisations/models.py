@@ -39,6 +39,7 @@ from django.db.models import Q, Max
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.forms import ValidationError
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
@@ -296,6 +297,17 @@ class Facture(BaseInvoice):
         self.field_permissions = {"control": self.can_change_control}
         self.__original_valid = self.valid
         self.__original_control = self.control
+        self.__original_user_id = self.user_id
+
+    def previous_user(self):
+        """Get the user the invoice belonged to before it was edited.
+
+        Returns:
+            user: the previous owner, None if the owner did not change.
+        """
+        if self.__original_user_id in (None, self.user_id):
+            return None
+        return users.models.User.objects.filter(pk=self.__original_user_id).first()
 
     def get_subscription(self):
         """Returns every subscription associated with this invoice."""
@@ -361,6 +373,13 @@ def facture_post_save(**kwargs):
     Synchronise the LDAP user after an invoice has been saved.
     """
     facture = kwargs["instance"]
+    users.models.UserAccessState.refresh(facture.user)
+    users.models.UserBalance.refresh(facture.user)
+    previous_user = facture.previous_user()
+    if previous_user is not None:
+        users.models.UserAccessState.refresh(previous_user)
+        users.models.UserBalance.refresh(previous_user)
+        users.signals.synchronise.send(sender=users.models.User, instance=previous_user, base=False, access_refresh=True, mac_refresh=False)
     if facture.valid:
         user = facture.user
         user.set_active()
@@ -373,6 +392,8 @@ def facture_post_delete(**kwargs):
     Synchronise the LDAP user after an invoice has been deleted.
     """
     user = kwargs["instance"].user
+    users.models.UserAccessState.refresh(user, create=False)
+    users.models.UserBalance.refresh(user, create=False)
     users.signals.synchronise.send(sender=users.models.User, instance=user, base=False, access_refresh=True, mac_refresh=False)
 
 
@@ -658,9 +679,10 @@ def vente_post_save(**kwargs):
     """
     purchase = kwargs["instance"]
     try:
-        purchase.facture.facture
+        invoice = purchase.facture.facture
     except Facture.DoesNotExist:
         return
+    users.models.UserBalance.refresh(invoice.user)
     if hasattr(purchase, "cotisation"):
         purchase.cotisation.vente = purchase
         purchase.cotisation.save()
@@ -683,6 +705,7 @@ def vente_post_delete(**kwargs):
         invoice = purchase.facture.facture
     except Facture.DoesNotExist:
         return
+    users.models.UserBalance.refresh(invoice.user, create=False)
     if purchase.type_cotisation:
         user = invoice.user
         users.signals.synchronise.send(sender=users.models.User, instance=user, base=True, access_refresh=True, mac_refresh=False)
@@ -862,9 +885,22 @@ class Paiement(RevMixin, AclMixin, models.Model):
         verbose_name = _("payment method")
         verbose_name_plural = _("payment methods")
 
+    def __init__(self, *args, **kwargs):
+        super(Paiement, self).__init__(*args, **kwargs)
+        self.__original_is_balance = self.is_balance
+
     def __str__(self):
         return self.moyen
 
+    def is_balance_changed(self):
+        """
+        Returns: whether is_balance changed since the payment method was
+        loaded, and reset it.
+        """
+        changed = self.is_balance != self.__original_is_balance
+        self.__original_is_balance = self.is_balance
+        return changed
+
     def clean(self):
         """l
         Override of the herited clean function to get a correct name
@@ -953,6 +989,19 @@ class Paiement(RevMixin, AclMixin, models.Model):
         return _("No custom payment methods.")
 
 
+@receiver(post_save, sender=Paiement)
+def paiement_post_save(**kwargs):
+    """
+    Refresh the balances of the users who paid with a payment method which
+    became, or stopped being, the balance payment method.
+    """
+    payment = kwargs["instance"]
+    if payment.is_balance_changed():
+        users.models.UserBalance.rebuild(
+            users.models.User.objects.filter(facture__paiement=payment).distinct()
+        )
+
+
 class Cotisation(RevMixin, AclMixin, models.Model):
     """
     The model defining a cotisation. It holds information about the time a user
@@ -1057,12 +1106,23 @@ class Cotisation(RevMixin, AclMixin, models.Model):
         )
 
 
+def refresh_access_state(cotisation, create=True):
+    """Refresh the access state of the user who bought a cotisation, see
+    users.models.UserAccessState.refresh."""
+    try:
+        user = cotisation.vente.facture.facture.user
+    except ObjectDoesNotExist:
+        return
+    users.models.UserAccessState.refresh(user, create=create)
+
+
 @receiver(post_save, sender=Cotisation)
-def cotisation_post_save(**_kwargs):
+def cotisation_post_save(**kwargs):
     """
     Mark some services as needing a regeneration after the edition of a
     cotisation. Indeed the membership status may have changed.
     """
+    refresh_access_state(kwargs["instance"])
     regen("dns")
     regen("dhcp")
     regen("mac_ip_list")
@@ -1070,10 +1130,11 @@ def cotisation_post_save(**_kwargs):
 
 
 @receiver(post_delete, sender=Cotisation)
-def cotisation_post_delete(**_kwargs):
+def cotisation_post_delete(**kwargs):
     """
     Mark some services as needing a regeneration after the deletion of a
     cotisation. Indeed the membership status may have changed.
     """
+    refresh_access_state(kwargs["instance"], create=False)
     regen("mac_ip_list")
     regen("mailing")
@@ -301,3 +301,33 @@ class FactureModelTests(TestCase):
         invoice1.delete()
         invoice2.delete()
 
+
+
+class BalanceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(pseudo="testUserBalance", email="test@example.org")
+        self.balance_payment = Paiement.objects.create(moyen="balance", is_balance=True)
+        self.paiement = Paiement.objects.create(moyen="test payment")
+
+    def tearDown(self):
+        self.user.facture_set.all().delete()
+        self.user.delete()
+        self.balance_payment.delete()
+        self.paiement.delete()
+
+    def buy(self, paiement, name, prix, number=1):
+        invoice = Facture.objects.create(user=self.user, paiement=paiement, valid=True)
+        Vente.objects.create(facture=invoice, number=number, name=name, prix=prix)
+        return invoice
+
+    def test_balance_is_updated_by_invoices(self):
+        self.buy(self.paiement, "solde", 10, number=2)
+        purchase = self.buy(self.balance_payment, "Test purchase", 3)
+        self.assertEqual(User.objects.get(pk=self.user.pk).solde, 17)
+        purchase.valid = False
+        purchase.save()
+        self.assertEqual(User.objects.get(pk=self.user.pk).solde, 20)
+        purchase.delete()
+        self.assertEqual(User.objects.get(pk=self.user.pk).solde, 20)
+        self.user.balance_totals.delete()
+        self.assertEqual(User.objects.get(pk=self.user.pk).solde, 20)
@@ -26,7 +26,8 @@
 Python backend for freeradius.
 
 This file contains definition of some functions called by freeradius backend
-during auth for wifi, wired device and nas.
+during auth for wifi, wired device and nas. The decisions are taken by
+re2o.radius, which is also used by the rlm_rest endpoint of the API.
 
 Other examples can be found here :
 https://github.com/FreeRADIUS/freeradius-server/blob/master/src/modules/rlm_python/
@@ -36,14 +37,19 @@ Inspired by Daniel Stan in Crans
 
 import os
 import sys
+import time
 import logging
+import threading
 import traceback
+from contextlib import contextmanager
+
 import radiusd  # Magic module freeradius (radiusd.py is dummy)
 
 from django.core.wsgi import get_wsgi_application
-from django.db.models import Q
 
-proj_path = "/var/www/re2o/"
+# RE2O_PATH allows loading this backend outside of freeradius, e.g. from the
+# bench_radius management command
+proj_path = os.environ.get("RE2O_PATH", "/var/www/re2o/")
 # This is so Django knows where to find stuff.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "re2o.settings")
 sys.path.append(proj_path)
@@ -54,11 +60,13 @@ os.chdir(proj_path)
 # This is so models get loaded.
 application = get_wsgi_application()
 
-from machines.models import Interface, IpList, Nas, Domain
-from topologie.models import Port, Switch
-from users.models import User
-from preferences.models import RadiusOption
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.db.backends.signals import connection_created
 
+from re2o import radius
+from re2o.base import access_memo, cache_is_shared
+from re2o.radius import stats
 
 
 # Logging
@@ -76,13 +84,107 @@ class RadiusdHandler(logging.Handler):
         radiusd.radlog(rad_sig, str(record.msg))
 
 
-# Init for logging 
+# Init for logging, the decision engine logs are sent to freeradius as well
 logger = logging.getLogger("auth.py")
-logger.setLevel(logging.DEBUG)
 formatter = logging.Formatter("%(name)s: [%(levelname)s] %(message)s")
 handler = RadiusdHandler()
 handler.setFormatter(formatter)
-logger.addHandler(handler)
+for backend_logger in (logger, logging.getLogger(radius.__name__)):
+    backend_logger.setLevel(logging.DEBUG)
+    backend_logger.addHandler(handler)
+
+# Display the freeradius return codes by name in the statistics
+stats.codes.update(
+    (getattr(radiusd, name), name[len("RLM_MODULE_"):])
+    for name in dir(radiusd)
+    if name.startswith("RLM_MODULE_")
+)
+
+
+class DatabaseConnections(object):
+    """Lifecycle of the database connections of the radiusd threads.
+
+    Nothing closes the connections here as Django does at the end of an HTTP
+    request. Each thread keeps its connection for at most max_age seconds and
+    checks it before use if it has failed or has been idle for a while. At
+    most max_connections threads use the database at once, the others wait
+    for wait_timeout seconds at most, and the connections in excess are
+    closed after use.
+    """
+
+    # A connection idle for longer (in seconds) is checked before use
+    IDLE_CHECK = 10
+
+    def __init__(self, max_age, max_connections, wait_timeout):
+        self.max_age = max_age
+        self.max_connections = max_connections
+        self.wait_timeout = wait_timeout
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.lock = threading.Lock()
+        self.opened = set()
+        self.current = threading.local()
+        connection_created.connect(self.connected, weak=False)
+
+    def connected(self, **_kwargs):
+        """Record a new connection of the current thread."""
+        self.current.opened_at = time.monotonic()
+        with self.lock:
+            self.opened.add(threading.get_ident())
+
+    def close(self):
+        """Close the connection of the current thread, the next query opens
+        a new one."""
+        try:
+            connection.close()
+        except Exception as err:
+            logger.warning("Failed to close the database connection: %r" % err)
+        with self.lock:
+            self.opened.discard(threading.get_ident())
+
+    def check(self):
+        """Close the connection of the current thread if it is too old or
+        unusable."""
+        if connection.connection is None:
+            return
+        now = time.monotonic()
+        if now - getattr(self.current, "opened_at", now) > self.max_age:
+            self.close()
+        elif (
+            connection.errors_occurred
+            or now - getattr(self.current, "used_at", now) > self.IDLE_CHECK
+        ):
+            if not connection.is_usable():
+                logger.warning("Database connection unusable, reconnecting")
+                self.close()
+            connection.errors_occurred = False
+
+    @contextmanager
+    def use(self):
+        """Hold a database slot, with a checked connection, for the current
+        thread."""
+        # Inside a transaction (e.g. bench_radius), leave the connection alone
+        if connection.in_atomic_block:
+            yield
+            return
+        if not self.slots.acquire(timeout=self.wait_timeout):
+            raise OperationalError("No database connection available")
+        try:
+            self.check()
+            yield
+        finally:
+            self.current.used_at = time.monotonic()
+            with self.lock:
+                excess = len(self.opened) > self.max_connections
+            if excess:
+                self.close()
+            self.slots.release()
+
+
+db_connections = DatabaseConnections(
+    settings.RADIUS_DB_CONN_MAX_AGE,
+    settings.RADIUS_DB_MAX_CONNECTIONS,
+    settings.RADIUS_DB_WAIT_TIMEOUT,
+)
 
 
 def radius_event(fun):
@@ -93,7 +195,10 @@ def radius_event(fun):
      * a tuple of 2 elements for response value (access ok , etc)
      * a tuple of 2 elements for internal value to update (password for example)
 
-    Here, we convert the list of tuples into a dictionnary.
+    Here, we convert the list of tuples into a dictionnary. The call holds a
+    database connection (see DatabaseConnections) and is retried once with a
+    new connection if the database fails. The access of the users is
+    memoized during the call (see re2o.base.access_memo).
     """
 
     def new_f(auth_data):
@@ -106,23 +211,53 @@ def radius_event(fun):
                 # Beware: les valeurs scalaires sont entre guillemets
                 # Ex: Calling-Station-Id: "une_adresse_mac"
                 data[key] = value.replace('"', "")
-        try:
-            return fun(data)
-        except Exception as err:
-            exc_type, exc_instance, exc_traceback = sys.exc_info()
-            formatted_traceback = "".join(traceback.format_tb(exc_traceback))
-            logger.error("Failed %r on data %r" % (err, auth_data))
-            logger.error("Function %r, Traceback : %r" % (fun, formatted_traceback))
-            return radiusd.RLM_MODULE_FAIL
+        with stats.measure(fun.__name__) as call:
+            try:
+                with db_connections.use(), access_memo():
+                    try:
+                        call.result = fun(data)
+                    except OperationalError as err:
+                        if connection.in_atomic_block:
+                            raise
+                        # The connection is probably dead (database restart,
+                        # failover), retry once with a new one
+                        logger.warning("Database error %r, retrying" % err)
+                        db_connections.close()
+                        call.result = fun(data)
+            except Exception as err:
+                exc_type, exc_instance, exc_traceback = sys.exc_info()
+                formatted_traceback = "".join(traceback.format_tb(exc_traceback))
+                logger.error("Failed %r on data %r" % (err, auth_data))
+                logger.error("Function %r, Traceback : %r" % (fun, formatted_traceback))
+                call.result = radiusd.RLM_MODULE_FAIL
+        return call.result
 
     return new_f
 
 
+def radiusd_result(result):
+    """Convert a result of the decision engine (code name, reply
+    attributes, control attributes) to what freeradius expects."""
+    code, reply, control = result
+    code = getattr(radiusd, "RLM_MODULE_" + code)
+    if not reply and not control:
+        return code
+    return (code, tuple(reply), tuple(control))
+
+
 @radius_event
 def instantiate(*_):
     """Usefull for instantiate ldap connexions otherwise,
     do nothing"""
     logger.info("Instantiation")
+    if not cache_is_shared():
+        logger.warning(
+            "The cache is not shared with the web server (see CACHES in"
+            " settings_local.py): the NAS devices, switches and ports edited"
+            " in re2o will only be seen after a restart of freeradius"
+        )
+    radius.nas_index.build()
+    radius.port_index.build()
 
 
 @radius_event
@@ -132,106 +267,14 @@ def authorize(data):
     - If the nas is known, we apply the 802.1X if enabled,
     - It the nas is known AND nas auth is enabled with mac address, returns
     accept here"""
-    # For proxified request, split 
-    nas = data.get("NAS-IP-Address", data.get("NAS-Identifier", None))
-    nas_instance = find_nas_from_request(nas)
-    # For none proxified requests 
-    nas_type = None
-    if nas_instance:
-        nas_type = Nas.objects.filter(nas_type=nas_instance.machine_type).first()
-    if not nas_type or nas_type.port_access_mode == "802.1X":
-        user = data.get("User-Name", "")
-        user = user.split("@", 1)[0]
-        mac = data.get("Calling-Station-Id", "")
-        result, log, password = check_user_machine_and_register(nas_type, user, mac)
-        logger.info(str(log))
-        logger.info(str(user))
-
-        if not result:
-            return radiusd.RLM_MODULE_REJECT
-        else:
-            return (
-                radiusd.RLM_MODULE_UPDATED,
-                (),
-                ((str("NT-Password"), str(password)),),
-            )
-
-    else:
-        return (radiusd.RLM_MODULE_UPDATED, (), (("Auth-Type", "Accept"),))
+    return radiusd_result(radius.authorize(data))
 
 
 @radius_event
 def post_auth(data):
     """ Function called after the user is authenticated
     """
-
-    nas = data.get("NAS-IP-Address", data.get("NAS-Identifier", None))
-    nas_instance = find_nas_from_request(nas)
-    # All non proxified requests 
-    if not nas_instance:
-        logger.info("Proxified request, nas unknown")
-        return radiusd.RLM_MODULE_OK
-    nas_type = Nas.objects.filter(nas_type=nas_instance.machine_type).first()
-    if not nas_type:
-        logger.info("This kind of nas is not registered in the database!")
-        return radiusd.RLM_MODULE_OK
-
-    mac = data.get("Calling-Station-Id", None)
-
-    # Switchs and access point can have several interfaces
-    nas_machine = nas_instance.machine
-    # If it is a switchs
-    if hasattr(nas_machine, "switch"):
-        port = data.get("NAS-Port-Id", data.get("NAS-Port", None))
-        # If the switch is part of a stack, calling ip is different from calling switch.
-        instance_stack = nas_machine.switch.stack
-        if instance_stack:
-            # If it is a stack, we select the correct switch in the stack
-            id_stack_member = port.split("-")[1].split("/")[0]
-            nas_machine = (
-                Switch.objects.filter(stack=instance_stack)
-                .filter(stack_member_id=id_stack_member)
-                .prefetch_related("interface_set__domain__extension")
-                .first()
-            )
-        # Find the port number from freeradius, works both with HP, Cisco
-        # and juniper output
-        port = port.split(".")[0].split("/")[-1][-2:]
-        out = decide_vlan_switch(nas_machine, nas_type, port, mac)
-        sw_name, room, reason, vlan_id, decision, attributes = out
-
-        if decision:
-            log_message = "(wired) %s -> %s [%s%s]" % (
-                sw_name + ":" + port + "/" + str(room),
-                mac,
-                vlan_id,
-                (reason and ": " + reason),
-            )
-            logger.info(log_message)
-
-            # Wired connexion
-            return (
-                radiusd.RLM_MODULE_UPDATED,
-                (
-                    ("Tunnel-Type", "VLAN"),
-                    ("Tunnel-Medium-Type", "IEEE-802"),
-                    ("Tunnel-Private-Group-Id", "%d" % int(vlan_id)),
-                )
-                + tuple(attributes),
-                (),
-            )
-        else:
-            log_message = "(fil) %s -> %s [Reject %s]" % (
-                sw_name + ":" + port + "/" + str(room),
-                mac,
-                (reason and ": " + reason),
-            )
-            logger.info(log_message)
-
-            return (radiusd.RLM_MODULE_REJECT, tuple(attributes), ())
-
-    else:
-        return radiusd.RLM_MODULE_OK
+    return radiusd_result(radius.post_auth(data))
 
 
 # TODO : remove this function
@@ -243,345 +286,6 @@ def dummy_fun(_):
 
 def detach(_=None):
     """Detatch the auth"""
+    stats.flush()
     print("*** goodbye from auth.py ***")
     return radiusd.RLM_MODULE_OK
-
-
-def find_nas_from_request(nas_id):
-    """ Get the nas object from its ID """
-    nas = (
-        Interface.objects.filter(
-            Q(domain=Domain.objects.filter(name=nas_id))
-            | Q(ipv4=IpList.objects.filter(ipv4=nas_id))
-        )
-        .select_related("machine_type")
-        .select_related("machine__switch__stack")
-    )
-    return nas.first()
-
-
-def check_user_machine_and_register(nas_type, username, mac_address):
-    """Check if username and mac are registered. Register it if unknown.
-    Return the user ntlm password if everything is ok.
-    Used for 802.1X auth"""
-    interface = Interface.objects.filter(mac_address=mac_address).first()
-    user = User.objects.filter(pseudo__iexact=username).first()
-    if not user:
-        return (False, "User unknown", "")
-    if not user.has_access():
-        return (False, "Invalid connexion (non-contributing user)", "")
-    if interface:
-        if interface.machine.user != user:
-            return (
-                False,
-                "Mac address registered on another user account",
-                "",
-            )
-        elif not interface.is_active:
-            return (False, "Interface/Machine disabled", "")
-        elif not interface.ipv4:
-            interface.assign_ipv4()
-            return (True, "Ok, new ipv4 assignement...", user.pwd_ntlm)
-        else:
-            return (True, "Access ok", user.pwd_ntlm)
-    elif nas_type:
-        if nas_type.autocapture_mac:
-            result, reason = user.autoregister_machine(mac_address, nas_type)
-            if result:
-                return (True, "Access Ok, Registering mac...", user.pwd_ntlm)
-            else:
-                return (False, "Error during mac register %s" % reason, "")
-        else:
-            return (False, "Unknown interface/machine", "")
-    else:
-        return (False, "Unknown interface/machine", "")
-
-
-def decide_vlan_switch(nas_machine, nas_type, port_number, mac_address):
-    """Function for selecting vlan for a switch with wired mac auth radius.
-    Several modes are available :
-        - all modes:
-           - unknown NAS : VLAN_OK,
-           - unknown port : Decision set in Re2o RadiusOption
-        - No radius on this port : VLAN_OK
-        - force : returns vlan provided by the database
-        - mode strict:
-            - no room : Decision set in Re2o RadiusOption,
-            - no user in this room : Reject,
-            - user of this room is banned or disable : Reject,
-            - user of this room non-contributor and not whitelisted: 
-            Decision set in Re2o RadiusOption
-        - mode common :
-            - mac-address already registered:
-                - related user non contributor / interface disabled:
-                Decision set in Re2o RadiusOption
-                - related user is banned:
-                Decision set in Re2o RadiusOption
-                - user contributing : VLAN_OK (can assign ipv4 if needed)
-            - unknown interface :
-                - register mac disabled : Decision set in Re2o RadiusOption
-                - register mac enabled : redirect to webauth
-    Returns:
-        tuple with :
-            - Switch name (str)
-            - Room (str)
-            - Reason of the decision (str)
-            - vlan_id (int)
-            - decision (bool)
-            - Other Attributs (attribut:str, operator:str, value:str)
-    """
-    attributes_kwargs = {
-        "client_mac": str(mac_address),
-        "switch_port": str(port_number),
-    }
-    # Get port from switch and port number
-    extra_log = ""
-    # If NAS is unknown, go to default vlan 
-    if not nas_machine:
-        return (
-            "?",
-            "Unknown room",
-            "Unknown NAS",
-            RadiusOption.get_cached_value("vlan_decision_ok").vlan_id,
-            True,
-            RadiusOption.get_attributes("ok_attributes", attributes_kwargs),
-        )
-
-    sw_name = str(getattr(nas_machine, "short_name", str(nas_machine)))
-
-    switch = Switch.objects.filter(machine_ptr=nas_machine).first()
-    attributes_kwargs["switch_ip"] = str(switch.ipv4)
-    port = Port.objects.filter(switch=switch, port=port_number).first()
-
-    # If the port is unknwon, go to default vlan
-    # We don't have enought information to make a better decision
-    if not port:
-        return (
-            sw_name,
-            "Unknown port",
-            "PUnknown port",
-            getattr(
-                RadiusOption.get_cached_value("unknown_port_vlan"), "vlan_id", None
-            ),
-            RadiusOption.get_cached_value("unknown_port") != RadiusOption.REJECT,
-            RadiusOption.get_attributes("unknown_port_attributes", attributes_kwargs),
-        )
- 
-    # Retrieve port profile
-    port_profile = port.get_port_profile
-
-    # If a vlan is precised in port config, we use it
-    if port_profile.vlan_untagged:
-        DECISION_VLAN = int(port_profile.vlan_untagged.vlan_id)
-        extra_log = "Force sur vlan " + str(DECISION_VLAN)
-        attributes = ()
-    else:
-        DECISION_VLAN = RadiusOption.get_cached_value("vlan_decision_ok").vlan_id
-        attributes = RadiusOption.get_attributes("ok_attributes", attributes_kwargs)
-
-    # If the port is disabled in re2o, REJECT
-    if not port.state:
-        return (sw_name, port.room, "Port disabled", None, False, ())
-
-    # If radius is disabled, decision is OK
-    if port_profile.radius_type == "NO":
-        return (
-            sw_name,
-            "",
-            "No Radius auth enabled on this port" + extra_log,
-            DECISION_VLAN,
-            True,
-            attributes,
-        )
-
-    # If 802.1X is enabled, people has been previously accepted.
-    # Go to the decision vlan
-    if (nas_type.port_access_mode, port_profile.radius_type) == ("802.1X", "802.1X"):
-        room = port.room or "Room unknown"
-        return (
-            sw_name,
-            room,
-            "Accept authentication 802.1X",
-            DECISION_VLAN,
-            True,
-            attributes,
-        )
-
-    # Otherwise, we are in mac radius.
-    # If strict mode is enabled, we check every user related with this port. If
-    # one user or more is not enabled, we reject to prevent from sharing or
-    # spoofing mac.
-    if port_profile.radius_mode == "STRICT":
-        room = port.room
-        if not room:
-            return (
-                sw_name,
-                "Unknown",
-                "Unkwown room",
-                getattr(
-                    RadiusOption.get_cached_value("unknown_room_vlan"), "vlan_id", None
-                ),
-                RadiusOption.get_cached_value("unknown_room") != RadiusOption.REJECT,
-                RadiusOption.get_attributes(
-                    "unknown_room_attributes", attributes_kwargs
-                ),
-            )
-
-        room_user = User.objects.filter(
-            Q(club__room=port.room) | Q(adherent__room=port.room)
-        )
-        if not room_user:
-            return (
-                sw_name,
-                room,
-                "Non-contributing room",
-                getattr(
-                    RadiusOption.get_cached_value("non_member_vlan"), "vlan_id", None
-                ),
-                RadiusOption.get_cached_value("non_member") != RadiusOption.REJECT,
-                RadiusOption.get_attributes("non_member_attributes", attributes_kwargs),
-            )
-        for user in room_user:
-            if user.is_ban() or user.state != User.STATE_ACTIVE:
-                return (
-                    sw_name,
-                    room,
-                    "User is banned or disabled",
-                    getattr(
-                        RadiusOption.get_cached_value("banned_vlan"), "vlan_id", None
-                    ),
-                    RadiusOption.get_cached_value("banned") != RadiusOption.REJECT,
-                    RadiusOption.get_attributes("banned_attributes", attributes_kwargs),
-                )
-            elif user.email_state == User.EMAIL_STATE_UNVERIFIED:
-                return (
-                    sw_name,
-                    room,
-                    "User is suspended (mail has not been confirmed)",
-                    getattr(
-                        RadiusOption.get_cached_value("non_member_vlan"),
-                        "vlan_id",
-                        None,
-                    ),
-                    RadiusOption.get_cached_value("non_member") != RadiusOption.REJECT,
-                    RadiusOption.get_attributes(
-                        "non_member_attributes", attributes_kwargs
-                    ),
-                )
-            elif not (user.is_connected() or user.is_whitelisted()):
-                return (
-                    sw_name,
-                    room,
-                    "Non-contributing member",
-                    getattr(
-                        RadiusOption.get_cached_value("non_member_vlan"),
-                        "vlan_id",
-                        None,
-                    ),
-                    RadiusOption.get_cached_value("non_member") != RadiusOption.REJECT,
-                    RadiusOption.get_attributes(
-                        "non_member_attributes", attributes_kwargs
-                    ),
-                )
-        # else: user OK, so we check MAC now
-
-    # If we are authenticating with mac, we look for the interfaces and its mac address
-    if port_profile.radius_mode == "COMMON" or port_profile.radius_mode == "STRICT":
-        # Mac auth
-        interface = (
-            Interface.objects.filter(mac_address=mac_address)
-            .select_related("machine__user")
-            .select_related("ipv4")
-            .first()
-        )
-        # If mac is unknown,
-        if not interface:
-            room = port.room
-            # We try to register mac, if autocapture is enabled
-            # Final decision depend on RADIUSOption set in re2o
-            if nas_type.autocapture_mac:
-                return (
-                    sw_name,
-                    room,
-                    "Unknown mac/interface",
-                    getattr(
-                        RadiusOption.get_cached_value("unknown_machine_vlan"),
-                        "vlan_id",
-                        None,
-                    ),
-                    RadiusOption.get_cached_value("unknown_machine")
-                    != RadiusOption.REJECT,
-                    RadiusOption.get_attributes(
-                        "unknown_machine_attributes", attributes_kwargs
-                    ),
-                )
-            # Otherwise, if autocapture mac is not enabled,
-            else:
-                return (
-                    sw_name,
-                    "",
-                    "Unknown mac/interface",
-                    getattr(
-                        RadiusOption.get_cached_value("unknown_machine_vlan"),
-                        "vlan_id",
-                        None,
-                    ),
-                    RadiusOption.get_cached_value("unknown_machine")
-                    != RadiusOption.REJECT,
-                    RadiusOption.get_attributes(
-                        "unknown_machine_attributes", attributes_kwargs
-                    ),
-                )
-
-        # Mac/Interface is found, check if related user is contributing and ok
-        # If needed, set ipv4 to it
-        else:
-            room = port.room
-            if interface.machine.user.is_ban():
-                return (
-                    sw_name,
-                    room,
-                    "Banned user",
-                    getattr(
-                        RadiusOption.get_cached_value("banned_vlan"), "vlan_id", None
-                    ),
-                    RadiusOption.get_cached_value("banned") != RadiusOption.REJECT,
-                    RadiusOption.get_attributes("banned_attributes", attributes_kwargs),
-                )
-            if not interface.is_active:
-                return (
-                    sw_name,
-                    room,
-                    "Disabled interface / non-contributing member",
-                    getattr(
-                        RadiusOption.get_cached_value("non_member_vlan"),
-                        "vlan_id",
-                        None,
-                    ),
-                    RadiusOption.get_cached_value("non_member") != RadiusOption.REJECT,
-                    RadiusOption.get_attributes(
-                        "non_member_attributes", attributes_kwargs
-                    ),
-                )
-            # If settings is set to related interface vlan policy based on interface type:
-            if RadiusOption.get_cached_value("radius_general_policy") == "MACHINE":
-                DECISION_VLAN = interface.machine_type.ip_type.vlan.vlan_id
-            if not interface.ipv4:
-                interface.assign_ipv4()
-                return (
-                    sw_name,
-                    room,
-                    "Ok, assigning new ipv4" + extra_log,
-                    DECISION_VLAN,
-                    True,
-                    attributes,
-                )
-            else:
-                return (
-                    sw_name,
-                    room,
-                    "Interface OK" + extra_log,
-                    DECISION_VLAN,
-                    True,
-                    attributes,
-                )
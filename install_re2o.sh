@@ -360,6 +360,7 @@ update_django() {
 
     echo "Applying Django migrations ..."
     python3 manage.py migrate
+    python3 manage.py createcachetable
     echo "Applying Django migrations: Done"
 
     echo "Collecting web frontend statics ..."
@@ -19,9 +19,11 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+from django.db import models
 from rest_framework import serializers
 
 import machines.models as machines
+from machines.zones import ZoneRecords
 from api.serializers import NamespacedHRField, NamespacedHIField, NamespacedHMSerializer
 
 
@@ -338,6 +340,13 @@ class HostMacIpSerializer(serializers.ModelSerializer):
         fields = ("hostname", "extension", "mac_address", "ipv4", "ip_type")
 
 
+class HostMacIpChangeSerializer(HostMacIpSerializer):
+    """Serialize an interface of the DHCP change feed, with its id."""
+
+    class Meta(HostMacIpSerializer.Meta):
+        fields = ("id",) + HostMacIpSerializer.Meta.fields
+
+
 class FirewallPortListSerializer(serializers.ModelSerializer):
     class Meta:
         model = machines.OuverturePort
@@ -482,7 +491,7 @@ class AAAARecordSerializer(serializers.ModelSerializer):
     """
 
     hostname = serializers.CharField(source="domain.name", read_only=True)
-    ipv6 = Ipv6ListSerializer(many=True, read_only=True)
+    ipv6 = Ipv6ListSerializer(many=True, read_only=True, source="active_ipv6")
     ttl = serializers.IntegerField(source="domain.ttl", read_only=True)
 
     class Meta:
@@ -516,7 +525,31 @@ class DNAMERecordSerializer(serializers.ModelSerializer):
         fields = ("alias", "zone", "ttl")
 
 
-class DNSZonesSerializer(serializers.ModelSerializer):
+class DNSZonesListSerializer(serializers.ListSerializer):
+    """Serialize DNS zones with the records of the interfaces fetched once
+    for all of them (see machines.zones.ZoneRecords).
+    """
+
+    def to_representation(self, data):
+        zones = list(data.all() if isinstance(data, models.Manager) else data)
+        records = self.child.zone_records(zones)
+        for zone in zones:
+            zone.zone_records = records[zone.pk]
+        return super(DNSZonesListSerializer, self).to_representation(zones)
+
+
+class ZoneRecordsMixin(object):
+    """Serialize a DNS zone alone, fetching the records of the interfaces
+    if DNSZonesListSerializer did not.
+    """
+
+    def to_representation(self, instance):
+        if not hasattr(instance, "zone_records"):
+            instance.zone_records = self.zone_records([instance])[instance.pk]
+        return super(ZoneRecordsMixin, self).to_representation(instance)
+
+
+class DNSZonesSerializer(ZoneRecordsMixin, serializers.ModelSerializer):
     """Serialize the data about DNS Zones.
     """
 
@@ -527,20 +560,21 @@ class DNSZonesSerializer(serializers.ModelSerializer):
     mx_records = MXRecordSerializer(many=True, source="mx_set")
     txt_records = TXTRecordSerializer(many=True, source="txt_set")
     srv_records = SRVRecordSerializer(many=True, source="srv_set")
-    a_records = ARecordSerializer(many=True, source="get_associated_a_records")
-    aaaa_records = AAAARecordSerializer(many=True, source="get_associated_aaaa_records")
+    a_records = ARecordSerializer(many=True, source="zone_records.a_records")
+    aaaa_records = AAAARecordSerializer(many=True, source="zone_records.aaaa_records")
     cname_records = CNAMERecordSerializer(
-        many=True, source="get_associated_cname_records"
+        many=True, source="zone_records.cname_records"
     )
     dname_records = DNAMERecordSerializer(
         many=True, source="get_associated_dname_records"
     )
     sshfp_records = SSHFPInterfaceSerializer(
-        many=True, source="get_associated_sshfp_records"
+        many=True, source="zone_records.sshfp_records"
     )
 
     class Meta:
         model = machines.Extension
+        list_serializer_class = DNSZonesListSerializer
         fields = (
             "name",
             "soa",
@@ -557,8 +591,13 @@ class DNSZonesSerializer(serializers.ModelSerializer):
             "sshfp_records",
         )
 
+    @staticmethod
+    def zone_records(zones):
+        records = ZoneRecords(extensions=zones)
+        return {zone.pk: records.extension(zone) for zone in zones}
+
 
-class DNSReverseZonesSerializer(serializers.ModelSerializer):
+class DNSReverseZonesSerializer(ZoneRecordsMixin, serializers.ModelSerializer):
     """Serialize the data about DNS Zones.
     """
 
@@ -570,13 +609,14 @@ class DNSReverseZonesSerializer(serializers.ModelSerializer):
     ns_records = NSRecordSerializer(many=True, source="extension.ns_set")
     mx_records = MXRecordSerializer(many=True, source="extension.mx_set")
     txt_records = TXTRecordSerializer(many=True, source="extension.txt_set")
-    ptr_records = ARecordSerializer(many=True, source="get_associated_ptr_records")
+    ptr_records = ARecordSerializer(many=True, source="zone_records.ptr_records")
     ptr_v6_records = AAAARecordSerializer(
-        many=True, source="get_associated_ptr_v6_records"
+        many=True, source="zone_records.ptr_v6_records"
     )
 
     class Meta:
         model = machines.IpType
+        list_serializer_class = DNSZonesListSerializer
         fields = (
             "name",
             "extension",
@@ -590,3 +630,8 @@ class DNSReverseZonesSerializer(serializers.ModelSerializer):
             "prefix_v6",
             "prefix_v6_length",
         )
+
+    @staticmethod
+    def zone_records(zones):
+        records = ZoneRecords(ip_types=zones)
+        return {zone.pk: records.reverse_zone(zone) for zone in zones}
@@ -51,7 +51,9 @@ urls_viewset = [
 ]
 
 urls_view = [
+    (r"machines/services-regen-wait", views.ServiceRegenWaitView),
     (r"machines/hostmacip", views.HostMacIpView),
+    (r"machines/dhcp-changes", views.HostMacIpChangesView),
     (r"machines/firewall-subnet-ports", views.SubnetPortsOpenView),
     (r"machines/firewall-interface-ports", views.InterfacePortsOpenView),
     (r"machines/dns-zones", views.DNSZonesView),
@@ -19,7 +19,13 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from rest_framework import viewsets, generics
+import datetime
+import hashlib
+
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag, urlencode
+from rest_framework import viewsets, generics, status
+from rest_framework.response import Response
 
 from . import serializers
 import machines.models as machines
@@ -218,6 +224,53 @@ class ServiceRegenViewSet(viewsets.ModelViewSet):
         return queryset
 
 
+class ServiceRegenWaitView(generics.GenericAPIView):
+    """Long-polling version of ServiceRegenViewSet: waits until some services
+    need to be regenerated and returns them, or returns an empty list after
+    `?timeout=` seconds. Filtered by `?hostname=` as well.
+
+    A waiting request makes no queries: it is woken up when a regeneration
+    is asked (see machines.models.RegenEvents) or when the regular time of
+    regeneration of a service is reached.
+    """
+
+    serializer_class = serializers.ServiceRegenSerializer
+    DEFAULT_TIMEOUT = 30
+    MAX_TIMEOUT = 120
+
+    def get_queryset(self):
+        queryset = machines.Service_link.objects.select_related(
+            "server__domain"
+        ).select_related("service")
+        if "hostname" in self.request.GET:
+            hostname = self.request.GET["hostname"]
+            queryset = queryset.filter(server__domain__name__iexact=hostname)
+        return queryset
+
+    def get_timeout(self):
+        try:
+            timeout = int(self.request.GET.get("timeout", self.DEFAULT_TIMEOUT))
+        except ValueError:
+            timeout = self.DEFAULT_TIMEOUT
+        return max(0, min(timeout, self.MAX_TIMEOUT))
+
+    def get(self, request, *args, **kwargs):
+        deadline = timezone.now() + datetime.timedelta(seconds=self.get_timeout())
+        while True:
+            version = machines.regen_events.version()
+            links = list(self.get_queryset())
+            due = [link for link in links if link.need_regen]
+            now = timezone.now()
+            if due or now >= deadline:
+                break
+            wake_up = min([link.next_regen for link in links] + [deadline])
+            machines.regen_events.wait(
+                version, max((wake_up - now).total_seconds(), 0)
+            )
+        serializer = self.get_serializer(due, many=True)
+        return Response(serializer.data)
+
+
 class HostMacIpView(generics.ListAPIView):
     """Exposes the associations between hostname, mac address and IPv4 in
     order to build the DHCP lease files.
@@ -229,6 +282,50 @@ class HostMacIpView(generics.ListAPIView):
         return all_active_interfaces()
 
 
+class HostMacIpChangesView(generics.GenericAPIView):
+    """Exposes the changes of the associations between hostname, mac
+    address and IPv4 since the sequence number `?since=`, in order to update
+    the DHCP lease files.
+
+    Returns the sequence number to give next time and the changes, the
+    interfaces to add or update and the ids of those to remove. Without
+    `?since=`, or if the changes since are not known anymore, returns every
+    active interface to add and `full` is true.
+    """
+
+    serializer_class = serializers.HostMacIpChangeSerializer
+
+    def get_queryset(self):
+        return all_active_interfaces()
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.GET["since"])
+        except (KeyError, ValueError):
+            since = None
+        machines.InterfaceChange.prune_periodically()
+        sequence, changes = machines.InterfaceChange.since(since)
+        if changes is None:
+            interfaces = self.get_queryset()
+        else:
+            interfaces = self.get_queryset().filter(pk__in=changes)
+        data = self.get_serializer(interfaces, many=True).data
+        entries = []
+        for entry in data:
+            if changes is None or changes.pop(entry["id"]):
+                action = machines.InterfaceChange.ADD
+            else:
+                action = machines.InterfaceChange.UPDATE
+            entries.append(dict(entry, action=action))
+        for interface_id in changes or ():
+            entries.append(
+                {"id": interface_id, "action": machines.InterfaceChange.REMOVE}
+            )
+        return Response(
+            {"sequence": sequence, "full": changes is None, "changes": entries}
+        )
+
+
 class SubnetPortsOpenView(generics.ListAPIView):
     queryset = machines.IpType.objects.all()
     serializer_class = serializers.SubnetPortsOpenSerializer
@@ -238,7 +335,44 @@ class InterfacePortsOpenView(generics.ListAPIView):
     queryset = machines.Interface.objects.filter(port_lists__isnull=False).distinct()
     serializer_class = serializers.InterfacePortsOpenSerializer
 
-class DNSZonesView(generics.ListAPIView):
+class DNSZonesMixin(object):
+    """Filter of the DNS zones views by name with `?zones=` (comma separated
+    names) and ETag made of the version stamps of the zones (see
+    machines.models.DNSZoneMixin). A request whose If-None-Match matches
+    gets a 304 response without the zones being built.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super(DNSZonesMixin, self).filter_queryset(queryset)
+        if "zones" in self.request.GET:
+            queryset = queryset.filter(name__in=self.request.GET["zones"].split(","))
+        return queryset
+
+    def get_etag(self, queryset):
+        """The ETag of the response, made of the versions of the zones and
+        of the query parameters (page, page_size...) which select them."""
+        versions = queryset.model.dns_versions(
+            queryset.prefetch_related(None).values_list("pk", flat=True)
+        )
+        content = ";".join("%s:%s" % version for version in sorted(versions.items()))
+        params = urlencode(sorted(self.request.GET.lists()), doseq=True)
+        return quote_etag(
+            hashlib.sha1(
+                "|".join((queryset.model.__name__, params, content)).encode("utf-8")
+            ).hexdigest()
+        )
+
+    def list(self, request, *args, **kwargs):
+        etag = self.get_etag(self.filter_queryset(self.get_queryset()))
+        etags = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+        if etag in etags or etags == ["*"]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        response = super(DNSZonesMixin, self).list(request, *args, **kwargs)
+        response["ETag"] = etag
+        return response
+
+
+class DNSZonesView(DNSZonesMixin, generics.ListAPIView):
     """Exposes the detailed information about each extension (hostnames,
     IPs, DNS records, etc.) in order to build the DNS zone files.
     """
@@ -258,7 +392,7 @@ class DNSZonesView(generics.ListAPIView):
     serializer_class = serializers.DNSZonesSerializer
 
 
-class DNSReverseZonesView(generics.ListAPIView):
+class DNSReverseZonesView(DNSZonesMixin, generics.ListAPIView):
     """Exposes the detailed information about each extension (hostnames,
     IPs, DNS records, etc.) in order to build the DNS zone files.
     """
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machines', '0002_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InterfaceChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('interface_id', models.PositiveIntegerField()),
+                ('action', models.CharField(choices=[('add', 'add'), ('update', 'update'), ('remove', 'remove')], default='update', max_length=8)),
+                ('date', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'interface change',
+                'verbose_name_plural': 'interface changes',
+            },
+        ),
+    ]
@@ -30,14 +30,17 @@ from __future__ import unicode_literals
 import base64
 import hashlib
 import re
+import threading
+import time
 from datetime import timedelta
 from ipaddress import IPv6Address
 from itertools import chain
 
+from django.core.cache import cache
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.db.models import Q
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
 from django.forms import ValidationError
 from django.utils import timezone
@@ -59,6 +62,7 @@ from netaddr import (
 import preferences.models
 import users.models
 import users.signals
+from re2o.base import bump_cache_version, get_cache_version
 from re2o.field_permissions import FieldPermissionModelMixin
 from re2o.mixins import AclMixin, RevMixin
 
@@ -290,6 +294,7 @@ class Machine(RevMixin, FieldPermissionModelMixin, AclMixin, models.Model):
         """Mass delete for machine queryset."""
         from topologie.models import AccessPoint
 
+        InterfaceChange.record_machines(machine_queryset, InterfaceChange.REMOVE)
         Domain.objects.filter(
             cname__interface_parent__machine__in=machine_queryset
         )._raw_delete(machine_queryset.db)
@@ -411,7 +416,34 @@ class MachineType(RevMixin, AclMixin, models.Model):
         return self.name
 
 
-class IpType(RevMixin, AclMixin, models.Model):
+class DNSZoneMixin(object):
+    """Version stamp of the content of the DNS zones of a model, a forward
+    zone for Extension and a reverse zone for IpType. It is bumped by the
+    signals of the objects which make the zones (see bump_domains_dns_zones
+    and the functions nearby) and used as the ETag of the zones by the API.
+    """
+
+    @classmethod
+    def dns_version_key(cls, pk):
+        return "dns_zone_version_%s_%s" % (cls.__name__.lower(), pk)
+
+    @classmethod
+    def dns_versions(cls, pks):
+        """The version stamps of the zones of the given ids, as a dict."""
+        return {pk: get_cache_version(cls.dns_version_key(pk)) for pk in pks}
+
+    @classmethod
+    def bump_dns_versions(cls, pks):
+        """Bump the version stamps of the zones of the given ids."""
+        for pk in set(pks):
+            bump_cache_version(cls.dns_version_key(pk))
+
+    @property
+    def dns_version(self):
+        return get_cache_version(self.dns_version_key(self.pk))
+
+
+class IpType(DNSZoneMixin, RevMixin, AclMixin, models.Model):
     """IP type, defining an IP range and assigned to machine types.
 
     Attributes:
@@ -764,11 +796,43 @@ class Nas(RevMixin, AclMixin, models.Model):
     )
     autocapture_mac = models.BooleanField(default=False)
 
+    # Cache key of the version stamp of the NAS index kept by the freeradius
+    # backends, see freeradius_utils/auth.py
+    INDEX_VERSION_KEY = "nas_index_version"
+
     class Meta:
         permissions = (("view_nas", _("Can view a NAS device object")),)
         verbose_name = _("NAS device")
         verbose_name_plural = _("NAS devices")
 
+    @classmethod
+    def refresh_index(cls):
+        """Ask the freeradius backends to rebuild their NAS index."""
+        bump_cache_version(cls.INDEX_VERSION_KEY)
+
+    @classmethod
+    def is_nas_interface(cls, *interface_ids):
+        """Check if one of the given interfaces is the interface of a NAS
+        device.
+
+        Args:
+            interface_ids: the primary keys of the interfaces to check.
+        """
+        return cls.objects.filter(nas_type__interface__in=interface_ids).exists()
+
+    @classmethod
+    def is_nas_domain(cls, *domain_ids):
+        """Check if one of the given domains is the domain of a NAS device
+        or an alias of it.
+
+        Args:
+            domain_ids: the primary keys of the domains to check.
+        """
+        return cls.objects.filter(
+            Q(nas_type__interface__domain__in=domain_ids)
+            | Q(nas_type__interface__domain__related_domain__in=domain_ids)
+        ).exists()
+
     def __str__(self):
         return self.name
 
@@ -865,7 +929,7 @@ class SOA(RevMixin, AclMixin, models.Model):
         )[0].pk
 
 
-class Extension(RevMixin, AclMixin, models.Model):
+class Extension(DNSZoneMixin, RevMixin, AclMixin, models.Model):
     """Extension.
 
     DNS extension such as example.org.
@@ -1492,6 +1556,7 @@ class Interface(RevMixin, AclMixin, FieldPermissionModelMixin, models.Model):
             interface_list: the list of interfaces to be updated.
         """
         with transaction.atomic(), reversion.create_revision():
+            InterfaceChange.record(interface_list.values_list("pk", flat=True))
             interface_list.update(ipv4=None)
             reversion.set_comment("IPv4 unassignment")
 
@@ -1710,6 +1775,33 @@ class Interface(RevMixin, AclMixin, FieldPermissionModelMixin, models.Model):
     def __init__(self, *args, **kwargs):
         super(Interface, self).__init__(*args, **kwargs)
         self.field_permissions = {"machine": self.can_change_machine}
+        self.__original_machine_type_id = self.machine_type_id
+        self.__original_ipv4_id = self.ipv4_id
+        self.__original_machine_id = self.machine_id
+
+    def dns_changed(self):
+        """Check if the interface was edited in a way which changes its DNS
+        records: its IPv4 address, machine type or machine. The changes of
+        its domain, IPv6 addresses and machine are handled by their own
+        signals."""
+        return (
+            self.ipv4_id != self.__original_ipv4_id
+            or self.machine_type_id != self.__original_machine_type_id
+            or self.machine_id != self.__original_machine_id
+        )
+
+    def was_nas_interface(self):
+        """Check if the interface is, or was before being edited, the
+        interface of a NAS device."""
+        machine_types = [
+            machine_type
+            for machine_type in (
+                self.machine_type_id,
+                self.__original_machine_type_id,
+            )
+            if machine_type is not None
+        ]
+        return Nas.objects.filter(nas_type__in=machine_types).exists()
 
     def __str__(self):
         try:
@@ -1719,6 +1811,134 @@ class Interface(RevMixin, AclMixin, FieldPermissionModelMixin, models.Model):
         return str(domain)
 
 
+class InterfaceChange(models.Model):
+    """A change of an interface which may change the DHCP leases: its
+    creation, deletion, address, name, machine or the access of its owner.
+    The id is the sequence number of the change, the clients of
+    machines.api.views.HostMacIpChangesView ask for the changes since the
+    last sequence number they got.
+
+    Attributes:
+        interface_id: the id of the interface, which may have been deleted.
+        action: the kind of change, ADD, UPDATE or REMOVE.
+        date: the date of the change.
+    """
+
+    ADD = "add"
+    UPDATE = "update"
+    REMOVE = "remove"
+    ACTIONS = ((ADD, ADD), (UPDATE, UPDATE), (REMOVE, REMOVE))
+
+    # The changes are kept for that long, the clients asking for older ones
+    # get a full snapshot
+    RETENTION = timedelta(days=7)
+    # A change is assumed committed that long after it was recorded: the
+    # sequence numbers are allocated before the commit, so a change may
+    # become visible after a change with a greater number
+    SETTLE_TIME = timedelta(minutes=1)
+    # The feed is polled by every DHCP server, the old changes are pruned at
+    # most that often
+    PRUNE_INTERVAL = timedelta(hours=1)
+    PRUNE_KEY = "interface_changes_pruned"
+
+    id = models.BigAutoField(primary_key=True)
+    interface_id = models.PositiveIntegerField()
+    action = models.CharField(max_length=8, choices=ACTIONS, default=UPDATE)
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = _("interface change")
+        verbose_name_plural = _("interface changes")
+
+    @classmethod
+    def record(cls, interface_ids, action=UPDATE, dns=True):
+        """Record a change of the interfaces of the given ids, and bump their
+        DNS zones which depend on the same changes unless dns is False."""
+        interface_ids = set(interface_ids)
+        cls.objects.bulk_create(
+            [cls(interface_id=pk, action=action) for pk in interface_ids],
+            batch_size=1000,
+        )
+        if dns:
+            bump_interfaces_dns_zones(interface_ids)
+
+    @classmethod
+    def record_machines(cls, machines, action=UPDATE):
+        """Record a change of the interfaces of a queryset of machines."""
+        cls.record(
+            Interface.objects.filter(machine__in=machines).values_list(
+                "pk", flat=True
+            ),
+            action,
+        )
+
+    @classmethod
+    def record_users(cls, users):
+        """Record a change of the interfaces of a queryset of users."""
+        cls.record(
+            Interface.objects.filter(machine__user__in=users).values_list(
+                "pk", flat=True
+            )
+        )
+
+    @classmethod
+    def prune(cls):
+        """Delete the changes older than RETENTION, but the last one which
+        holds the sequence number."""
+        last = cls.objects.order_by("-id").values_list("id", flat=True).first()
+        if last is not None:
+            cls.objects.filter(
+                id__lt=last, date__lt=timezone.now() - cls.RETENTION
+            ).delete()
+
+    @classmethod
+    def prune_periodically(cls):
+        """Prune the changes if they were not pruned for PRUNE_INTERVAL."""
+        if cache.add(cls.PRUNE_KEY, True, cls.PRUNE_INTERVAL.total_seconds()):
+            cls.prune()
+
+    @classmethod
+    def since(cls, sequence):
+        """The interfaces changed since the change of number sequence.
+
+        Args:
+            sequence: the last sequence number of the client, None if it
+                has none.
+
+        Returns:
+            (sequence, changes): the sequence number to give next time and
+            a dict of the ids of the changed interfaces to True if they
+            were created meanwhile. changes is None if the changes since
+            sequence are not known anymore, then a full snapshot is needed.
+        """
+        bounds = cls.objects.aggregate(
+            oldest=models.Min("id"), last=models.Max("id")
+        )
+        settled = (
+            cls.objects.filter(date__lte=timezone.now() - cls.SETTLE_TIME)
+            .aggregate(settled=models.Max("id"))["settled"]
+        )
+        if settled is None:
+            settled = (bounds["oldest"] or 1) - 1
+        if (
+            sequence is None
+            or sequence < (bounds["oldest"] or 1) - 1
+            or sequence > (bounds["last"] or 0)
+        ):
+            return settled, None
+        changes = {}
+        for interface_id, action in cls.objects.filter(id__gt=sequence).values_list(
+            "interface_id", "action"
+        ):
+            changes[interface_id] = changes.get(interface_id, False) or (
+                action == cls.ADD
+            )
+        return settled, changes
+
+    def __str__(self):
+        return "%s %s %s" % (self.id, self.action, self.interface_id)
+
+
 class Ipv6List(RevMixin, AclMixin, FieldPermissionModelMixin, models.Model):
     """IPv6 addresses list.
 
@@ -2331,9 +2551,10 @@ class Service(RevMixin, AclMixin, models.Model):
 
     def ask_regen(self):
         """Set the demand for regen to True for the current Service (self)."""
-        Service_link.objects.filter(service=self).exclude(asked_regen=True).update(
+        if Service_link.objects.filter(service=self).exclude(asked_regen=True).update(
             asked_regen=True
-        )
+        ):
+            regen_events.notify()
         return
 
     def process_link(self, servers):
@@ -2355,16 +2576,160 @@ class Service(RevMixin, AclMixin, models.Model):
         return str(self.service_type)
 
 
+def bump_extensions_dns_zones(extension_ids):
+    """Bump the DNS zones of the extensions of the given ids, with the
+    reverse zones sharing their SOA, NS, MX and TXT records."""
+    extension_ids = set(extension_ids)
+    Extension.bump_dns_versions(extension_ids)
+    IpType.bump_dns_versions(
+        IpType.objects.filter(extension__in=extension_ids).values_list(
+            "pk", flat=True
+        )
+    )
+
+
+def bump_domains_dns_zones(domains):
+    """Bump the DNS zones holding the records of, or pointing to, a
+    queryset of domains."""
+    extension_ids = set()
+    for lookup in (
+        "domain__in",
+        "domain__cname__in",
+        "mx__name__in",
+        "ns__ns__in",
+        "srv__target__in",
+        "iptype__machinetype__interface__domain__in",
+    ):
+        extension_ids.update(
+            Extension.objects.filter(**{lookup: domains}).values_list(
+                "pk", flat=True
+            )
+        )
+    Extension.bump_dns_versions(extension_ids)
+    IpType.bump_dns_versions(
+        IpType.objects.filter(machinetype__interface__domain__in=domains)
+        .values_list("pk", flat=True)
+    )
+
+
+def bump_interfaces_dns_zones(interface_ids):
+    """Bump the DNS zones holding the records of the interfaces of the given
+    ids (A, AAAA, PTR, SSHFP and the records pointing to their domains)."""
+    interface_ids = list(interface_ids)
+    if not interface_ids:
+        return
+    bump_domains_dns_zones(Domain.objects.filter(interface_parent__in=interface_ids))
+    Extension.bump_dns_versions(
+        Extension.objects.filter(
+            iptype__machinetype__interface__in=interface_ids
+        ).values_list("pk", flat=True)
+    )
+    IpType.bump_dns_versions(
+        IpType.objects.filter(machinetype__interface__in=interface_ids).values_list(
+            "pk", flat=True
+        )
+    )
+
+
+def bump_all_dns_zones():
+    """Bump every DNS zone."""
+    Extension.bump_dns_versions(Extension.objects.values_list("pk", flat=True))
+    IpType.bump_dns_versions(IpType.objects.values_list("pk", flat=True))
+
+
+class RegenEvents(object):
+    """Wake up the requests waiting for a regeneration to be asked (see
+    machines.api.views.ServiceRegenWaitView).
+
+    The regenerations asked in this process wake them up at once. Those
+    asked in other processes are seen through a version stamp in the cache,
+    checked every POLL_INTERVAL seconds, if the cache is shared.
+    """
+
+    VERSION_KEY = "service_regen_version"
+    POLL_INTERVAL = 1
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.local_version = 0
+
+    def notify(self):
+        """Signal that a regeneration was asked."""
+        bump_cache_version(self.VERSION_KEY)
+        with self.condition:
+            self.local_version += 1
+            self.condition.notify_all()
+
+    def version(self):
+        """The current version, to give to wait."""
+        return self.local_version, get_cache_version(self.VERSION_KEY)
+
+    def wait(self, version, timeout):
+        """Wait at most timeout seconds for a regeneration asked after
+        version was read.
+
+        Returns:
+            True if a regeneration was asked
+        """
+        end = time.monotonic() + timeout
+        while True:
+            if self.version() != version:
+                return True
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            with self.condition:
+                if self.local_version == version[0]:
+                    self.condition.wait(min(remaining, self.POLL_INTERVAL))
+
+
+regen_events = RegenEvents()
+
+
+class RegenRequests(object):
+    """The services whose regeneration was asked during a transaction,
+    asked at once when it is committed (see regen)."""
+
+    def __init__(self):
+        self.services = set()
+
+    def __call__(self):
+        ask_regen(self.services)
+
+
+def ask_regen(services):
+    """Ask regeneration for the given services, with a single query.
+
+    Args:
+        services: the types of the services to be regenerated.
+    """
+    if Service_link.objects.filter(service__service_type__in=services).exclude(
+        asked_regen=True
+    ).update(asked_regen=True):
+        regen_events.notify()
+
+
 def regen(service):
     """Ask regeneration for the given service.
 
+    Inside a transaction, the services are collected and asked at once when
+    it is committed, so that the many signals of an edition or a mass
+    operation cost a single query. They are not asked if it is rolled back.
+
     Args:
         service: the service to be regenerated.
     """
-    obj = Service.objects.filter(service_type=service)
-    if obj:
-        obj[0].ask_regen()
-    return
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        ask_regen([service])
+        return
+    for _savepoints, callback in connection.run_on_commit:
+        if isinstance(callback, RegenRequests):
+            callback.services.add(service)
+            return
+    requests = RegenRequests()
+    requests.services.add(service)
+    transaction.on_commit(requests)
 
 
 class Service_link(RevMixin, AclMixin, models.Model):
@@ -2422,6 +2787,15 @@ class Service_link(RevMixin, AclMixin, models.Model):
         self.asked_regen = value
         self.save()
 
+    @property
+    def next_regen(self):
+        """The date after which need_regen becomes true, if nothing
+        changes meanwhile."""
+        next_regen = self.last_regen + self.service.regular_time_regen
+        if self.asked_regen:
+            next_regen = min(next_regen, self.last_regen + self.service.min_time_regen)
+        return next_regen
+
     def __str__(self):
         return str(self.server) + " " + str(self.service)
 
@@ -2541,7 +2915,9 @@ class OuverturePort(RevMixin, AclMixin, models.Model):
 @receiver(post_save, sender=Machine)
 def machine_post_save(**kwargs):
     """Synchronise LDAP and regen firewall/DHCP after a machine is edited."""
-    user = kwargs["instance"].user
+    machine = kwargs["instance"]
+    InterfaceChange.record_machines([machine])
+    user = machine.user
     users.signals.synchronise.send(sender=users.models.User, instance=user, base=False, access_refresh=False, mac_refresh=True)
     regen("dhcp")
     regen("mac_ip_list")
@@ -2563,7 +2939,14 @@ def interface_post_save(**kwargs):
     and update associated domains
     """
     interface = kwargs["instance"]
+    InterfaceChange.record(
+        [interface.pk],
+        InterfaceChange.ADD if kwargs["created"] else InterfaceChange.UPDATE,
+        dns=kwargs["created"] or interface.dns_changed(),
+    )
     interface.sync_ipv6()
+    if interface.was_nas_interface():
+        Nas.refresh_index()
     user = interface.machine.user
     users.signals.synchronise.send(sender=users.models.User, instance=user, base=False, access_refresh=False, mac_refresh=True)
     # Regen services
@@ -2575,11 +2958,29 @@ def interface_post_save(**kwargs):
         domain.save()
 
 
+@receiver(pre_save, sender=Interface)
+def interface_pre_save(**kwargs):
+    """Bump the DNS zones an interface is about to leave, if it is edited in
+    a way which changes its DNS records."""
+    interface = kwargs["instance"]
+    if interface.pk and interface.dns_changed():
+        bump_interfaces_dns_zones([interface.pk])
+
+
+@receiver(pre_delete, sender=Interface)
+def interface_pre_delete(**kwargs):
+    """Bump the DNS zones an interface is about to leave."""
+    bump_interfaces_dns_zones([kwargs["instance"].pk])
+
+
 @receiver(post_delete, sender=Interface)
 def interface_post_delete(**kwargs):
     """Synchronise LDAP and regen firewall/DHCP after an interface is deleted.
     """
     interface = kwargs["instance"]
+    InterfaceChange.record([interface.pk], InterfaceChange.REMOVE)
+    if interface.was_nas_interface():
+        Nas.refresh_index()
     user = interface.machine.user
     users.signals.synchronise.send(sender=users.models.User, instance=user, base=False, access_refresh=False, mac_refresh=True)
 
@@ -2590,10 +2991,18 @@ def iptype_post_save(**kwargs):
     iptype = kwargs["instance"]
     iptype.gen_ip_range()
     iptype.check_replace_prefixv6()
+    IpType.bump_dns_versions([iptype.pk])
     for machinetype in iptype.all_machine_types():
         machinetype.save()
 
 
+@receiver(post_save, sender=Vlan)
+def vlan_post_save(**_kwargs):
+    """Compile the RADIUS policy again after a VLAN is edited, its VLAN ID
+    may be used by a decision."""
+    preferences.models.RadiusOption.refresh_policy()
+
+
 @receiver(post_save, sender=MachineType)
 def machinetype_post_save(**kwargs):
     """Update the interfaces after the machine type is changed (change the
@@ -2601,24 +3010,83 @@ def machinetype_post_save(**kwargs):
     """
     machinetype = kwargs["instance"]
     machinetype.update_domains()
+    InterfaceChange.record(
+        machinetype.all_interfaces().values_list("pk", flat=True)
+    )
+    # The interfaces may have left the zones of the previous IP type
+    bump_all_dns_zones()
+
+
+@receiver(post_save, sender=Nas)
+def nas_post_save(**_kwargs):
+    """Refresh the NAS index of the freeradius backends after a NAS device is
+    edited."""
+    Nas.refresh_index()
+
+
+@receiver(post_delete, sender=Nas)
+def nas_post_delete(**_kwargs):
+    """Refresh the NAS index of the freeradius backends after a NAS device is
+    deleted."""
+    Nas.refresh_index()
 
 
 @receiver(post_save, sender=Domain)
-def domain_post_save(**_kwargs):
-    """Regenerate the DNS after a domain is edited."""
+def domain_post_save(**kwargs):
+    """Regenerate the DNS after a domain is edited and refresh the NAS index
+    if the domain names a NAS device or is an alias of it."""
     regen("dns")
+    domain = kwargs["instance"]
+    bump_domains_dns_zones(Domain.objects.filter(pk=domain.pk))
+    if domain.interface_parent_id:
+        InterfaceChange.record([domain.interface_parent_id])
+    if Nas.is_nas_domain(domain.pk):
+        Nas.refresh_index()
+
+
+@receiver(pre_save, sender=Domain)
+@receiver(pre_delete, sender=Domain)
+def domain_pre_change(**kwargs):
+    """Bump the DNS zones a domain is about to leave, and refresh the NAS
+    index if it names a NAS device or is an alias of it before the change."""
+    domain = kwargs["instance"]
+    if domain.pk:
+        bump_domains_dns_zones(Domain.objects.filter(pk=domain.pk))
+        if Nas.is_nas_domain(domain.pk):
+            Nas.refresh_index()
 
 
 @receiver(post_delete, sender=Domain)
-def domain_post_delete(**_kwargs):
-    """Regenerate the DNS after a domain is deleted."""
+def domain_post_delete(**kwargs):
+    """Regenerate the DNS after a domain is deleted and refresh the NAS index
+    if the domain named a NAS device or was an alias of it."""
     regen("dns")
+    domain = kwargs["instance"]
+    if domain.interface_parent_id and Nas.is_nas_interface(domain.interface_parent_id):
+        Nas.refresh_index()
+    elif domain.cname_id and Nas.is_nas_domain(domain.cname_id):
+        Nas.refresh_index()
+
+
+@receiver(post_save, sender=IpList)
+def iplist_post_save(**kwargs):
+    """Refresh the NAS index after the IPv4 address of a NAS device is
+    edited. An address in use can't be deleted, and moving it to another
+    interface is handled by interface_post_save."""
+    if Nas.objects.filter(nas_type__interface__ipv4=kwargs["instance"].pk).exists():
+        Nas.refresh_index()
 
 
 @receiver(post_save, sender=Extension)
-def extension_post_save(**_kwargs):
+def extension_post_save(**kwargs):
     """Regenerate the DNS after an extension is edited."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].pk])
+    InterfaceChange.record(
+        Interface.objects.filter(domain__extension=kwargs["instance"]).values_list(
+            "pk", flat=True
+        )
+    )
 
 
 @receiver(post_delete, sender=Extension)
@@ -2628,72 +3096,122 @@ def extension_post_delete(**_kwargs):
 
 
 @receiver(post_save, sender=SOA)
-def soa_post_save(**_kwargs):
+def soa_post_save(**kwargs):
     """Regenerate the DNS after a SOA record is edited."""
     regen("dns")
+    bump_extensions_dns_zones(
+        Extension.objects.filter(soa=kwargs["instance"]).values_list("pk", flat=True)
+    )
 
 
 @receiver(post_delete, sender=SOA)
-def soa_post_delete(**_kwargs):
+def soa_post_delete(**kwargs):
     """Regenerate the DNS after a SOA record is deleted."""
     regen("dns")
+    bump_extensions_dns_zones(
+        Extension.objects.filter(soa=kwargs["instance"]).values_list("pk", flat=True)
+    )
 
 
 @receiver(post_save, sender=Mx)
-def mx_post_save(**_kwargs):
+def mx_post_save(**kwargs):
     """Regenerate the DNS after an MX record is edited."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].zone_id])
 
 
 @receiver(post_delete, sender=Mx)
-def mx_post_delete(**_kwargs):
+def mx_post_delete(**kwargs):
     """Regenerate the DNS after an MX record is deleted."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].zone_id])
 
 
 @receiver(post_save, sender=Ns)
-def ns_post_save(**_kwargs):
+def ns_post_save(**kwargs):
     """Regenerate the DNS after an NS record is edited."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].zone_id])
 
 
 @receiver(post_delete, sender=Ns)
-def ns_post_delete(**_kwargs):
+def ns_post_delete(**kwargs):
     """Regenerate the DNS after an NS record is deleted."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].zone_id])
 
 
 @receiver(post_save, sender=Txt)
-def text_post_save(**_kwargs):
+def text_post_save(**kwargs):
     """Regenerate the DNS after a TXT record is edited."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].zone_id])
 
 
 @receiver(post_delete, sender=Txt)
-def text_post_delete(**_kwargs):
+def text_post_delete(**kwargs):
     """Regenerate the DNS after a TXT record is deleted."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].zone_id])
 
 
 @receiver(post_save, sender=DName)
-def dname_post_save(**_kwargs):
+def dname_post_save(**kwargs):
     """Regenerate the DNS after a DNAME record is edited."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].zone_id])
 
 
 @receiver(post_delete, sender=DName)
-def dname_post_delete(**_kwargs):
+def dname_post_delete(**kwargs):
     """Regenerate the DNS after a DNAME record is deleted."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].zone_id])
 
 
 @receiver(post_save, sender=Srv)
-def srv_post_save(**_kwargs):
+def srv_post_save(**kwargs):
     """Regenerate the DNS after an SRV record is edited."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].extension_id])
 
 
 @receiver(post_delete, sender=Srv)
-def srv_post_delete(**_kwargs):
+def srv_post_delete(**kwargs):
     """Regenerate the DNS after an SRV record is deleted."""
     regen("dns")
+    bump_extensions_dns_zones([kwargs["instance"].extension_id])
+
+
+@receiver(pre_save, sender=Mx)
+@receiver(pre_save, sender=Ns)
+@receiver(pre_save, sender=Txt)
+@receiver(pre_save, sender=DName)
+@receiver(pre_save, sender=Srv)
+def dns_record_pre_save(sender, **kwargs):
+    """Bump the DNS zone a record is about to be moved from."""
+    record = kwargs["instance"]
+    if record.pk:
+        zone = "extension_id" if sender is Srv else "zone_id"
+        bump_extensions_dns_zones(
+            sender.objects.filter(pk=record.pk).values_list(zone, flat=True)
+        )
+
+
+@receiver(post_save, sender=SshFp)
+@receiver(post_delete, sender=SshFp)
+def sshfp_post_change(**kwargs):
+    """Bump the DNS zones of the interfaces of a machine after one of its
+    SSH fingerprints is edited or deleted."""
+    bump_interfaces_dns_zones(
+        Interface.objects.filter(machine_id=kwargs["instance"].machine_id)
+        .values_list("pk", flat=True)
+    )
+
+
+@receiver(post_save, sender=Ipv6List)
+@receiver(post_delete, sender=Ipv6List)
+def ipv6list_post_change(**kwargs):
+    """Bump the DNS zones of an interface after one of its IPv6 addresses is
+    edited or deleted."""
+    bump_interfaces_dns_zones([kwargs["instance"].interface_id])
@@ -0,0 +1,131 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Records of the interfaces in the DNS zones.
+
+Extension.get_associated_*_records and IpType.get_associated_ptr*_records
+run the active interfaces filter again for each zone, and Interface.ipv6
+makes a query per interface. ZoneRecords fetches the active interfaces with
+their domains, addresses and SSH fingerprints, and the aliases, in a fixed
+number of queries and groups them by zone, with the same rules.
+"""
+
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db.models import Prefetch
+
+from machines.models import Domain, Ipv6List
+from preferences.models import OptionalMachine
+from re2o.utils import all_active_assigned_interfaces, all_active_interfaces
+
+
+class ZoneRecords(object):
+    """The records of the interfaces, by zone.
+
+    Attributes:
+        extensions: the extensions whose records are needed, all if None
+        ip_types: the IP types whose records are needed, all if None. Only
+            the records of the forward zones are fetched if extensions is
+            given, and only those of the reverse zones if ip_types is.
+        forward: dict of the records of each extension id, see extension
+        reverse: dict of the records of each IP type id, see reverse_zone
+    """
+
+    def __init__(self, extensions=None, ip_types=None):
+        self.extensions = extensions
+        self.ip_types = ip_types
+        self.forward = defaultdict(lambda: defaultdict(list))
+        self.reverse = defaultdict(lambda: defaultdict(list))
+        self.build()
+
+    @staticmethod
+    def active_ipv6():
+        """The IPv6 addresses to publish, as Interface.ipv6, None if there
+        are none."""
+        ipv6_mode = OptionalMachine.get_cached_value("ipv6_mode")
+        if ipv6_mode == "SLAAC":
+            return Ipv6List.objects.filter(active=True)
+        elif ipv6_mode == "DHCPV6":
+            return Ipv6List.objects.filter(active=True).filter(slaac_ip=False)
+        return None
+
+    def build(self):
+        ipv6 = self.active_ipv6()
+        interfaces = (
+            all_active_interfaces()
+            .select_related("machine_type__ip_type")
+            .prefetch_related("machine__sshfp_set")
+        )
+        if self.extensions is not None:
+            interfaces = interfaces.filter(
+                machine_type__ip_type__extension__in=self.extensions
+            )
+        if self.ip_types is not None:
+            interfaces = interfaces.filter(machine_type__ip_type__in=self.ip_types)
+        if ipv6 is not None:
+            interfaces = interfaces.prefetch_related(
+                Prefetch("ipv6list", queryset=ipv6, to_attr="active_ipv6")
+            )
+        for interface in interfaces:
+            if ipv6 is None:
+                interface.active_ipv6 = []
+            ip_type = interface.machine_type.ip_type
+            forward = self.forward[ip_type.extension_id]
+            reverse = self.reverse[ip_type.pk]
+            forward["aaaa_records"].append(interface)
+            reverse["ptr_v6_records"].append(interface)
+            if interface.ipv4_id is None:
+                continue
+            forward["a_records"].append(interface)
+            reverse["ptr_records"].append(interface)
+            if interface.machine.sshfp_set.all():
+                forward["sshfp_records"].append(interface)
+        if self.ip_types is not None:
+            return
+        aliases = Domain.objects.filter(
+            cname__interface_parent__in=all_active_assigned_interfaces()
+        ).select_related("cname__extension")
+        if self.extensions is not None:
+            aliases = aliases.filter(extension__in=self.extensions)
+        for alias in aliases:
+            self.forward[alias.extension_id]["cname_records"].append(alias)
+
+    def extension(self, extension):
+        """The A, AAAA, CNAME and SSHFP records of an extension, as
+        Extension.get_associated_*_records."""
+        records = self.forward[extension.pk]
+        return {
+            "a_records": records["a_records"],
+            "aaaa_records": records["aaaa_records"],
+            "cname_records": records["cname_records"],
+            "sshfp_records": records["sshfp_records"],
+        }
+
+    def reverse_zone(self, ip_type):
+        """The PTR records of the reverse zone of an IP type, as
+        IpType.get_associated_ptr*_records."""
+        records = self.reverse[ip_type.pk]
+        return {
+            "ptr_records": records["ptr_records"] if ip_type.reverse_v4 else None,
+            "ptr_v6_records": (
+                records["ptr_v6_records"] if ip_type.reverse_v6 else None
+            ),
+        }
@@ -26,11 +26,12 @@ etc.
 """
 from __future__ import unicode_literals
 import os
+from collections import namedtuple
 
 from django.utils.functional import cached_property
 from django.utils import timezone
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.core.cache import cache
 from django.forms import ValidationError
@@ -40,6 +41,7 @@ import machines.models
 
 from re2o.mixins import AclMixin, RevMixin
 from re2o.aes_field import AESEncryptedField
+from re2o.base import get_cache_version, bump_cache_version
 
 from datetime import timedelta
 
@@ -1001,6 +1003,11 @@ class RadiusOption(AclMixin, PreferencesModel):
         help_text=_("Answer attributes for accepted users."),
     )
 
+    # Cache key of the version stamp of the compiled RADIUS policy
+    POLICY_VERSION_KEY = "radius_policy_version"
+    # Process-local (version, RadiusPolicy) couple, see get_policy
+    _policy = (None, None)
+
     @classmethod
     def get_attributes(cls, name, attribute_kwargs={}):
         return (
@@ -1008,6 +1015,145 @@ class RadiusOption(AclMixin, PreferencesModel):
             for attribute in cls.get_cached_value(name).all()
         )
 
+    @classmethod
+    def compile_policy(cls):
+        """Build a RadiusPolicy snapshot of the RADIUS preferences, with the
+        VLANs, the decisions and the attributes of every outcome."""
+        options = (
+            cls.objects.select_related(
+                "vlan_decision_ok",
+                "banned_vlan",
+                "non_member_vlan",
+                "unknown_port_vlan",
+                "unknown_room_vlan",
+                "unknown_machine_vlan",
+            )
+            .prefetch_related(
+                "ok_attributes",
+                "banned_attributes",
+                "non_member_attributes",
+                "unknown_port_attributes",
+                "unknown_room_attributes",
+                "unknown_machine_attributes",
+            )
+            .first()
+        )
+        if not options:
+            options, _created = cls.objects.get_or_create()
+
+        def decision(vlan, accept, attributes):
+            return RadiusDecision(
+                getattr(vlan, "vlan_id", None),
+                accept,
+                tuple(
+                    (str(attribute.attribute), str(attribute.value))
+                    for attribute in attributes.all()
+                ),
+            )
+
+        def policy_decision(name):
+            return decision(
+                getattr(options, name + "_vlan"),
+                getattr(options, name) != cls.REJECT,
+                getattr(options, name + "_attributes"),
+            )
+
+        return RadiusPolicy(
+            general_policy=options.radius_general_policy,
+            ok=decision(options.vlan_decision_ok, True, options.ok_attributes),
+            banned=policy_decision("banned"),
+            non_member=policy_decision("non_member"),
+            unknown_port=policy_decision("unknown_port"),
+            unknown_room=policy_decision("unknown_room"),
+            unknown_machine=policy_decision("unknown_machine"),
+        )
+
+    @classmethod
+    def get_policy(cls):
+        """Get the compiled RADIUS policy.
+
+        The policy is kept in the process memory and compiled again only when
+        the RADIUS preferences or attributes have been edited.
+        """
+        version = get_cache_version(cls.POLICY_VERSION_KEY)
+        policy_version, policy = cls._policy
+        if policy_version != version:
+            policy = cls.compile_policy()
+            cls._policy = (version, policy)
+        return policy
+
+    @classmethod
+    def refresh_policy(cls):
+        """Ask every process to compile the RADIUS policy again."""
+        bump_cache_version(cls.POLICY_VERSION_KEY)
+
+
+class RadiusDecision(
+    namedtuple("RadiusDecision", ("vlan_id", "accept", "attribute_templates"))
+):
+    """Outcome of the RADIUS policy for a kind of request.
+
+    Attributes:
+        vlan_id: the VLAN ID to assign, None if not set.
+        accept: whether the request is accepted.
+        attribute_templates: the (attribute, value) couples of the answer
+            attributes, values being not yet formatted.
+    """
+
+    __slots__ = ()
+
+    def attributes(self, attribute_kwargs={}):
+        """Format the answer attributes for a request."""
+        return tuple(
+            (attribute, value % attribute_kwargs)
+            for attribute, value in self.attribute_templates
+        )
+
+
+RadiusPolicy = namedtuple(
+    "RadiusPolicy",
+    (
+        "general_policy",
+        "ok",
+        "banned",
+        "non_member",
+        "unknown_port",
+        "unknown_room",
+        "unknown_machine",
+    ),
+)
+RadiusPolicy.__doc__ = """Immutable snapshot of the RADIUS preferences, see
+RadiusOption.get_policy. Every field but general_policy is a RadiusDecision."""
+
+
+@receiver(post_save, sender=RadiusOption)
+def radiusoption_post_save(**kwargs):
+    """Write in the cache and compile the RADIUS policy again."""
+    radius_pref = kwargs["instance"]
+    radius_pref.set_in_cache()
+    RadiusOption.refresh_policy()
+
+
+@receiver(m2m_changed, sender=RadiusOption.ok_attributes.through)
+@receiver(m2m_changed, sender=RadiusOption.banned_attributes.through)
+@receiver(m2m_changed, sender=RadiusOption.non_member_attributes.through)
+@receiver(m2m_changed, sender=RadiusOption.unknown_port_attributes.through)
+@receiver(m2m_changed, sender=RadiusOption.unknown_room_attributes.through)
+@receiver(m2m_changed, sender=RadiusOption.unknown_machine_attributes.through)
+def radiusoption_attributes_changed(**kwargs):
+    """Compile the RADIUS policy again when the answer attributes of an
+    outcome are changed."""
+    if kwargs["action"] in ("post_add", "post_remove", "post_clear"):
+        RadiusOption.refresh_policy()
+
+
+@receiver(post_save, sender=RadiusAttribute)
+@receiver(post_delete, sender=RadiusAttribute)
+def radiusattribute_post_save(**_kwargs):
+    """Compile the RADIUS policy again after a RADIUS attribute is edited or
+    deleted."""
+    RadiusOption.refresh_policy()
+
 
 def default_invoice():
     tpl, _ = DocumentTemplate.objects.get_or_create(
@@ -24,8 +24,15 @@
 Global independant usefull functions
 """
 
+import functools
 import smtplib
+import threading
+import uuid
+from contextlib import contextmanager
 
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
 from django.utils.translation import ugettext_lazy as _
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 
@@ -256,3 +263,117 @@ def re2o_paginator(request, query_set, pagination_number, page_arg="page"):
         # If page is out of range (e.g. 9999), deliver last page of results.
         results = paginator.page(paginator.num_pages)
     return results
+
+
+def get_cache_version(key):
+    """Return the version stamp stored under key in the server-side cache.
+
+    Processes keeping a local copy of some data (e.g. the freeradius backend)
+    compare this stamp with the one of their copy to know if it is stale. A
+    new stamp is created if the cache has been flushed. The stamps are only
+    seen by the other processes if the cache is shared, see
+    cache_is_shared.
+
+    :key: The cache key of the version stamp
+    """
+    version = cache.get(key)
+    if version is None:
+        version = cache.get_or_set(key, uuid.uuid4().hex, None)
+    return version
+
+
+def cache_is_shared():
+    """Check if the default cache is shared by the processes of re2o (web
+    workers, freeradius backend...), which the version stamps need. The
+    local memory cache, the default one, is not."""
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def bump_cache_version(key):
+    """Replace the version stamp stored under key in the server-side cache,
+    so that every local copy built from the previous stamp is dropped.
+
+    :key: The cache key of the version stamp
+    """
+    version = uuid.uuid4().hex
+    cache.set(key, version, None)
+    return version
+
+
+# Memo of the access computations of the users, per thread, see access_memo
+_access_memo = threading.local()
+
+
+def start_access_memo():
+    """Start memoizing the methods decorated with memoize_access in the
+    current thread, until end_access_memo is called. Used by
+    re2o.middleware.AccessMemoMiddleware for the duration of a request."""
+    _access_memo.values = {}
+
+
+def end_access_memo():
+    """Stop memoizing the methods decorated with memoize_access in the
+    current thread, and drop the memo."""
+    _access_memo.values = None
+
+
+@contextmanager
+def access_memo():
+    """Memoize the methods decorated with memoize_access during the block,
+    e.g. a signal cascade or a request of the freeradius backend. Inside an
+    enclosing memo (e.g. a request), the enclosing memo is used.
+    """
+    if getattr(_access_memo, "values", None) is not None:
+        yield
+        return
+    start_access_memo()
+    try:
+        yield
+    finally:
+        end_access_memo()
+
+
+def memoize_access(method):
+    """Decorator of the access methods of the users (end_connexion, is_ban,
+    has_access...): inside an access memo, each one is computed once per
+    user and per date of evaluation (see User.access_state_date).
+
+    The memo of a user is dropped by forget_access when its cotisations,
+    bans, whitelists or state change.
+    """
+
+    @functools.wraps(method)
+    def memoized(self, *args, **kwargs):
+        values = getattr(_access_memo, "values", None)
+        if values is None or self.pk is None or kwargs:
+            return method(self, *args, **kwargs)
+        key = (self.pk, method.__name__, args, getattr(self, "access_state_at", None))
+        if key not in values:
+            values[key] = method(self, *args)
+        return values[key]
+
+    return memoized
+
+
+def forget_access(pk):
+    """Drop the memoized access methods of the user of primary key pk."""
+    values = getattr(_access_memo, "values", None)
+    if values:
+        for key in [key for key in values if key[0] == pk]:
+            del values[key]
+
+
+@contextmanager
+def muted_signals(*signals):
+    """Disable the receivers of the given signals during the block, e.g.
+    to create many objects and run their side effects once afterwards."""
+    saved_receivers = [signal.receivers for signal in signals]
+    for signal in signals:
+        signal.receivers = []
+        signal.sender_receivers_cache.clear()
+    try:
+        yield
+    finally:
+        for signal, receivers in zip(signals, saved_receivers):
+            signal.receivers = receivers
+            signal.sender_receivers_cache.clear()
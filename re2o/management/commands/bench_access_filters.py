@@ -0,0 +1,195 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Compare the id__in (all_has_access, all_adherent...) and the correlated
+EXISTS (all_has_access_exists, all_adherent_exists...) implementations of
+the user filters of re2o.utils: check they return the same users, and
+report their timings and optionally their query plans.
+
+The filters run on the database content, with a generated dataset added if
+requested. Everything runs inside a transaction which is rolled back, with
+the model signals muted while the dataset is generated.
+"""
+
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.utils import timezone
+
+from cotisations.models import Cotisation, Facture, Paiement, Vente
+from re2o import utils
+from re2o.base import muted_signals
+from users import signals
+from users.models import Ban, User, Whitelist
+
+
+FILTERS = (
+    ("all_adherent", utils.all_adherent, utils.all_adherent_exists),
+    ("all_conn", utils.all_conn, utils.all_conn_exists),
+    ("all_baned", utils.all_baned, utils.all_baned_exists),
+    ("all_whitelisted", utils.all_whitelisted, utils.all_whitelisted_exists),
+    ("all_has_access", utils.all_has_access, utils.all_has_access_exists),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the id__in and EXISTS implementations of all_has_access and"
+        " its siblings. The database is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            "-u",
+            type=int,
+            default=0,
+            help="Number of users to generate (with invoices, bans and"
+            " whitelists) before running the filters.",
+        )
+        parser.add_argument(
+            "--repeat",
+            "-r",
+            type=int,
+            default=5,
+            help="Number of runs of each filter, the best time is reported.",
+        )
+        parser.add_argument(
+            "--explain",
+            action="store_true",
+            help="Display the query plans of all_has_access.",
+        )
+
+    def generate(self, count):
+        """Create count users, most of them with invoices and a few of them
+        banned or whitelisted, with past, running and future periods."""
+        now = timezone.now()
+        first_uid = (User.objects.aggregate(Max("uid_number"))["uid_number__max"] or 0) + 1
+        User.objects.bulk_create(
+            User(
+                pseudo="bench-access-%d" % index,
+                surname="Bench",
+                email="bench-access-%d@example.net" % index,
+                uid_number=first_uid + index,
+                state=random.choice(
+                    (User.STATE_ACTIVE,) * 8 + (User.STATE_DISABLED, User.STATE_ARCHIVE)
+                ),
+            )
+            for index in range(count)
+        )
+        paiement = Paiement.objects.create(moyen="bench_access_filters")
+        users = User.objects.filter(pseudo__startswith="bench-access-")
+        bans, whitelists = [], []
+        for user in users:
+            for _invoice in range(random.randint(0, 3)):
+                invoice = Facture(user=user, paiement=paiement, valid=random.random() > 0.1)
+                invoice.save()
+                purchase = Vente(
+                    facture=invoice,
+                    number=1,
+                    name="Bench purchase",
+                    prix=0,
+                    duration_connection=0,
+                    duration_days_connection=0,
+                    duration_membership=0,
+                    duration_days_membership=0,
+                )
+                purchase.save()
+                start = now + timedelta(days=random.randint(-730, 30))
+                Cotisation.objects.create(
+                    vente=purchase,
+                    date_start_con=start,
+                    date_end_con=start + timedelta(days=random.randint(0, 365)),
+                    date_start_memb=start,
+                    date_end_memb=start + timedelta(days=random.randint(0, 365)),
+                )
+            for model, periods, ratio in ((Ban, bans, 0.05), (Whitelist, whitelists, 0.05)):
+                if random.random() < ratio:
+                    periods.append(
+                        model(
+                            user=user,
+                            raison="Bench",
+                            date_end=now + timedelta(days=random.randint(-30, 30)),
+                        )
+                    )
+        Ban.objects.bulk_create(bans)
+        Whitelist.objects.bulk_create(whitelists)
+
+    def run_filter(self, builder, repeat):
+        """Run a filter repeat times, return the best time and the ids."""
+        best = None
+        for _run in range(repeat):
+            start = time.perf_counter()
+            ids = set(builder().values_list("pk", flat=True))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, ids
+
+    def explain(self, name, queryset):
+        """Display the query plan of a queryset."""
+        sql, params = queryset.values("pk").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN " + sql, params)
+            plan = cursor.fetchall()
+        self.stdout.write("Query plan of %s:" % name)
+        for row in plan:
+            self.stdout.write("  " + " | ".join(str(column) for column in row))
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options["users"]:
+                with muted_signals(
+                    pre_save,
+                    post_save,
+                    post_delete,
+                    m2m_changed,
+                    signals.synchronise,
+                    signals.remove,
+                ):
+                    self.generate(options["users"])
+            self.stdout.write(
+                "%d users in the database." % User.objects.count()
+            )
+            self.stdout.write(
+                "%-16s %8s %12s %12s %8s  %s"
+                % ("filter", "users", "id__in (ms)", "EXISTS (ms)", "speedup", "same users")
+            )
+            for name, legacy, exists in FILTERS:
+                legacy_time, legacy_ids = self.run_filter(legacy, options["repeat"])
+                exists_time, exists_ids = self.run_filter(exists, options["repeat"])
+                self.stdout.write(
+                    "%-16s %8d %12.2f %12.2f %7.1fx  %s"
+                    % (
+                        name,
+                        len(legacy_ids),
+                        legacy_time * 1000,
+                        exists_time * 1000,
+                        legacy_time / exists_time if exists_time else 0,
+                        "yes" if legacy_ids == exists_ids else "NO",
+                    )
+                )
+            if options["explain"]:
+                self.explain("all_has_access", utils.all_has_access())
+                self.explain("all_has_access_exists", utils.all_has_access_exists())
+            transaction.set_rollback(True)
@@ -0,0 +1,350 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Replay RADIUS requests through the freeradius python backend
+(freeradius_utils/auth.py) without a running freeradius, and report the
+latency, the number of SQL queries and the throughput of each scenario.
+
+Requests are either read from a JSON file (a list of objects with a
+"scenario" name and the "attributes" of the Access-Request) or generated from
+the objects of the database. Every request runs authorize then post_auth, as
+freeradius does, inside a transaction which is rolled back: machines
+registered by MAC autocapture are not kept. Emails are not sent, the
+users.signals receivers (LDAP synchronisation) are muted and the RADIUS
+statistics are written in a temporary file during the run.
+"""
+
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from machines.models import Interface, Nas
+from re2o import radius
+from re2o.base import muted_signals
+from topologie.models import Switch
+from users import signals
+from users.models import User
+
+
+SCENARIOS = (
+    "wired-common",
+    "wired-strict",
+    "dot1x",
+    "dot1x-autocapture",
+    "stacked",
+    "unknown-nas",
+)
+
+
+def radiusd_stub():
+    """Build a module standing for the radiusd module that freeradius injects
+    in rlm_python."""
+    radiusd = types.ModuleType("radiusd")
+    for code, name in enumerate(
+        (
+            "RLM_MODULE_REJECT",
+            "RLM_MODULE_FAIL",
+            "RLM_MODULE_OK",
+            "RLM_MODULE_HANDLED",
+            "RLM_MODULE_INVALID",
+            "RLM_MODULE_USERLOCK",
+            "RLM_MODULE_NOTFOUND",
+            "RLM_MODULE_NOOP",
+            "RLM_MODULE_UPDATED",
+        )
+    ):
+        setattr(radiusd, name, code)
+    radiusd.L_DBG = 1
+    radiusd.L_INFO = 3
+    radiusd.L_ERR = 4
+    radiusd.radlog = lambda level, message: None
+    return radiusd
+
+
+def load_backend():
+    """Import freeradius_utils/auth.py with the radiusd stub."""
+    sys.modules.setdefault("radiusd", radiusd_stub())
+    os.environ.setdefault("RE2O_PATH", settings.BASE_DIR)
+    spec = importlib.util.spec_from_file_location(
+        "re2o_radius_backend",
+        os.path.join(settings.BASE_DIR, "freeradius_utils", "auth.py"),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values, rank):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0
+    index = max(0, int(round(rank / 100.0 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def random_mac():
+    """A locally administered MAC address, unknown to re2o."""
+    return "02:" + ":".join("%02x" % random.randint(0, 255) for _ in range(5))
+
+
+class Command(BaseCommand):
+    help = "Benchmark the freeradius python backend on recorded or synthetic requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--input",
+            "-i",
+            help="JSON file of recorded requests, instead of synthetic ones.",
+        )
+        parser.add_argument(
+            "--requests",
+            "-n",
+            type=int,
+            default=200,
+            help="Number of synthetic requests per scenario.",
+        )
+        parser.add_argument(
+            "--scenario",
+            "-s",
+            action="append",
+            choices=SCENARIOS,
+            help="Only run this scenario (can be repeated).",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=10,
+            help="Number of requests run before measuring.",
+        )
+
+    def nas_interfaces(self, port_access_mode, autocapture=None, switch=True):
+        """Interfaces of NAS devices of the given access mode."""
+        nas_types = Nas.objects.filter(port_access_mode=port_access_mode)
+        if autocapture is not None:
+            nas_types = nas_types.filter(autocapture_mac=autocapture)
+        interfaces = Interface.objects.filter(
+            machine_type__in=nas_types.values("nas_type"), ipv4__isnull=False
+        ).select_related("ipv4", "machine__switch")
+        if switch:
+            interfaces = interfaces.filter(machine__switch__isnull=False)
+        return list(interfaces)
+
+    def switch_ports(self, interfaces, radius_mode, stacked=False):
+        """(NAS-IP-Address, NAS-Port-Id) couples of the ports of the given
+        RADIUS mode on the switches of the interfaces."""
+        ports = []
+        for interface in interfaces:
+            switch = interface.machine.switch
+            if bool(switch.stack_id) != stacked:
+                continue
+            members = [switch]
+            if stacked:
+                members = Switch.objects.filter(stack=switch.stack).exclude(
+                    stack_member_id=None
+                )
+            for member in members:
+                for port in member.ports.all():
+                    profile = port.get_port_profile
+                    if (
+                        profile.radius_type == "MAC-radius"
+                        and profile.radius_mode == radius_mode
+                    ):
+                        if stacked:
+                            port_id = "GigabitEthernet-%d/0/%d" % (
+                                member.stack_member_id,
+                                port.port,
+                            )
+                        else:
+                            port_id = str(port.port)
+                        ports.append((str(interface.ipv4), port_id))
+        return ports
+
+    def synthetic_requests(self, scenarios, count):
+        """Build count requests for each scenario from the database."""
+        macs = list(
+            Interface.objects.filter(machine__active=True).values_list(
+                "mac_address", flat=True
+            )[:1000]
+        )
+        users = list(
+            User.objects.filter(machine__interface__isnull=False)
+            .values_list("pseudo", "machine__interface__mac_address")
+            .distinct()[:1000]
+        )
+        requests = []
+        for scenario in scenarios:
+            samples = []
+            if scenario in ("wired-common", "wired-strict", "stacked"):
+                mode = "STRICT" if scenario == "wired-strict" else "COMMON"
+                ports = self.switch_ports(
+                    self.nas_interfaces("Mac-address"),
+                    mode,
+                    stacked=scenario == "stacked",
+                )
+                if ports and macs:
+                    for _ in range(count):
+                        nas_ip, port_id = random.choice(ports)
+                        samples.append(
+                            {
+                                "NAS-IP-Address": nas_ip,
+                                "NAS-Port-Id": port_id,
+                                "Calling-Station-Id": random.choice(macs),
+                            }
+                        )
+            elif scenario in ("dot1x", "dot1x-autocapture"):
+                autocapture = scenario == "dot1x-autocapture"
+                interfaces = self.nas_interfaces(
+                    "802.1X", autocapture=autocapture, switch=False
+                )
+                if interfaces and users:
+                    for _ in range(count):
+                        pseudo, mac = random.choice(users)
+                        samples.append(
+                            {
+                                "NAS-IP-Address": str(random.choice(interfaces).ipv4),
+                                "User-Name": pseudo,
+                                "Calling-Station-Id": random_mac()
+                                if autocapture
+                                else str(mac),
+                            }
+                        )
+            elif scenario == "unknown-nas":
+                for index in range(count):
+                    samples.append(
+                        {
+                            "NAS-IP-Address": "192.0.2.%d" % (index % 254 + 1),
+                            "User-Name": users[0][0] if users else "unknown",
+                            "Calling-Station-Id": random.choice(macs)
+                            if macs
+                            else random_mac(),
+                        }
+                    )
+            if not samples:
+                self.stderr.write(
+                    self.style.WARNING(
+                        "No object in the database matches scenario %s, skipped."
+                        % scenario
+                    )
+                )
+            requests += [(scenario, sample) for sample in samples]
+        return requests
+
+    def recorded_requests(self, path, scenarios):
+        """Read the requests of a JSON file."""
+        try:
+            with open(path) as recorded:
+                entries = json.load(recorded)
+        except (IOError, ValueError) as error:
+            raise CommandError("Can't read %s: %s" % (path, error))
+        return [
+            (entry.get("scenario", "recorded"), entry["attributes"])
+            for entry in entries
+            if not scenarios or entry.get("scenario") in scenarios
+        ]
+
+    def replay(self, backend, attributes):
+        """Run authorize then post_auth on a request, return the elapsed
+        time, the number of SQL queries and the final return code."""
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            with transaction.atomic():
+                result = backend.authorize(attributes)
+                code = result[0] if isinstance(result, tuple) else result
+                if code != backend.radiusd.RLM_MODULE_REJECT:
+                    result = backend.post_auth(attributes)
+                    code = result[0] if isinstance(result, tuple) else result
+                transaction.set_rollback(True)
+            elapsed = time.perf_counter() - start
+        return elapsed, len(queries), code
+
+    def handle(self, *args, **options):
+        scenarios = options["scenario"] or SCENARIOS
+        if options["input"]:
+            requests = self.recorded_requests(options["input"], options["scenario"])
+        else:
+            requests = self.synthetic_requests(scenarios, options["requests"])
+        if not requests:
+            raise CommandError("No request to replay.")
+
+        backend = load_backend()
+        backend.instantiate()
+        codes = dict(
+            (getattr(backend.radiusd, name), name[len("RLM_MODULE_"):])
+            for name in dir(backend.radiusd)
+            if name.startswith("RLM_MODULE_")
+        )
+
+        # The backend records its calls in re2o.radius.stats: keep the
+        # synthetic calls out of the statistics of the production server
+        saved_stats = (radius.stats.path, radius.stats.functions)
+        stats = OrderedDict()
+        try:
+            with tempfile.TemporaryDirectory() as stats_dir, muted_signals(
+                signals.synchronise, signals.remove
+            ), override_settings(
+                EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"
+            ):
+                radius.stats.path = os.path.join(stats_dir, "radius_stats.json")
+                radius.stats.functions = {}
+                for _scenario, attributes in requests[: options["warmup"]]:
+                    self.replay(backend, attributes)
+                for scenario, attributes in requests:
+                    elapsed, queries, code = self.replay(backend, attributes)
+                    scenario_stats = stats.setdefault(
+                        scenario,
+                        {"times": [], "queries": [], "codes": defaultdict(int)},
+                    )
+                    scenario_stats["times"].append(elapsed)
+                    scenario_stats["queries"].append(queries)
+                    scenario_stats["codes"][codes.get(code, code)] += 1
+        finally:
+            radius.stats.path, radius.stats.functions = saved_stats
+
+        self.stdout.write(
+            "%-18s %7s %9s %9s %9s %8s %9s  %s"
+            % ("scenario", "count", "p50 (ms)", "p95 (ms)", "p99 (ms)", "SQL/req", "dec./s", "results")
+        )
+        for scenario, scenario_stats in stats.items():
+            times = sorted(scenario_stats["times"])
+            self.stdout.write(
+                "%-18s %7d %9.2f %9.2f %9.2f %8.1f %9.1f  %s"
+                % (
+                    scenario,
+                    len(times),
+                    percentile(times, 50) * 1000,
+                    percentile(times, 95) * 1000,
+                    percentile(times, 99) * 1000,
+                    sum(scenario_stats["queries"]) / float(len(times)),
+                    len(times) / sum(times) if sum(times) else 0,
+                    ", ".join(
+                        "%s: %d" % item for item in sorted(scenario_stats["codes"].items())
+                    ),
+                )
+            )
@@ -0,0 +1,115 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Display the statistics written by the freeradius python backend
+(freeradius_utils/auth.py) in settings.RADIUS_STATS_FILE.
+"""
+
+import datetime
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def histogram_percentile(buckets, histogram, rank):
+    """Upper bound (in ms) of the bucket holding the given percentile."""
+    total = sum(histogram)
+    threshold = rank / 100.0 * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if seen >= threshold:
+            if index < len(buckets):
+                return "%d" % buckets[index]
+            return ">%d" % buckets[-1]
+    return "-"
+
+
+class Command(BaseCommand):
+    help = "Show the statistics of the freeradius python backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            "-f",
+            default=settings.RADIUS_STATS_FILE,
+            help="The stats file to read.",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Output the raw statistics.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["file"]) as stats_file:
+                stats = json.load(stats_file)
+        except (IOError, ValueError) as error:
+            raise CommandError("Can't read %s: %s" % (options["file"], error))
+
+        if options["json"]:
+            self.stdout.write(json.dumps(stats, indent=4))
+            return
+
+        self.stdout.write(
+            "Process %s, started %s, updated %s"
+            % (
+                stats["pid"],
+                datetime.datetime.fromtimestamp(stats["started"]),
+                datetime.datetime.fromtimestamp(stats["updated"]),
+            )
+        )
+        buckets = stats["buckets"]
+        for function, function_stats in sorted(stats["functions"].items()):
+            count = function_stats["count"]
+            if not count:
+                continue
+            self.stdout.write("")
+            self.stdout.write(self.style.SUCCESS(function))
+            self.stdout.write(
+                "  calls: %d, mean: %.2f ms, p50 <= %s ms, p95 <= %s ms, p99 <= %s ms"
+                % (
+                    count,
+                    function_stats["time"] * 1000 / count,
+                    histogram_percentile(buckets, function_stats["histogram"], 50),
+                    histogram_percentile(buckets, function_stats["histogram"], 95),
+                    histogram_percentile(buckets, function_stats["histogram"], 99),
+                )
+            )
+            self.stdout.write(
+                "  SQL: %.1f queries, %.2f ms per call"
+                % (
+                    function_stats["queries"] / float(count),
+                    function_stats["db_time"] * 1000 / count,
+                )
+            )
+            self.stdout.write(
+                "  results: "
+                + ", ".join(
+                    "%s: %d" % outcome
+                    for outcome in sorted(function_stats["outcomes"].items())
+                )
+            )
+            for name, phase in sorted(function_stats["phases"].items()):
+                self.stdout.write(
+                    "  phase %s: %d calls, mean %.2f ms"
+                    % (name, phase["count"], phase["time"] * 1000 / phase["count"])
+                )
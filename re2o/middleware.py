@@ -22,6 +22,9 @@
 """
 
 from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+from re2o.base import end_access_memo, start_access_memo
 
 
 def show_debug_toolbar(request):
@@ -44,3 +47,18 @@ def show_debug_toolbar(request):
         return False
 
     return bool(settings.DEBUG)
+
+
+class AccessMemoMiddleware(MiddlewareMixin):
+    """Memoize the access methods of the users (see
+    re2o.base.memoize_access) for the duration of each request."""
+
+    def process_request(self, request):
+        start_access_memo()
+
+    def process_response(self, request, response):
+        end_access_memo()
+        return response
+
+    def process_exception(self, request, exception):
+        end_access_memo()
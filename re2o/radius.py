@@ -0,0 +1,752 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# Copyirght © 2017  Daniel Stan
+# Copyright © 2017  Gabriel Détraz
+# Copyright © 2017  Lara Kermarec
+# Copyright © 2017  Augustin Lemesle
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""re2o.radius
+The RADIUS decision engine.
+
+It is shared by the python backend of freeradius (freeradius_utils/auth.py)
+and by the endpoint of the API for the rlm_rest module of freeradius (see
+api.views.RadiusView). It does not depend on freeradius: authorize and
+post_auth return the name of the freeradius return code with the reply and
+control attributes, the callers translate them.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Prefetch, Q
+
+from machines.models import Domain, Interface, Nas
+from topologie.models import Port, Switch
+from users.models import AutoregisterRequest, User
+from preferences.models import RadiusOption
+from re2o.base import get_cache_version
+
+
+logger = logging.getLogger(__name__)
+
+
+class RadiusStats(object):
+    """In-process statistics of the calls to the RADIUS backend functions:
+    wall time histogram, SQL queries count and time, return codes and time
+    spent in each phase (see radius_phase).
+
+    The statistics are written as JSON in settings.RADIUS_STATS_FILE at most
+    every FLUSH_INTERVAL seconds and on detach. They can be displayed with the
+    radius_stats management command.
+    """
+
+    # Upper bounds (in ms) of the wall time histogram buckets, the last
+    # bucket holds the slower calls
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+    FLUSH_INTERVAL = 60
+
+    def __init__(self, path, codes=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.last_flush = self.started
+        self.functions = {}
+        self.current = threading.local()
+        # Names of the return codes, to display them in the statistics
+        self.codes = codes or {}
+
+    @contextmanager
+    def phase(self, name):
+        """Measure the time spent in a phase of the current call."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases = getattr(self.current, "phases", None)
+            if phases is not None:
+                phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+    @contextmanager
+    def measure(self, function):
+        """Measure a call of function, with the SQL queries it runs."""
+        self.current.phases = {}
+        self.current.result = None
+        # Record the queries even when DEBUG is off. The log is not cleared
+        # if somebody else is already recording them (e.g. bench_radius).
+        capturing = connection.force_debug_cursor
+        if not capturing:
+            connection.queries_log.clear()
+        connection.force_debug_cursor = True
+        initial_queries = len(connection.queries_log)
+        start = time.perf_counter()
+        try:
+            yield self.current
+        finally:
+            elapsed = time.perf_counter() - start
+            connection.force_debug_cursor = capturing
+            queries = list(connection.queries_log)[initial_queries:]
+            if not capturing:
+                connection.queries_log.clear()
+            self.record(
+                function,
+                elapsed,
+                len(queries),
+                sum(float(query["time"]) for query in queries),
+                self.current.result,
+                self.current.phases,
+            )
+            self.current.phases = None
+
+    def record(self, function, elapsed, queries, db_time, result, phases):
+        """Add a call to the statistics."""
+        code = result[0] if isinstance(result, tuple) else result
+        outcome = self.codes.get(code, str(code))
+        bucket = len(self.BUCKETS)
+        for index, bound in enumerate(self.BUCKETS):
+            if elapsed * 1000 <= bound:
+                bucket = index
+                break
+        with self.lock:
+            stats = self.functions.setdefault(
+                function,
+                {
+                    "count": 0,
+                    "time": 0.0,
+                    "queries": 0,
+                    "db_time": 0.0,
+                    "histogram": [0] * (len(self.BUCKETS) + 1),
+                    "outcomes": {},
+                    "phases": {},
+                },
+            )
+            stats["count"] += 1
+            stats["time"] += elapsed
+            stats["queries"] += queries
+            stats["db_time"] += db_time
+            stats["histogram"][bucket] += 1
+            stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+            for name, phase_time in phases.items():
+                phase = stats["phases"].setdefault(name, {"count": 0, "time": 0.0})
+                phase["count"] += 1
+                phase["time"] += phase_time
+        if time.time() - self.last_flush > self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write the statistics in the stats file."""
+        with self.lock:
+            self.last_flush = time.time()
+            content = json.dumps(
+                {
+                    "pid": os.getpid(),
+                    "started": self.started,
+                    "updated": self.last_flush,
+                    "buckets": self.BUCKETS,
+                    "functions": self.functions,
+                }
+            )
+        try:
+            temporary_path = "%s.%d" % (self.path, os.getpid())
+            with open(temporary_path, "w") as stats_file:
+                stats_file.write(content)
+            os.replace(temporary_path, self.path)
+        except OSError as err:
+            logger.error("Failed to write the stats in %s: %r" % (self.path, err))
+
+
+stats = RadiusStats(settings.RADIUS_STATS_FILE)
+radius_phase = stats.phase
+
+
+class NasIndex(object):
+    """Process-local index of the NAS devices known by re2o.
+
+    Every request coming from a NAS is resolved against this index instead of
+    the database. The index is rebuilt when the version stamp set by the
+    Nas, Interface, IpList, Domain and Switch signals (see Nas.refresh_index)
+    changes.
+    Lookups are then only a cache read and a dict access.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.entries = {}
+
+    def build(self):
+        """Load every interface of a NAS device, indexed by its IPv4 address,
+        its domain name and the names of its aliases, with the related Nas
+        object."""
+        version = get_cache_version(Nas.INDEX_VERSION_KEY)
+        nas_types = {}
+        for nas_type in Nas.objects.order_by("pk"):
+            nas_types.setdefault(nas_type.nas_type_id, nas_type)
+        entries = {}
+        interfaces = (
+            Interface.objects.filter(machine_type__in=list(nas_types))
+            .select_related("machine_type")
+            .select_related("machine__switch__stack")
+            .select_related("domain")
+            .select_related("ipv4")
+            .order_by("pk")
+        )
+        interface_entries = {}
+        for interface in interfaces:
+            entry = (interface, nas_types[interface.machine_type_id])
+            interface_entries[interface.pk] = entry
+            if interface.ipv4:
+                entries.setdefault(str(interface.ipv4), entry)
+            try:
+                entries.setdefault(interface.domain.name, entry)
+            except Domain.DoesNotExist:
+                pass
+        aliases = (
+            Domain.objects.filter(cname__interface_parent__in=list(interface_entries))
+            .values_list("name", "cname__interface_parent")
+            .order_by("pk")
+        )
+        for name, interface_id in aliases:
+            entries.setdefault(name, interface_entries[interface_id])
+        # Swap the whole index at once, other threads may be reading it
+        self.version, self.entries = version, entries
+        logger.info("NAS index built with %d entries" % len(entries))
+
+    def find(self, nas_id):
+        """Get the NAS interface and the Nas object from the NAS ID sent by
+        freeradius (IPv4 address or name).
+
+        Returns:
+            tuple (Interface, Nas), (None, None) if the NAS is unknown.
+        """
+        if get_cache_version(Nas.INDEX_VERSION_KEY) != self.version:
+            self.build()
+        return self.entries.get(nas_id, (None, None))
+
+
+nas_index = NasIndex()
+
+
+# Everything decide_vlan_switch needs to know about a port. vlan_id is the
+# VLAN forced by the port profile, if any.
+PortDecision = namedtuple(
+    "PortDecision", ("state", "room", "vlan_id", "radius_type", "radius_mode")
+)
+
+
+class PortIndex(object):
+    """Process-local index of the switch ports, with their effective
+    profile already resolved.
+
+    The index maps each switch (by primary key) to the IPv4 address of its
+    management interface and a dict of its ports (by port number) to a
+    PortDecision. It also maps the (stack, member ID) couples to the stacked
+    switches. It is rebuilt when the version stamp set by the Port,
+    PortProfile, Vlan, Switch, Stack, Room and Dormitory signals (see
+    Port.refresh_index) or the one of the NAS index changes, so that a MAC
+    authentication only has to resolve the MAC address.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.switches = {}
+        self.stack_members = {}
+
+    @staticmethod
+    def current_version():
+        return (
+            get_cache_version(Port.INDEX_VERSION_KEY),
+            get_cache_version(Nas.INDEX_VERSION_KEY),
+        )
+
+    def build(self):
+        """Load every port of every switch and resolve its profile."""
+        version = self.current_version()
+        switches = {}
+        stack_members = {}
+        ports = Port.objects.select_related(
+            "room__building",
+            "related",
+            "machine_interface__machine__accesspoint",
+            "custom_profile__vlan_untagged",
+        ).order_by("pk")
+        for switch in Switch.objects.select_related(
+            "switchbay__building__dormitory"
+        ).prefetch_related(Prefetch("ports", queryset=ports)):
+            switch_ports = {}
+            for port in switch.ports.all():
+                # The default profiles are cached on the switch instance
+                profile = port.get_port_profile
+                switch_ports[port.port] = PortDecision(
+                    port.state,
+                    port.room,
+                    getattr(profile.vlan_untagged, "vlan_id", None),
+                    profile.radius_type,
+                    profile.radius_mode,
+                )
+            interface = switch.main_interface()
+            switch_ip = str(interface.ipv4) if interface else None
+            switches[switch.pk] = (switch_ip, switch_ports)
+            if switch.stack_id is not None:
+                # Fill the cached name, used in the logs of each request
+                switch.short_name
+                stack_members[(switch.stack_id, switch.stack_member_id)] = switch
+        self.version, self.switches = version, switches
+        self.stack_members = stack_members
+        logger.info("Port index built for %d switches" % len(switches))
+
+    def find(self, switch_id, port_number):
+        """Get the management IPv4 address of a switch and the PortDecision
+        of one of its ports.
+
+        Returns:
+            tuple (str, PortDecision), the PortDecision is None if the port
+            is unknown and both are None if the switch is unknown.
+        """
+        if self.current_version() != self.version:
+            self.build()
+        switch_ip, switch_ports = self.switches.get(switch_id, (None, {}))
+        try:
+            port = switch_ports.get(int(port_number))
+        except (TypeError, ValueError):
+            port = None
+        return switch_ip, port
+
+    def find_stack_member(self, stack_id, member_id):
+        """Get a switch from its stack and its member ID in the stack.
+
+        Returns:
+            The Switch object, None if there is no such member.
+        """
+        if self.current_version() != self.version:
+            self.build()
+        try:
+            return self.stack_members.get((stack_id, int(member_id)))
+        except (TypeError, ValueError):
+            return None
+
+
+port_index = PortIndex()
+
+
+def authorize(data):
+    """Here, we test if the Nas is known.
+    - If the nas is unknown, we assume that it is a 802.1X request,
+    - If the nas is known, we apply the 802.1X if enabled,
+    - It the nas is known AND nas auth is enabled with mac address, returns
+    accept here
+
+    Returns:
+        tuple (code, reply attributes, control attributes), code being the
+        name of the freeradius return code (without the RLM_MODULE_ prefix).
+    """
+    # For proxified request, split 
+    nas = data.get("NAS-IP-Address", data.get("NAS-Identifier", None))
+    # For none proxified requests 
+    with radius_phase("find_nas"):
+        _nas_instance, nas_type = find_nas_from_request(nas)
+    if not nas_type or nas_type.port_access_mode == "802.1X":
+        user = data.get("User-Name", "")
+        user = user.split("@", 1)[0]
+        mac = data.get("Calling-Station-Id", "")
+        with radius_phase("check_user"):
+            result, log, password = check_user_machine_and_register(nas_type, user, mac)
+        logger.info(str(log))
+        logger.info(str(user))
+
+        if not result:
+            return ("REJECT", (), ())
+        else:
+            return ("UPDATED", (), (("NT-Password", str(password)),))
+
+    else:
+        return ("UPDATED", (), (("Auth-Type", "Accept"),))
+
+
+def post_auth(data):
+    """ Function called after the user is authenticated
+
+    Returns:
+        tuple (code, reply attributes, control attributes), see authorize.
+    """
+
+    nas = data.get("NAS-IP-Address", data.get("NAS-Identifier", None))
+    with radius_phase("find_nas"):
+        nas_instance, nas_type = find_nas_from_request(nas)
+    # All non proxified requests 
+    if not nas_instance:
+        logger.info("Proxified request, nas unknown")
+        return ("OK", (), ())
+
+    mac = data.get("Calling-Station-Id", None)
+
+    # Switchs and access point can have several interfaces
+    nas_machine = nas_instance.machine
+    # If it is a switchs
+    if hasattr(nas_machine, "switch"):
+        port = data.get("NAS-Port-Id", data.get("NAS-Port", None))
+        # If the switch is part of a stack, calling ip is different from calling switch.
+        instance_stack_id = nas_machine.switch.stack_id
+        if instance_stack_id:
+            # If it is a stack, we select the correct switch in the stack
+            id_stack_member = port.split("-")[1].split("/")[0]
+            with radius_phase("stack_lookup"):
+                nas_machine = port_index.find_stack_member(
+                    instance_stack_id, id_stack_member
+                )
+        # Find the port number from freeradius, works both with HP, Cisco
+        # and juniper output
+        port = port.split(".")[0].split("/")[-1][-2:]
+        with radius_phase("decide_vlan"):
+            out = decide_vlan_switch(nas_machine, nas_type, port, mac)
+        sw_name, room, reason, vlan_id, decision, attributes = out
+
+        if decision:
+            log_message = "(wired) %s -> %s [%s%s]" % (
+                sw_name + ":" + port + "/" + str(room),
+                mac,
+                vlan_id,
+                (reason and ": " + reason),
+            )
+            logger.info(log_message)
+
+            # Wired connexion
+            return (
+                "UPDATED",
+                (
+                    ("Tunnel-Type", "VLAN"),
+                    ("Tunnel-Medium-Type", "IEEE-802"),
+                    ("Tunnel-Private-Group-Id", "%d" % int(vlan_id)),
+                )
+                + tuple(attributes),
+                (),
+            )
+        else:
+            log_message = "(fil) %s -> %s [Reject %s]" % (
+                sw_name + ":" + port + "/" + str(room),
+                mac,
+                (reason and ": " + reason),
+            )
+            logger.info(log_message)
+
+            return ("REJECT", tuple(attributes), ())
+
+    else:
+        return ("OK", (), ())
+
+
+def find_nas_from_request(nas_id):
+    """Get the nas interface and the Nas object from its ID, through the
+    process-local NAS index."""
+    return nas_index.find(nas_id)
+
+
+def check_user_machine_and_register(nas_type, username, mac_address):
+    """Check if username and mac are registered. Register it if unknown.
+    Return the user ntlm password if everything is ok.
+    Used for 802.1X auth"""
+    interface = Interface.objects.filter(mac_address=mac_address).first()
+    user = User.objects.filter(pseudo__iexact=username).first()
+    if not user:
+        return (False, "User unknown", "")
+    if not user.has_access():
+        return (False, "Invalid connexion (non-contributing user)", "")
+    if interface:
+        if interface.machine.user != user:
+            return (
+                False,
+                "Mac address registered on another user account",
+                "",
+            )
+        elif not interface.is_active:
+            return (False, "Interface/Machine disabled", "")
+        elif not interface.ipv4:
+            interface.assign_ipv4()
+            return (True, "Ok, new ipv4 assignement...", user.pwd_ntlm)
+        else:
+            return (True, "Access ok", user.pwd_ntlm)
+    elif nas_type:
+        if nas_type.autocapture_mac:
+            # The machine is registered later by the process_autoregister
+            # command, not to hold the radiusd thread
+            AutoregisterRequest.enqueue(user, mac_address, nas_type)
+            return (True, "Access Ok, Registering mac...", user.pwd_ntlm)
+        else:
+            return (False, "Unknown interface/machine", "")
+    else:
+        return (False, "Unknown interface/machine", "")
+
+
+def decide_vlan_switch(nas_machine, nas_type, port_number, mac_address):
+    """Function for selecting vlan for a switch with wired mac auth radius.
+    Several modes are available :
+        - all modes:
+           - unknown NAS : VLAN_OK,
+           - unknown port : Decision set in Re2o RadiusOption
+        - No radius on this port : VLAN_OK
+        - force : returns vlan provided by the database
+        - mode strict:
+            - no room : Decision set in Re2o RadiusOption,
+            - no user in this room : Reject,
+            - user of this room is banned or disable : Reject,
+            - user of this room non-contributor and not whitelisted: 
+            Decision set in Re2o RadiusOption
+        - mode common :
+            - mac-address already registered:
+                - related user non contributor / interface disabled:
+                Decision set in Re2o RadiusOption
+                - related user is banned:
+                Decision set in Re2o RadiusOption
+                - user contributing : VLAN_OK (can assign ipv4 if needed)
+            - unknown interface :
+                - register mac disabled : Decision set in Re2o RadiusOption
+                - register mac enabled : redirect to webauth
+    Returns:
+        tuple with :
+            - Switch name (str)
+            - Room (str)
+            - Reason of the decision (str)
+            - vlan_id (int)
+            - decision (bool)
+            - Other Attributs (attribut:str, operator:str, value:str)
+    """
+    policy = RadiusOption.get_policy()
+    attributes_kwargs = {
+        "client_mac": str(mac_address),
+        "switch_port": str(port_number),
+    }
+    # Get port from switch and port number
+    extra_log = ""
+    # If NAS is unknown, go to default vlan 
+    if not nas_machine:
+        return (
+            "?",
+            "Unknown room",
+            "Unknown NAS",
+            policy.ok.vlan_id,
+            True,
+            policy.ok.attributes(attributes_kwargs),
+        )
+
+    sw_name = str(getattr(nas_machine, "short_name", str(nas_machine)))
+
+    with radius_phase("port_lookup"):
+        switch_ip, port = port_index.find(nas_machine.pk, port_number)
+    attributes_kwargs["switch_ip"] = str(switch_ip)
+
+    # If the port is unknwon, go to default vlan
+    # We don't have enought information to make a better decision
+    if not port:
+        return (
+            sw_name,
+            "Unknown port",
+            "PUnknown port",
+            policy.unknown_port.vlan_id,
+            policy.unknown_port.accept,
+            policy.unknown_port.attributes(attributes_kwargs),
+        )
+ 
+    # If a vlan is precised in port config, we use it
+    if port.vlan_id:
+        DECISION_VLAN = int(port.vlan_id)
+        extra_log = "Force sur vlan " + str(DECISION_VLAN)
+        attributes = ()
+    else:
+        DECISION_VLAN = policy.ok.vlan_id
+        attributes = policy.ok.attributes(attributes_kwargs)
+
+    # If the port is disabled in re2o, REJECT
+    if not port.state:
+        return (sw_name, port.room, "Port disabled", None, False, ())
+
+    # If radius is disabled, decision is OK
+    if port.radius_type == "NO":
+        return (
+            sw_name,
+            "",
+            "No Radius auth enabled on this port" + extra_log,
+            DECISION_VLAN,
+            True,
+            attributes,
+        )
+
+    # If 802.1X is enabled, people has been previously accepted.
+    # Go to the decision vlan
+    if (nas_type.port_access_mode, port.radius_type) == ("802.1X", "802.1X"):
+        room = port.room or "Room unknown"
+        return (
+            sw_name,
+            room,
+            "Accept authentication 802.1X",
+            DECISION_VLAN,
+            True,
+            attributes,
+        )
+
+    # Otherwise, we are in mac radius.
+    # If strict mode is enabled, we check every user related with this port. If
+    # one user or more is not enabled, we reject to prevent from sharing or
+    # spoofing mac.
+    if port.radius_mode == "STRICT":
+        room = port.room
+        if not room:
+            return (
+                sw_name,
+                "Unknown",
+                "Unkwown room",
+                policy.unknown_room.vlan_id,
+                policy.unknown_room.accept,
+                policy.unknown_room.attributes(attributes_kwargs),
+            )
+
+        # A single query fetches the occupants with their access state
+        with radius_phase("room_check"):
+            room_user = list(
+                User.objects.with_access_state().filter(
+                    Q(club__room=port.room) | Q(adherent__room=port.room)
+                )
+            )
+        if not room_user:
+            return (
+                sw_name,
+                room,
+                "Non-contributing room",
+                policy.non_member.vlan_id,
+                policy.non_member.accept,
+                policy.non_member.attributes(attributes_kwargs),
+            )
+        for user in room_user:
+            if user.is_ban() or user.state != User.STATE_ACTIVE:
+                return (
+                    sw_name,
+                    room,
+                    "User is banned or disabled",
+                    policy.banned.vlan_id,
+                    policy.banned.accept,
+                    policy.banned.attributes(attributes_kwargs),
+                )
+            elif user.email_state == User.EMAIL_STATE_UNVERIFIED:
+                return (
+                    sw_name,
+                    room,
+                    "User is suspended (mail has not been confirmed)",
+                    policy.non_member.vlan_id,
+                    policy.non_member.accept,
+                    policy.non_member.attributes(attributes_kwargs),
+                )
+            elif not (user.is_connected() or user.is_whitelisted()):
+                return (
+                    sw_name,
+                    room,
+                    "Non-contributing member",
+                    policy.non_member.vlan_id,
+                    policy.non_member.accept,
+                    policy.non_member.attributes(attributes_kwargs),
+                )
+        # else: user OK, so we check MAC now
+
+    # If we are authenticating with mac, we look for the interfaces and its mac address
+    if port.radius_mode == "COMMON" or port.radius_mode == "STRICT":
+        # Mac auth
+        with radius_phase("mac_lookup"):
+            interface = (
+                Interface.objects.filter(mac_address=mac_address)
+                .select_related("machine__user")
+                .select_related("ipv4")
+                .first()
+            )
+        # If mac is unknown,
+        if not interface:
+            room = port.room
+            # We try to register mac, if autocapture is enabled
+            # Final decision depend on RADIUSOption set in re2o
+            if nas_type.autocapture_mac:
+                return (
+                    sw_name,
+                    room,
+                    "Unknown mac/interface",
+                    policy.unknown_machine.vlan_id,
+                    policy.unknown_machine.accept,
+                    policy.unknown_machine.attributes(attributes_kwargs),
+                )
+            # Otherwise, if autocapture mac is not enabled,
+            else:
+                return (
+                    sw_name,
+                    "",
+                    "Unknown mac/interface",
+                    policy.unknown_machine.vlan_id,
+                    policy.unknown_machine.accept,
+                    policy.unknown_machine.attributes(attributes_kwargs),
+                )
+
+        # Mac/Interface is found, check if related user is contributing and ok
+        # If needed, set ipv4 to it
+        else:
+            room = port.room
+            with radius_phase("user_access"):
+                user_banned = interface.machine.user.is_ban()
+            if user_banned:
+                return (
+                    sw_name,
+                    room,
+                    "Banned user",
+                    policy.banned.vlan_id,
+                    policy.banned.accept,
+                    policy.banned.attributes(attributes_kwargs),
+                )
+            with radius_phase("user_access"):
+                interface_active = interface.is_active
+            if not interface_active:
+                return (
+                    sw_name,
+                    room,
+                    "Disabled interface / non-contributing member",
+                    policy.non_member.vlan_id,
+                    policy.non_member.accept,
+                    policy.non_member.attributes(attributes_kwargs),
+                )
+            # If settings is set to related interface vlan policy based on interface type:
+            if policy.general_policy == RadiusOption.MACHINE:
+                DECISION_VLAN = interface.machine_type.ip_type.vlan.vlan_id
+            if not interface.ipv4:
+                interface.assign_ipv4()
+                return (
+                    sw_name,
+                    room,
+                    "Ok, assigning new ipv4" + extra_log,
+                    DECISION_VLAN,
+                    True,
+                    attributes,
+                )
+            else:
+                return (
+                    sw_name,
+                    room,
+                    "Interface OK" + extra_log,
+                    DECISION_VLAN,
+                    True,
+                    attributes,
+                )
@@ -95,6 +95,7 @@ MIDDLEWARE_CLASSES = (
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "reversion.middleware.RevisionMiddleware",
+    "re2o.middleware.AccessMemoMiddleware",
 )
 
 AUTHENTICATION_BACKENDS = ["re2o.login.RecryptBackend"]
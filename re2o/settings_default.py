@@ -54,6 +54,17 @@ UID_RANGES = {"users": [21001, 30000], "service-users": [20000, 21000]}
 # A range of GID to use. Used in linux environement
 GID_RANGES = {"posix": [501, 600]}
 
+# The file where the freeradius backend writes its statistics, see the
+# radius_stats management command
+RADIUS_STATS_FILE = "/var/tmp/re2o_radius_stats.json"
+
+# Database connections of the freeradius backend: lifetime of a connection
+# (in seconds), maximum number of connections in use at once, and how long a
+# request waits for one (in seconds)
+RADIUS_DB_CONN_MAX_AGE = 600
+RADIUS_DB_MAX_CONNECTIONS = 16
+RADIUS_DB_WAIT_TIMEOUT = 2
+
 # If you want to add a database routers, please fill in above and add your databse.
 # Then, add a file "local_routers.py" in folder app re2o, and add your router path in
 # the LOCAL_ROUTERS var as "re2o.local_routers.DbRouter". You can also add extra routers. 
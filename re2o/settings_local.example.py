@@ -68,6 +68,20 @@ DATABASES = {
     },
 }
 
+# The cache shared by the processes of re2o (web server workers, freeradius
+# backend). It holds the version stamps of the NAS, switch ports and RADIUS
+# policy indexes kept by the freeradius backend, of the DNS zones and of the
+# services regeneration: with a cache local to each process (the default),
+# the changes made in a process are only seen by the others after a restart.
+# The database cache needs no other service, create its table with
+# `python3 manage.py createcachetable`. memcached can be used instead.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "re2o_cache",
+    }
+}
+
 # Security settings for secure https
 # Activate once https is correctly configured
 SECURE_CONTENT_TYPE_NOSNIFF = False
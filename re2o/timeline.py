@@ -0,0 +1,406 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Access timeline of the users.
+
+re2o.utils.all_has_access and its siblings answer for one date, with one
+query per call. AccessTimeline loads the cotisations, bans and whitelists
+overlapping a date range once, and sweeps them to know who is a member,
+connected, banned, whitelisted and has access at every sample date (every
+day or hour) of the range, with the same rules as re2o.utils.
+
+AccessScheduler keeps the upcoming starts and ends of these periods in a
+priority queue, and when they pass, synchronises the users whose access
+changed and asks the regeneration of the services which depend on it.
+"""
+
+from __future__ import unicode_literals
+
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from cotisations.models import Cotisation
+from machines.models import regen
+from preferences.models import AssoOption
+from re2o.utils import all_adherent_exists, all_has_access_exists
+from users import signals
+from users.models import Ban, User, UserAccessState, Whitelist
+
+
+SERIES = ("adherent", "conn", "baned", "whitelisted", "has_access")
+
+
+def sample_dates(start, end, step=timedelta(days=1)):
+    """Dates from start to end (included) every step."""
+    dates = []
+    date = start
+    while date <= end:
+        dates.append(date)
+        date += step
+    return dates
+
+
+def merge_ranges(ranges):
+    """Merge overlapping or adjacent [first, last) index ranges."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1]:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+class AccessTimeline(object):
+    """Members, connected, banned, whitelisted users and users with access
+    at each of the sample dates.
+
+    Parameters:
+        dates (list of django datetime): Sorted sample dates, see
+            sample_dates
+        including_asso (boolean): Decide if org itself is included in
+            results, as in re2o.utils
+        dormitory (Dormitory): Only the users of this dormitory
+        user_type (string): "all", "adherent" or "club"
+        group_by (string): None, "dormitory" or "user_type", to count the
+            users of each dormitory or each type separately
+
+    """
+
+    def __init__(
+        self,
+        dates,
+        including_asso=True,
+        dormitory=None,
+        user_type="all",
+        group_by=None,
+    ):
+        if group_by not in (None, "dormitory", "user_type"):
+            raise ValueError("Unknown group: %r" % group_by)
+        self.dates = list(dates)
+        self.including_asso = including_asso
+        self.dormitory = dormitory
+        self.user_type = user_type
+        self.group_by = group_by
+        # series -> user id -> merged [first, last) index ranges
+        self.ranges = dict((name, {}) for name in SERIES)
+        # user id -> group
+        self.groups = {}
+        self.build()
+
+    def index_range(self, start, end):
+        """Indices of the sample dates strictly between start and end, as
+        the date_start__lt and date_end__gt filters of re2o.utils."""
+        return bisect_right(self.dates, start), bisect_left(self.dates, end)
+
+    def user_filter(self):
+        """Filter of the users in scope, as re2o.utils.filter_results."""
+        query_filter = Q()
+        if self.dormitory:
+            query_filter &= Q(adherent__room__building__dormitory=self.dormitory) | Q(
+                club__room__building__dormitory=self.dormitory
+            )
+        if self.user_type == "adherent":
+            query_filter &= Q(adherent__isnull=False)
+        if self.user_type == "club":
+            query_filter &= Q(club__isnull=False)
+        return query_filter
+
+    def load_users(self):
+        """Users in scope, their group and whether their state allows an
+        access."""
+        allowed = {}
+        for user_id, state, email_state, adherent, club, adherent_dorm, club_dorm in (
+            User.objects.filter(self.user_filter()).values_list(
+                "id",
+                "state",
+                "email_state",
+                "adherent",
+                "club",
+                "adherent__room__building__dormitory",
+                "club__room__building__dormitory",
+            )
+        ):
+            allowed[user_id] = (
+                state == User.STATE_ACTIVE
+                and email_state != User.EMAIL_STATE_UNVERIFIED
+            )
+            if self.group_by == "dormitory":
+                self.groups[user_id] = adherent_dorm or club_dorm
+            elif self.group_by == "user_type":
+                self.groups[user_id] = (
+                    "adherent" if adherent else "club" if club else None
+                )
+            else:
+                self.groups[user_id] = None
+        return allowed
+
+    def load_periods(self, users, queryset, user_field, fields):
+        """Index ranges of the periods of the users in scope, one dict per
+        (start, end) couple of fields."""
+        periods = [defaultdict(list) for _fields in fields]
+        first, last = self.dates[0], self.dates[-1]
+        columns = [user_field] + [field for couple in fields for field in couple]
+        overlap = Q()
+        for start_field, end_field in fields:
+            overlap |= Q(**{start_field + "__lt": last, end_field + "__gt": first})
+        for row in queryset.filter(overlap).values_list(*columns):
+            user_id = row[0]
+            if user_id not in users:
+                continue
+            for position, user_periods in enumerate(periods):
+                first_index, last_index = self.index_range(
+                    row[1 + 2 * position], row[2 + 2 * position]
+                )
+                if first_index < last_index:
+                    user_periods[user_id].append((first_index, last_index))
+        return [
+            dict(
+                (user_id, merge_ranges(ranges))
+                for user_id, ranges in user_periods.items()
+            )
+            for user_periods in periods
+        ]
+
+    def access_ranges(self, adherent, conn, baned, whitelisted):
+        """Ranges where whitelisted or (adherent and connected), and not
+        banned, from the ranges of one user."""
+        boundaries = sorted(
+            set(
+                index
+                for ranges in (adherent, conn, baned, whitelisted)
+                for couple in ranges
+                for index in couple
+            )
+        )
+
+        def covered(ranges, index):
+            return any(first <= index < last for first, last in ranges)
+
+        access = []
+        for first, last in zip(boundaries, boundaries[1:]):
+            if not covered(baned, first) and (
+                covered(whitelisted, first)
+                or (covered(adherent, first) and covered(conn, first))
+            ):
+                access.append((first, last))
+        return merge_ranges(access)
+
+    def build(self):
+        """Load the periods overlapping the sample dates and compute the
+        ranges of each series."""
+        if not self.dates:
+            return
+        allowed = self.load_users()
+        adherent, conn = self.load_periods(
+            allowed,
+            Cotisation.objects.filter(vente__facture__facture__valid=True),
+            "vente__facture__facture__user",
+            (("date_start_memb", "date_end_memb"), ("date_start_con", "date_end_con")),
+        )
+        (baned,) = self.load_periods(
+            allowed, Ban.objects.all(), "user", (("date_start", "date_end"),)
+        )
+        (whitelisted,) = self.load_periods(
+            allowed, Whitelist.objects.all(), "user", (("date_start", "date_end"),)
+        )
+        if self.including_asso:
+            asso_user = AssoOption.get_cached_value("utilisateur_asso")
+            if asso_user and asso_user.id in allowed:
+                allowed[asso_user.id] = True
+                adherent[asso_user.id] = conn[asso_user.id] = [(0, len(self.dates))]
+        self.ranges["adherent"] = adherent
+        self.ranges["conn"] = conn
+        self.ranges["baned"] = baned
+        self.ranges["whitelisted"] = whitelisted
+        for user_id in set(whitelisted) | (set(adherent) & set(conn)):
+            if not allowed[user_id]:
+                continue
+            ranges = self.access_ranges(
+                adherent.get(user_id, []),
+                conn.get(user_id, []),
+                baned.get(user_id, []),
+                whitelisted.get(user_id, []),
+            )
+            if ranges:
+                self.ranges["has_access"][user_id] = ranges
+
+    def counts(self, series, user_ids=None):
+        """Number of users of the series at each sample date, per group if
+        the timeline is grouped.
+
+        Parameters:
+            series (string): One of SERIES
+            user_ids (set): Only count these users
+
+        Returns:
+            A list of counts, or a dict of lists of counts per group
+
+        """
+        deltas = defaultdict(lambda: [0] * (len(self.dates) + 1))
+        for user_id, ranges in self.ranges[series].items():
+            if user_ids is not None and user_id not in user_ids:
+                continue
+            group_deltas = deltas[self.groups[user_id]]
+            for first, last in ranges:
+                group_deltas[first] += 1
+                group_deltas[last] -= 1
+        counts = {}
+        for group, group_deltas in deltas.items():
+            total, counts[group] = 0, []
+            for delta in group_deltas[:-1]:
+                total += delta
+                counts[group].append(total)
+        if self.group_by is None:
+            return counts.get(None, [0] * len(self.dates))
+        return counts
+
+    def users(self, series, index):
+        """Ids of the users of the series at the sample date of this
+        index."""
+        return set(
+            user_id
+            for user_id, ranges in self.ranges[series].items()
+            if any(first <= index < last for first, last in ranges)
+        )
+
+
+class AccessScheduler(object):
+    """Priority queue of the dates at which a cotisation, a ban or a
+    whitelist starts or ends, i.e. at which the access of a user may change.
+
+    When the dates pass, only the users whose membership or access actually
+    changed are handled: their UserAccessState is refreshed, their access
+    is synchronised (users.signals.synchronise) if it changed, and the
+    services depending on the access (dhcp, mac_ip_list, dns) or on the
+    membership (mailing) are asked to regenerate.
+
+    Parameters:
+        horizon (timedelta): How far in the future the dates are loaded
+        since (django datetime): Date from which the transitions are
+            handled, defaults to now
+
+    """
+
+    def __init__(self, horizon=timedelta(days=1), since=None):
+        self.horizon = horizon
+        self.checked_at = since or timezone.now()
+        self.loaded_at = None
+        self.loaded_until = self.checked_at
+        self.queue = []
+
+    def load(self, now):
+        """Build the queue of the transitions after the last check and
+        before now + horizon. Called again to see the periods created or
+        edited since the last load."""
+        until = now + self.horizon
+        transitions = set()
+        cotisations = Cotisation.objects.filter(vente__facture__facture__valid=True)
+        for field in ("date_start_memb", "date_end_memb", "date_start_con", "date_end_con"):
+            transitions.update(
+                cotisations.filter(
+                    **{field + "__gt": self.checked_at, field + "__lte": until}
+                ).values_list(field, "vente__facture__facture__user")
+            )
+        for model in (Ban, Whitelist):
+            for field in ("date_start", "date_end"):
+                transitions.update(
+                    model.objects.filter(
+                        **{field + "__gt": self.checked_at, field + "__lte": until}
+                    ).values_list(field, "user")
+                )
+        self.queue = list(transitions)
+        heapq.heapify(self.queue)
+        self.loaded_at = now
+        self.loaded_until = until
+
+    def next_transition(self):
+        """Date of the next transition in the queue, None if it is empty."""
+        return self.queue[0][0] if self.queue else None
+
+    def due(self, now):
+        """Pop the transitions passed at now, return the ids of their
+        users."""
+        user_ids = set()
+        while self.queue and self.queue[0][0] <= now:
+            user_ids.add(heapq.heappop(self.queue)[1])
+        return user_ids
+
+    def changes(self, user_ids, before, after):
+        """Users of user_ids whose membership, and whose access, differ
+        between the two dates."""
+
+        def states(date):
+            return [
+                set(
+                    builder(search_time=date)
+                    .filter(pk__in=user_ids)
+                    .values_list("pk", flat=True)
+                )
+                for builder in (all_adherent_exists, all_has_access_exists)
+            ]
+
+        membership_before, access_before = states(before)
+        membership_after, access_after = states(after)
+        return membership_before ^ membership_after, access_before ^ access_after
+
+    def fire(self, membership, access):
+        """Refresh and synchronise the users whose membership or access
+        changed, and ask the regeneration of the services."""
+        for user in User.objects.filter(pk__in=membership | access):
+            UserAccessState.refresh(user)
+            if user.pk in access:
+                signals.synchronise.send(
+                    sender=User,
+                    instance=user,
+                    base=False,
+                    access_refresh=True,
+                    mac_refresh=False,
+                )
+        if access:
+            regen("dhcp")
+            regen("mac_ip_list")
+            regen("dns")
+        if membership:
+            regen("mailing")
+
+    def run_pending(self, now=None):
+        """Handle the transitions passed since the last check.
+
+        Returns:
+            The ids of the users whose membership changed and of the users
+            whose access changed
+
+        """
+        now = now or timezone.now()
+        if now >= self.loaded_until:
+            self.load(now)
+        user_ids = self.due(now)
+        membership, access = set(), set()
+        if user_ids:
+            membership, access = self.changes(user_ids, self.checked_at, now)
+            self.fire(membership, access)
+        self.checked_at = now
+        return membership, access
@@ -37,7 +37,7 @@ Functions:
 from __future__ import unicode_literals
 
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
 from django.contrib.auth.models import Permission, Group
 
 from cotisations.models import Cotisation, Facture, Vente
@@ -247,6 +247,165 @@ def all_has_access(search_time=None, including_asso=True, dormitory=None, user_t
     ).distinct()
 
 
+def cotisation_exists(search_time, start_field, end_field):
+    """Return a correlated EXISTS expression, true for the users who have a
+    valid cotisation running at search_time.
+
+    Parameters:
+        search_time (django datetime): Datetime to perform this search
+        start_field (string): start date field of the cotisation
+            (date_start_memb or date_start_con)
+        end_field (string): end date field of the cotisation
+            (date_end_memb or date_end_con)
+
+    Returns:
+        django expression: Exists expression to annotate a User queryset with
+
+    """
+    return Exists(
+        Cotisation.objects.filter(
+            **{
+                "vente__facture__facture__valid": True,
+                "vente__facture__facture__user": OuterRef("pk"),
+                start_field + "__lt": search_time,
+                end_field + "__gt": search_time,
+            }
+        )
+    )
+
+
+def period_exists(model, search_time):
+    """Return a correlated EXISTS expression, true for the users who have a
+    Ban or a Whitelist (model) running at search_time.
+
+    Returns:
+        django expression: Exists expression to annotate a User queryset with
+
+    """
+    return Exists(
+        model.objects.filter(
+            user=OuterRef("pk"), date_start__lt=search_time, date_end__gt=search_time
+        )
+    )
+
+
+def filter_exists(
+    annotation, expression, including_asso=False, dormitory=None, user_type="all"
+):
+    """Annotate the users with an EXISTS expression and filter the ones for
+    which it is true. Shared by the *_exists functions.
+
+    Returns:
+        django queryset: Django queryset of the users
+
+    """
+    filter_user = Q(**{annotation: True})
+    if including_asso:
+        asso_user = AssoOption.get_cached_value("utilisateur_asso")
+        if asso_user:
+            filter_user |= Q(id=asso_user.id)
+    filter_user = filter_results(filter_user, dormitory, user_type)
+    # Django can't filter on an Exists expression without annotating it
+    return User.objects.annotate(**{annotation: expression}).filter(filter_user)
+
+
+def all_adherent_exists(search_time=None, including_asso=True, dormitory=None, user_type="all"):
+    """Same as all_adherent, with a correlated EXISTS instead of the joins
+    and the DISTINCT."""
+    if search_time is None:
+        search_time = timezone.now()
+    return filter_exists(
+        "membership_running",
+        cotisation_exists(search_time, "date_start_memb", "date_end_memb"),
+        including_asso=including_asso,
+        dormitory=dormitory,
+        user_type=user_type,
+    )
+
+
+def all_baned_exists(search_time=None, dormitory=None, user_type="all"):
+    """Same as all_baned, with a correlated EXISTS instead of the joins and
+    the DISTINCT."""
+    if search_time is None:
+        search_time = timezone.now()
+    return filter_exists(
+        "ban_running",
+        period_exists(Ban, search_time),
+        dormitory=dormitory,
+        user_type=user_type,
+    )
+
+
+def all_whitelisted_exists(search_time=None, dormitory=None, user_type="all"):
+    """Same as all_whitelisted, with a correlated EXISTS instead of the joins
+    and the DISTINCT."""
+    if search_time is None:
+        search_time = timezone.now()
+    return filter_exists(
+        "whitelist_running",
+        period_exists(Whitelist, search_time),
+        dormitory=dormitory,
+        user_type=user_type,
+    )
+
+
+def all_conn_exists(search_time=None, including_asso=True, dormitory=None, user_type="all"):
+    """Same as all_conn, with a correlated EXISTS instead of the joins and
+    the DISTINCT."""
+    if search_time is None:
+        search_time = timezone.now()
+    return filter_exists(
+        "connection_running",
+        cotisation_exists(search_time, "date_start_con", "date_end_con"),
+        including_asso=including_asso,
+        dormitory=dormitory,
+        user_type=user_type,
+    )
+
+
+def all_has_access_exists(search_time=None, including_asso=True, dormitory=None, user_type="all"):
+    """Same as all_has_access, in a single query: the memberships,
+    connections, bans and whitelists are correlated EXISTS on the users
+    instead of nested id__in subqueries with DISTINCT.
+
+    Parameters:
+        search_time (django datetime): Datetime to perform this search,
+        if not provided, search_time will be set à timezone.now()
+        including_asso (boolean): Decide if org itself is included in results
+
+    Returns:
+        django queryset: Django queryset containing all valid connection users
+
+    """
+    if search_time is None:
+        search_time = timezone.now()
+    filter_user = (
+        Q(state=User.STATE_ACTIVE)
+        & ~Q(email_state=User.EMAIL_STATE_UNVERIFIED)
+    )
+    paid_access = Q(membership_running=True) & Q(connection_running=True)
+    if including_asso:
+        asso_user = AssoOption.get_cached_value("utilisateur_asso")
+        if asso_user:
+            filter_user |= Q(id=asso_user.id)
+            paid_access |= Q(id=asso_user.id)
+    filter_user = filter_results(filter_user, dormitory, user_type)
+    return User.objects.annotate(
+        membership_running=cotisation_exists(
+            search_time, "date_start_memb", "date_end_memb"
+        ),
+        connection_running=cotisation_exists(
+            search_time, "date_start_con", "date_end_con"
+        ),
+        ban_running=period_exists(Ban, search_time),
+        whitelist_running=period_exists(Whitelist, search_time),
+    ).filter(
+        filter_user
+        & (Q(whitelist_running=True) | paid_access)
+        & Q(ban_running=False)
+    )
+
+
 def filter_active_interfaces(interface_set):
     """Return a filter for filtering all interfaces of people who have an valid
     internet access at org.
@@ -264,9 +423,9 @@ def filter_active_interfaces(interface_set):
     """
     return (
         interface_set.filter(
-            machine__in=Machine.objects.filter(user__in=all_has_access()).filter(
-                active=True
-            )
+            machine__in=Machine.objects.filter(
+                user__in=all_has_access_exists().values("pk")
+            ).filter(active=True)
         )
         .select_related("domain")
         .select_related("machine")
@@ -48,7 +48,8 @@ from django.utils.translation import ugettext_lazy as _
 from reversion import revisions as reversion
 
 from preferences.models import OptionalTopologie, RadiusKey, SwitchManagementCred
-from machines.models import Machine, regen, Role, MachineType, Ipv6List
+from machines.models import Machine, regen, Role, MachineType, Ipv6List, Nas, Vlan
+from re2o.base import bump_cache_version
 from re2o.mixins import AclMixin, RevMixin
 
 
@@ -849,6 +850,8 @@ class Port(AclMixin, RevMixin, models.Model):
     )
     details = models.CharField(max_length=255, blank=True)
 
+    INDEX_VERSION_KEY = "port_index_version"
+
     class Meta:
         unique_together = ("switch", "port")
         permissions = (("view_port", _("Can view a port object")),)
@@ -890,6 +893,11 @@ class Port(AclMixin, RevMixin, models.Model):
         else:
             return Switch.nothing_profile()
 
+    @classmethod
+    def refresh_index(cls):
+        """Ask the freeradius backends to rebuild their port index."""
+        bump_cache_version(cls.INDEX_VERSION_KEY)
+
     @classmethod
     def get_instance(cls, port_id, *_args, **kwargs):
         return (
@@ -1175,6 +1183,7 @@ def ap_post_save(**_kwargs):
     """Regenerate the AP names towards the controller."""
     regen("unifi-ap-names")
     regen("graph_topo")
+    Port.refresh_index()
 
 
 @receiver(post_delete, sender=AccessPoint)
@@ -1182,22 +1191,32 @@ def ap_post_delete(**_kwargs):
     """Regenerate the AP names towards the controller."""
     regen("unifi-ap-names")
     regen("graph_topo")
+    Port.refresh_index()
+
+
+@receiver(post_save, sender=Stack)
+def stack_post_save(**_kwargs):
+    """Rebuild the freeradius index of the stacked switches."""
+    Port.refresh_index()
 
 
 @receiver(post_delete, sender=Stack)
 def stack_post_delete(**_kwargs):
     """Empty the stack member ID of switches when a stack is deleted."""
     Switch.objects.filter(stack=None).update(stack_member_id=None)
+    Port.refresh_index()
 
 
 @receiver(post_save, sender=Port)
 def port_post_save(**_kwargs):
     regen("graph_topo")
+    Port.refresh_index()
 
 
 @receiver(post_delete, sender=Port)
 def port_post_delete(**_kwargs):
     regen("graph_topo")
+    Port.refresh_index()
 
 
 @receiver(post_save, sender=ModelSwitch)
@@ -1213,18 +1232,46 @@ def modelswitch_post_delete(**_kwargs):
 @receiver(post_save, sender=Building)
 def building_post_save(**_kwargs):
     regen("graph_topo")
+    Port.refresh_index()
 
 
 @receiver(post_delete, sender=Building)
 def building_post_delete(**_kwargs):
     regen("graph_topo")
+    Port.refresh_index()
 
 
 @receiver(post_save, sender=Switch)
 def switch_post_save(**_kwargs):
     regen("graph_topo")
+    Nas.refresh_index()
+    Port.refresh_index()
 
 
 @receiver(post_delete, sender=Switch)
 def switch_post_delete(**_kwargs):
     regen("graph_topo")
+    Nas.refresh_index()
+    Port.refresh_index()
+
+
+@receiver(post_save, sender=SwitchBay)
+@receiver(post_delete, sender=SwitchBay)
+@receiver(post_save, sender=Dormitory)
+@receiver(post_delete, sender=Dormitory)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+@receiver(post_save, sender=PortProfile)
+@receiver(post_delete, sender=PortProfile)
+def port_index_post_change(**_kwargs):
+    """Rebuild the freeradius port index when a port profile or the location
+    of a port changes."""
+    Port.refresh_index()
+
+
+@receiver(post_save, sender=Vlan)
+@receiver(post_delete, sender=Vlan)
+def vlan_post_change(**_kwargs):
+    """Rebuild the freeradius port index when a VLAN changes, its VLAN ID is
+    stored in the decisions of the ports whose profile forces it."""
+    Port.refresh_index()
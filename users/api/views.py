@@ -35,7 +35,11 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """Exposes list and details of `users.models.Users` objects.
     """
 
-    queryset = users.User.objects.all()
+    # The access state is annotated and the balance joined to serialize
+    # access, end_access and solde without querying for each user
+    queryset = users.User.objects.with_access_state().select_related(
+        "balance_totals"
+    )
     serializer_class = serializers.UserSerializer
 
 
@@ -69,7 +73,9 @@ class ClubViewSet(viewsets.ReadOnlyModelViewSet):
     """Exposes list and details of `users.models.Club` objects.
     """
 
-    queryset = users.Club.objects.all()
+    queryset = users.Club.objects.with_access_state().select_related(
+        "balance_totals"
+    )
     serializer_class = serializers.ClubSerializer
 
 
@@ -77,7 +83,9 @@ class AdherentViewSet(viewsets.ReadOnlyModelViewSet):
     """Exposes list and details of `users.models.Adherent` objects.
     """
 
-    queryset = users.Adherent.objects.all()
+    queryset = users.Adherent.objects.with_access_state().select_related(
+        "balance_totals"
+    )
     serializer_class = serializers.AdherentSerializer
 
 
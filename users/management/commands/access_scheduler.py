@@ -0,0 +1,97 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from re2o.timeline import AccessScheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Synchronise the users and regenerate the services when a membership,"
+        " a connection, a ban or a whitelist starts or ends."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--horizon",
+            type=int,
+            default=24,
+            help="Number of hours of upcoming transitions kept in the queue.",
+        )
+        parser.add_argument(
+            "--reload",
+            type=int,
+            default=300,
+            help="Number of seconds between two reloads of the queue, to see"
+            " the periods created or edited meanwhile.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Handle the transitions of the last --since minutes and exit"
+            " (e.g. from a cron job).",
+        )
+        parser.add_argument(
+            "--since",
+            type=int,
+            default=5,
+            help="Number of minutes of past transitions handled with --once.",
+        )
+
+    def handle_pending(self, scheduler):
+        membership, access = scheduler.run_pending()
+        if membership or access:
+            self.stdout.write(
+                "%s : membership changed for %d users, access changed for %d users."
+                % (
+                    timezone.localtime(scheduler.checked_at).strftime("%d/%m/%Y %H:%M:%S"),
+                    len(membership),
+                    len(access),
+                )
+            )
+
+    def handle(self, *args, **options):
+        horizon = datetime.timedelta(hours=options["horizon"])
+        if options["once"]:
+            scheduler = AccessScheduler(
+                horizon=horizon,
+                since=timezone.now() - datetime.timedelta(minutes=options["since"]),
+            )
+            self.handle_pending(scheduler)
+            return
+
+        scheduler = AccessScheduler(horizon=horizon)
+        reload_every = datetime.timedelta(seconds=options["reload"])
+        while True:
+            close_old_connections()
+            now = timezone.now()
+            if scheduler.loaded_at is None or now >= scheduler.loaded_at + reload_every:
+                scheduler.load(now)
+            self.handle_pending(scheduler)
+            wake_up = min(
+                scheduler.next_transition() or scheduler.loaded_until,
+                scheduler.loaded_at + reload_every,
+            )
+            time.sleep(max(1, (wake_up - timezone.now()).total_seconds()))
@@ -0,0 +1,110 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import argparse
+import csv
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import make_aware
+
+from re2o.timeline import SERIES, AccessTimeline, sample_dates
+from topologie.models import Dormitory
+
+
+def valid_date(s):
+    try:
+        return make_aware(datetime.datetime.strptime(s, "%d/%m/%Y"))
+    except ValueError:
+        msg = "Not a valid date: '{0}'.".format(s)
+        raise argparse.ArgumentTypeError(msg)
+
+
+class Command(BaseCommand):
+    help = (
+        "Output as CSV the number of members, connected, banned, whitelisted"
+        " users and users with access at each day (or hour) of a date range."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", type=valid_date, help="First date (dd/mm/yyyy).")
+        parser.add_argument("end", type=valid_date, help="Last date (dd/mm/yyyy).")
+        parser.add_argument(
+            "--hourly", action="store_true", help="One sample per hour instead of per day."
+        )
+        parser.add_argument(
+            "--dormitory", "-d", help="Only count the users of this dormitory (name)."
+        )
+        parser.add_argument(
+            "--user-type",
+            "-t",
+            choices=("all", "adherent", "club"),
+            default="all",
+            help="Only count this type of users.",
+        )
+        parser.add_argument(
+            "--group-by",
+            "-g",
+            choices=("dormitory", "user_type"),
+            help="One set of columns per dormitory or per type of users.",
+        )
+
+    def handle(self, *args, **options):
+        if options["end"] < options["start"]:
+            raise CommandError("The end date is before the start date.")
+        dormitory = None
+        if options["dormitory"]:
+            try:
+                dormitory = Dormitory.objects.get(name=options["dormitory"])
+            except Dormitory.DoesNotExist:
+                raise CommandError("Unknown dormitory %s." % options["dormitory"])
+        step = datetime.timedelta(hours=1 if options["hourly"] else 24)
+        timeline = AccessTimeline(
+            sample_dates(options["start"], options["end"], step),
+            including_asso=False,
+            dormitory=dormitory,
+            user_type=options["user_type"],
+            group_by=options["group_by"],
+        )
+        counts = dict((series, timeline.counts(series)) for series in SERIES)
+        if options["group_by"] == "dormitory":
+            names = dict(Dormitory.objects.values_list("id", "name"))
+        else:
+            names = {}
+        groups = [None]
+        if options["group_by"]:
+            groups = sorted(
+                set(group for series in SERIES for group in counts[series]),
+                key=lambda group: (group is None, str(names.get(group, group))),
+            )
+        header = ["date"]
+        for group in groups:
+            prefix = "" if group is None and not options["group_by"] else "%s " % names.get(group, group)
+            header += [prefix + series for series in SERIES]
+        writer = csv.writer(self.stdout)
+        writer.writerow(header)
+        for index, date in enumerate(timeline.dates):
+            row = [date.strftime("%Y-%m-%d %H:%M" if options["hourly"] else "%Y-%m-%d")]
+            for group in groups:
+                for series in SERIES:
+                    values = counts[series]
+                    if options["group_by"]:
+                        values = values.get(group, [0] * len(timeline.dates))
+                    row.append(values[index])
+            writer.writerow(row)
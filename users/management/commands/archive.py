@@ -23,9 +23,10 @@ import argparse
 import datetime
 
 from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
 from django.utils.timezone import make_aware
 
-from re2o.utils import all_has_access
+from re2o.timeline import AccessTimeline, sample_dates
 from users.models import User
 
 
@@ -60,24 +61,43 @@ class Command(BaseCommand):
             action="store_true",
             help="Only show a list of users, without doing anything.",
         )
+        parser.add_argument(
+            "--preview",
+            "-p",
+            action="store_true",
+            help="Only show how many users would be archived for each date until --date, without doing anything.",
+        )
         parser.add_argument(
             "-y",
             action="store_true",
             help="Do not ask for confirmation before fully archiving.",
         )
 
+    def preview(self, date, full_archive):
+        """Number of users which would be archived with each date from now
+        to date, from one access timeline."""
+        dates = sample_dates(timezone.now(), max(date, timezone.now()))
+        timeline = AccessTimeline(dates)
+        candidates = set(
+            User.archive_candidates(full_archive).values_list("id", flat=True)
+        ) - timeline.users("has_access", 0)
+        counts = timeline.counts("has_access", user_ids=candidates)
+        for sample, with_access in zip(dates, counts):
+            self.stdout.write(
+                "%s : %s users" % (sample.strftime("%d/%m/%Y"), len(candidates) - with_access)
+            )
+
     def handle(self, *args, **kwargs):
         full_archive = kwargs["full"]
         date = kwargs["date"]
         force = kwargs["y"]
         show = kwargs["show"]
 
-        to_archive_list = (
-            User.objects.exclude(id__in=all_has_access())
-            .exclude(id__in=all_has_access(search_time=date))
-            .exclude(state=User.STATE_NOT_YET_ACTIVE)
-            .exclude(state=User.STATE_FULL_ARCHIVE)
-        )
+        if kwargs["preview"]:
+            self.preview(date, full_archive)
+            return
+
+        to_archive_list = User.archive_targets(date, full_archive=full_archive)
 
         if show:
             self.stdout.write("%s users found : " % to_archive_list.count())
@@ -98,14 +118,13 @@ class Command(BaseCommand):
                 "Fully archiving users with a membership ending prior to %s."
                 % date.strftime("%d/%m/%Y")
             )
-            User.mass_full_archive(to_archive_list)
+            count = User.mass_full_archive(to_archive_list)
         else:
             self.stdout.write(
                 "Archiving users with a membership ending prior to %s."
                 % date.strftime("%d/%m/%Y")
             )
-            to_archive_list = to_archive_list.exclude(state=User.STATE_ARCHIVE)
-            User.mass_archive(to_archive_list)
+            count = User.mass_archive(to_archive_list)
         self.stdout.write(
-            self.style.SUCCESS("%s users were archived." % to_archive_list.count())
+            self.style.SUCCESS("%s users were archived." % count)
         )
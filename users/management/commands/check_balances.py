@@ -0,0 +1,68 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from django.core.management.base import BaseCommand
+
+from users.models import User, UserBalance
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the balance of every user from the invoices and report the"
+        " stored balances which differ."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            "-f",
+            action="store_true",
+            help="Store the recomputed balances of the users with a drift or"
+            " without a stored balance.",
+        )
+
+    def handle(self, *args, **options):
+        stored = dict(
+            (balance.user_id, balance) for balance in UserBalance.objects.all()
+        )
+        drifted, missing = [], []
+        for user in UserBalance.with_totals(User.objects.order_by("pk")).iterator():
+            credit, debit = user.credit_total or 0, user.debit_total or 0
+            balance = stored.get(user.pk)
+            if balance is None:
+                missing.append(user.pk)
+            elif (balance.credit, balance.debit) != (credit, debit):
+                drifted.append(user.pk)
+                self.stdout.write(
+                    self.style.WARNING(
+                        "%s : stored credit %s and debit %s, %s and %s expected."
+                        % (user.pseudo, balance.credit, balance.debit, credit, debit)
+                    )
+                )
+        self.stdout.write(
+            "%d balances checked, %d with a drift, %d not stored."
+            % (len(stored), len(drifted), len(missing))
+        )
+        if options["fix"] and (drifted or missing):
+            to_fix = drifted + missing
+            for start in range(0, len(to_fix), 1000):
+                UserBalance.rebuild(User.objects.filter(pk__in=to_fix[start : start + 1000]))
+            self.stdout.write(
+                self.style.SUCCESS("%d balances fixed." % (len(drifted) + len(missing)))
+            )
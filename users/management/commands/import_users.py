@@ -0,0 +1,384 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Import adherents in bulk from a CSV file (with a header line) or a JSON file
+(a list of objects), e.g. the new students at the start of the year.
+
+The columns are pseudo, name, surname and email, and optionally telephone,
+comment, school (name), building and room (names, the missing rooms are
+created) and article (name of an article bought for each user, paid with
+the --payment method).
+
+The users, their email addresses, purchases and cotisations are created
+in bulk, in chunks with the model signals muted. Each chunk is committed in
+its own transaction with the access states and balances of its users, then
+its users are synchronised to the LDAP (without the group refresh, new
+users are in no group). The invoices are saved one by one, as bulk_create
+does not support the multi-table inheritance of Facture. If a chunk fails,
+the previous ones stay imported: remove their lines from the file before
+importing it again. At the end, the welcome and password emails are sent
+through a single connection, and each service is asked to regenerate once.
+"""
+
+import csv
+import json
+import os
+
+from dateutil.relativedelta import relativedelta
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+
+from cotisations.models import Article, Cotisation, Facture, Paiement, Vente
+from machines.models import regen
+from preferences.models import GeneralOption, MailMessageOption, OptionalUser
+from re2o.base import muted_signals
+from re2o.settings import UID_RANGES
+from topologie.models import Building, Room
+from users import signals
+from users.models import (
+    Adherent,
+    EMailAddress,
+    School,
+    User,
+    UserAccessState,
+    UserBalance,
+    linux_user_check,
+)
+
+
+REQUIRED_COLUMNS = ("pseudo", "name", "surname", "email")
+
+
+class Command(BaseCommand):
+    help = (
+        "Import adherents in bulk from a CSV or JSON file. Each chunk of"
+        " users is committed separately: if the import fails, the users of"
+        " the previous chunks stay imported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="CSV or JSON file of the users.")
+        parser.add_argument(
+            "--format",
+            choices=("csv", "json"),
+            help="Format of the file, guessed from its extension by default.",
+        )
+        parser.add_argument(
+            "--payment",
+            "-p",
+            help="Payment method (name) of the invoices of the article column.",
+        )
+        parser.add_argument(
+            "--chunk",
+            "-c",
+            type=int,
+            default=500,
+            help="Number of users created per chunk (and per transaction).",
+        )
+        parser.add_argument(
+            "--verified",
+            action="store_true",
+            help="Consider the email addresses of the users as verified.",
+        )
+        parser.add_argument(
+            "--no-mail",
+            action="store_true",
+            help="Do not send the welcome and password emails.",
+        )
+
+    def read(self, path, file_format):
+        """Rows of the file, as dicts."""
+        file_format = file_format or os.path.splitext(path)[1].lstrip(".").lower()
+        try:
+            with open(path) as users_file:
+                if file_format == "json":
+                    rows = json.load(users_file)
+                elif file_format == "csv":
+                    rows = list(csv.DictReader(users_file))
+                else:
+                    raise CommandError("Unknown format %s, use --format." % file_format)
+        except (IOError, ValueError) as error:
+            raise CommandError("Can't read %s: %s" % (path, error))
+        return [
+            dict((key, (value or "").strip()) for key, value in row.items())
+            for row in rows
+        ]
+
+    def resolve(self, rows, payment):
+        """Check the rows and find their school, room and article, with a
+        few queries for the whole file."""
+        errors = []
+        pseudos = [row.get("pseudo", "") for row in rows]
+        taken = set(
+            User.objects.filter(pseudo__in=pseudos).values_list("pseudo", flat=True)
+        ) | set(
+            EMailAddress.objects.filter(
+                local_part__in=[pseudo.lower() for pseudo in pseudos]
+            ).values_list("local_part", flat=True)
+        )
+        schools = dict(School.objects.values_list("name", "id"))
+        buildings = dict(Building.objects.values_list("name", "id"))
+        articles = dict((article.name, article) for article in Article.objects.all())
+        seen = set()
+        for line, row in enumerate(rows, 1):
+            missing = [column for column in REQUIRED_COLUMNS if not row.get(column)]
+            if missing:
+                errors.append("Line %d: missing %s." % (line, ", ".join(missing)))
+                continue
+            pseudo = row["pseudo"]
+            if not linux_user_check(pseudo) or len(pseudo) > 32:
+                errors.append("Line %d: invalid pseudo %s." % (line, pseudo))
+            if pseudo in seen or pseudo in taken or pseudo.lower() in taken:
+                errors.append("Line %d: pseudo %s already used." % (line, pseudo))
+            seen.add(pseudo)
+            if row.get("school") and row["school"] not in schools:
+                errors.append("Line %d: unknown school %s." % (line, row["school"]))
+            row["school_id"] = schools.get(row.get("school"))
+            if row.get("room"):
+                if row.get("building") not in buildings:
+                    errors.append(
+                        "Line %d: unknown building %s." % (line, row.get("building"))
+                    )
+                row["building_id"] = buildings.get(row.get("building"))
+            if row.get("article"):
+                if row["article"] not in articles:
+                    errors.append("Line %d: unknown article %s." % (line, row["article"]))
+                elif payment is None:
+                    errors.append("Line %d: an article requires --payment." % line)
+            row["article"] = articles.get(row.get("article"))
+        if errors:
+            raise CommandError("\n".join(errors))
+
+    def create_rooms(self, rows):
+        """Create the missing rooms, and set the room id of the rows. The
+        rooms already occupied by an adherent are refused."""
+        wanted = set(
+            (row["building_id"], row["room"]) for row in rows if row.get("room")
+        )
+        if not wanted:
+            return
+        building_ids = set(building_id for building_id, _name in wanted)
+
+        def existing():
+            return dict(
+                ((building_id, name), room_id)
+                for room_id, building_id, name in Room.objects.filter(
+                    building__in=building_ids
+                ).values_list("id", "building", "name")
+            )
+
+        rooms = existing()
+        Room.objects.bulk_create(
+            Room(building_id=building_id, name=name)
+            for building_id, name in wanted - set(rooms)
+        )
+        rooms = existing()
+        occupied = set(
+            Adherent.objects.filter(room__in=rooms.values()).values_list("room", flat=True)
+        )
+        errors = []
+        for line, row in enumerate(rows, 1):
+            if row.get("room"):
+                row["room_id"] = rooms[(row["building_id"], row["room"])]
+                if row["room_id"] in occupied:
+                    errors.append("Line %d: room %s already occupied." % (line, row["room"]))
+                occupied.add(row["room_id"])
+        if errors:
+            raise CommandError("\n".join(errors))
+
+    def free_uids(self):
+        """Iterator on the unused uids."""
+        used = set(User.objects.values_list("uid_number", flat=True))
+        for uid in range(int(min(UID_RANGES["users"])), int(max(UID_RANGES["users"]))):
+            if uid not in used:
+                yield uid
+
+    def create_chunk(self, rows, uids, payment, options):
+        """Create the users of a chunk of rows with their email address,
+        invoice and cotisation. Returns the ids of the users."""
+        all_users_active = OptionalUser.get_cached_value("all_users_active")
+        new_users = []
+        for row in rows:
+            article = row["article"]
+            user = User(
+                pseudo=row["pseudo"],
+                surname=row["surname"],
+                email=row["email"],
+                telephone=row.get("telephone") or None,
+                comment=row.get("comment", ""),
+                school_id=row["school_id"],
+                uid_number=next(uids),
+                pwd_ntlm="",
+                email_state=User.EMAIL_STATE_VERIFIED
+                if options["verified"]
+                else User.EMAIL_STATE_PENDING,
+                # As User.set_active
+                state=User.STATE_ACTIVE
+                if all_users_active
+                or (
+                    article
+                    and (article.duration_membership or article.duration_days_membership)
+                )
+                else User.STATE_NOT_YET_ACTIVE,
+            )
+            user.set_unusable_password()
+            new_users.append(user)
+        User.objects.bulk_create(new_users)
+        # The primary keys are not set by bulk_create on every database
+        user_ids = dict(
+            User.objects.filter(pseudo__in=[row["pseudo"] for row in rows]).values_list(
+                "pseudo", "id"
+            )
+        )
+        EMailAddress.objects.bulk_create(
+            EMailAddress(local_part=row["pseudo"].lower(), user_id=user_ids[row["pseudo"]])
+            for row in rows
+        )
+        invoices = {}
+        for row in rows:
+            # Multi-table inheritance: only the Adherent table is written,
+            # bulk_create does not support it
+            Adherent(
+                user_ptr_id=user_ids[row["pseudo"]],
+                name=row["name"],
+                room_id=row.get("room_id"),
+            ).save_base(raw=True, force_insert=True)
+            if row["article"] is None:
+                continue
+            # Same for the invoices
+            invoice = Facture(user_id=user_ids[row["pseudo"]], paiement=payment, valid=True)
+            invoice.save_base()
+            invoices[invoice.pk] = (invoice, row["article"])
+        Vente.objects.bulk_create(
+            Vente(
+                facture_id=invoice_id,
+                name=article.name,
+                prix=article.prix,
+                duration_connection=article.duration_connection,
+                duration_days_connection=article.duration_days_connection,
+                duration_membership=article.duration_membership,
+                duration_days_membership=article.duration_days_membership,
+                number=1,
+            )
+            for invoice_id, (_invoice, article) in invoices.items()
+        )
+        cotisations = []
+        for purchase in Vente.objects.filter(facture__in=invoices):
+            if not purchase.test_membership_or_connection():
+                continue
+            date = invoices[purchase.facture_id][0].date
+            cotisations.append(
+                Cotisation(
+                    vente_id=purchase.pk,
+                    date_start_con=date,
+                    date_end_con=date
+                    + relativedelta(
+                        months=purchase.duration_connection or 0,
+                        days=purchase.duration_days_connection or 0,
+                    ),
+                    date_start_memb=date,
+                    date_end_memb=date
+                    + relativedelta(
+                        months=purchase.duration_membership or 0,
+                        days=purchase.duration_days_membership or 0,
+                    ),
+                )
+            )
+        Cotisation.objects.bulk_create(cotisations)
+        return list(user_ids.values())
+
+    def send_mails(self, imported):
+        """Send the welcome emails and the emails to set the password, as
+        the users are created without one, through one connection."""
+        mailmessageoptions, _created = MailMessageOption.objects.get_or_create()
+        email_from = GeneralOption.get_cached_value("email_from")
+        site_url = GeneralOption.get_cached_value("main_site_url").rstrip("/")
+        messages = []
+        for user in imported.exclude(email=""):
+            subject, html_message = user.welcome_mail(mailmessageoptions)
+            message = EmailMultiAlternatives(subject, "", email_from, [user.email])
+            message.attach_alternative(html_message, "text/html")
+            messages.append(message)
+            subject, passwd_message = user.reset_passwd_message(
+                lambda path: site_url + path
+            )
+            messages.append(
+                EmailMessage(subject, passwd_message, email_from, [user.email])
+            )
+        return get_connection(fail_silently=True).send_messages(messages) or 0
+
+    def handle(self, *args, **options):
+        rows = self.read(options["file"], options["format"])
+        if not rows:
+            raise CommandError("No user to import.")
+        payment = None
+        if options["payment"]:
+            try:
+                payment = Paiement.objects.get(moyen=options["payment"])
+            except Paiement.DoesNotExist:
+                raise CommandError("Unknown payment method %s." % options["payment"])
+        self.resolve(rows, payment)
+
+        muted = (
+            pre_save,
+            post_save,
+            post_delete,
+            m2m_changed,
+            signals.synchronise,
+            signals.remove,
+        )
+        with transaction.atomic(), muted_signals(*muted):
+            self.create_rooms(rows)
+        uids = self.free_uids()
+        user_ids = []
+        try:
+            for start in range(0, len(rows), options["chunk"]):
+                chunk = rows[start : start + options["chunk"]]
+                with transaction.atomic(), muted_signals(*muted):
+                    chunk_ids = self.create_chunk(chunk, uids, payment, options)
+                    created = User.objects.filter(pk__in=chunk_ids)
+                    UserAccessState.rebuild(created)
+                    UserBalance.rebuild(created)
+                for user in created.order_by("pk").iterator():
+                    signals.synchronise.send(
+                        sender=User,
+                        instance=user,
+                        base=True,
+                        access_refresh=True,
+                        mac_refresh=False,
+                    )
+                user_ids += chunk_ids
+                self.stdout.write(
+                    "%d/%d users imported." % (len(user_ids), len(rows))
+                )
+        finally:
+            # The users of the committed chunks are imported even if a
+            # later chunk failed
+            imported = User.objects.filter(pk__in=user_ids)
+            if user_ids and not options["no_mail"]:
+                self.stdout.write("%d emails sent." % self.send_mails(imported))
+            if user_ids:
+                regen("mailing")
+            if user_ids and any(row["article"] for row in rows):
+                regen("dns")
+                regen("dhcp")
+                regen("mac_ip_list")
+        self.stdout.write(self.style.SUCCESS("%d users imported." % len(user_ids)))
@@ -0,0 +1,95 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import time
+from smtplib import SMTPException
+from socket import herror, gaierror
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from users.models import AutoregisterRequest
+
+
+class Command(BaseCommand):
+    help = (
+        "Register the machines captured by the freeradius backend (MAC"
+        " autocapture) and send the notification emails. The requests which"
+        " failed for a transient reason are tried again later. Only one"
+        " instance of this command should run at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            "-l",
+            action="store_true",
+            help="Keep running and process the new requests as they come.",
+        )
+        parser.add_argument(
+            "--interval",
+            "-i",
+            type=float,
+            default=5,
+            help="Seconds between two checks of the queue in loop mode.",
+        )
+        parser.add_argument(
+            "--batch",
+            "-b",
+            type=int,
+            default=100,
+            help="Maximum number of requests processed before sending the emails.",
+        )
+
+    def process_batch(self, size):
+        """Register a batch of machines, then send all their notification
+        emails through a single connection. Return the number of processed
+        requests."""
+        requests = list(
+            AutoregisterRequest.due()
+            .select_related("user", "nas__machine_type")
+            .order_by("created_at")[:size]
+        )
+        mails = []
+        for request in requests:
+            interface, reason = request.process()
+            if interface:
+                mails.append(request.user.auto_newmachine_mail(interface))
+                self.stdout.write("Registered %s" % request)
+            elif request.pk is not None:
+                self.stderr.write(
+                    "Failed to register %s (attempt %d, retrying at %s): %s"
+                    % (request, request.attempts, request.next_attempt, reason)
+                )
+            else:
+                self.stderr.write("Failed to register %s: %s" % (request, reason))
+        if mails:
+            try:
+                get_connection().send_messages(mails)
+            except (SMTPException, ConnectionError, herror, gaierror) as error:
+                self.stderr.write("Failed to send the emails: %s" % error)
+        return len(requests)
+
+    def handle(self, *args, **options):
+        while True:
+            while self.process_batch(options["batch"]) == options["batch"]:
+                pass
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
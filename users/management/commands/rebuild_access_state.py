@@ -0,0 +1,36 @@
+# -*- mode: python; coding: utf-8 -*-
+# Re2o est un logiciel d'administration développé initiallement au Rézo Metz. Il
+# se veut agnostique au réseau considéré, de manière à être installable en
+# quelques clics.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from django.core.management.base import BaseCommand
+
+from users.models import User, UserAccessState
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the materialized access state of every user from the"
+        " cotisations, bans and whitelists. The signals keep it up to date"
+        " afterwards."
+    )
+
+    def handle(self, *args, **options):
+        access_states = UserAccessState.rebuild(User.objects.all())
+        self.stdout.write(
+            self.style.SUCCESS("Access state rebuilt for %d users." % len(access_states))
+        )
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import macaddress.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machines', '0002_foreign_keys'),
+        ('users', '0002_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutoregisterRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mac_address', macaddress.fields.MACAddressField(integer=False, max_length=17, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('nas', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='machines.Nas')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'machine autoregistration request',
+                'verbose_name_plural': 'machine autoregistration requests',
+            },
+        ),
+    ]
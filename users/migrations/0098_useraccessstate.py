@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0097_autoregisterrequest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAccessState',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='access_state', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('end_adhesion', models.DateTimeField(blank=True, null=True)),
+                ('end_connexion', models.DateTimeField(blank=True, null=True)),
+                ('end_ban', models.DateTimeField(blank=True, null=True)),
+                ('end_whitelist', models.DateTimeField(blank=True, null=True)),
+                ('access', models.BooleanField(default=False)),
+                ('next_change', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'user access state',
+                'verbose_name_plural': 'user access states',
+            },
+        ),
+    ]
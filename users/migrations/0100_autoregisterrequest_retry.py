@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0099_userbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autoregisterrequest',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='autoregisterrequest',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='autoregisterrequest',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
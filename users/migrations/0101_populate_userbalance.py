@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def populate_balances(apps, schema_editor):
+    """Create the balance of every user which has none yet, from the same
+    totals as UserBalance.with_totals."""
+    db_alias = schema_editor.connection.alias
+    User = apps.get_model("users", "User")
+    UserBalance = apps.get_model("users", "UserBalance")
+    Vente = apps.get_model("cotisations", "Vente")
+
+    def totals(purchases):
+        return dict(
+            purchases.filter(facture__facture__valid=True)
+            .order_by()
+            .values("facture__facture__user")
+            .annotate(
+                total=models.Sum(
+                    models.F("prix") * models.F("number"),
+                    output_field=models.DecimalField(),
+                )
+            )
+            .values_list("facture__facture__user", "total")
+        )
+
+    purchases = Vente.objects.using(db_alias)
+    credits = totals(purchases.filter(name="solde"))
+    debits = totals(purchases.filter(facture__facture__paiement__is_balance=True))
+    user_ids = (
+        User.objects.using(db_alias)
+        .filter(balance_totals__isnull=True)
+        .values_list("pk", flat=True)
+    )
+    UserBalance.objects.using(db_alias).bulk_create(
+        [
+            UserBalance(
+                user_id=pk, credit=credits.get(pk) or 0, debit=debits.get(pk) or 0
+            )
+            for pk in user_ids
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cotisations', '0002_foreign_keys'),
+        ('users', '0100_autoregisterrequest_retry'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
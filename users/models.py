@@ -57,6 +57,7 @@ from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils.functional import cached_property
 from django.template import loader
+from django.core.mail import EmailMultiAlternatives
 from django.core.urlresolvers import reverse
 from django.db import transaction
 from django.utils import timezone
@@ -75,14 +76,16 @@ from django.core.files.uploadedfile import InMemoryUploadedFile
 from reversion import revisions as reversion
 
 
+from macaddress.fields import MACAddressField
+
 from re2o.settings import LDAP, GID_RANGES, UID_RANGES
 from re2o.field_permissions import FieldPermissionModelMixin
 from re2o.mixins import AclMixin, RevMixin
-from re2o.base import smtp_check
-from re2o.mail_utils import send_mail
+from re2o.base import forget_access, memoize_access, smtp_check
+from re2o.mail_utils import send_mail, send_mail_object
 
-from cotisations.models import Cotisation, Facture, Paiement, Vente
-from machines.models import Domain, Interface, Machine, regen
+from cotisations.models import Cotisation, Facture, Vente
+from machines.models import Domain, Interface, InterfaceChange, Machine, regen
 from preferences.models import GeneralOption, AssoOption, OptionalUser
 from preferences.models import OptionalMachine, MailMessageOption
 
@@ -191,6 +194,58 @@ class UserManager(BaseUserManager):
         """
         return self._create_user(pseudo, surname, email, password, True)
 
+    def with_access_state(self, at=None):
+        """Annotate the users with the end dates of their membership,
+        connection, bans and whitelists, computed with subqueries so that
+        a whole set of users is fetched in one query.
+
+        The annotations are end_adhesion_date, end_connexion_date,
+        end_ban_date and end_whitelist_date. When they are present,
+        end_adhesion, end_connexion, end_ban and end_whitelist (and thus
+        is_ban, is_connected, has_access, end_access...) return them without
+        querying.
+
+        Parameters:
+            at (datetime): if set, the access state at this date: only the
+                cotisations, bans and whitelists started at this date are
+                taken into account, and is_ban, is_connected, has_access...
+                are evaluated at this date (annotated as access_state_at).
+        """
+
+        def end_date(queryset, user_field, date_field):
+            return models.Subquery(
+                queryset.filter(**{user_field: models.OuterRef("pk")})
+                .order_by()
+                .values(user_field)
+                .annotate(end=models.Max(date_field))
+                .values("end")[:1],
+                output_field=models.DateTimeField(),
+            )
+
+        cotisations = Cotisation.objects.filter(vente__facture__facture__valid=True)
+        memberships = connections = cotisations
+        bans = Ban.objects.all()
+        whitelists = Whitelist.objects.all()
+        queryset = self.get_queryset()
+        if at is not None:
+            memberships = cotisations.filter(date_start_memb__lte=at)
+            connections = cotisations.filter(date_start_con__lte=at)
+            bans = bans.filter(date_start__lte=at)
+            whitelists = whitelists.filter(date_start__lte=at)
+            queryset = queryset.annotate(
+                access_state_at=models.Value(at, output_field=models.DateTimeField())
+            )
+        return queryset.annotate(
+            end_adhesion_date=end_date(
+                memberships, "vente__facture__facture__user", "date_end_memb"
+            ),
+            end_connexion_date=end_date(
+                connections, "vente__facture__facture__user", "date_end_con"
+            ),
+            end_ban_date=end_date(bans, "user", "date_end"),
+            end_whitelist_date=end_date(whitelists, "user", "date_end"),
+        )
+
 
 class User(
     RevMixin, FieldPermissionModelMixin, AbstractBaseUser, PermissionsMixin, AclMixin
@@ -239,6 +294,15 @@ class User(
         (2, _("Waiting for email confirmation")),
     )
 
+    # Failure codes of autoregister_machine
+    AUTOREGISTER_MAX_MACHINES = "max_machines"
+    AUTOREGISTER_NO_MACHINE_TYPE = "no_machine_type"
+    AUTOREGISTER_ERROR = "error"
+
+    # Number of users archived per transaction by mass_archive and
+    # mass_full_archive
+    ARCHIVE_CHUNK = 500
+
     surname = models.CharField(max_length=255)
     pseudo = models.CharField(
         max_length=32,
@@ -604,9 +668,10 @@ class User(
 
     @cached_property
     def solde(self):
-        """Shortcuts, calculate and returns the balance for this user, as a
-        dynamic balance beetween debiti (-) and credit (+) "Vente" objects
-        flaged as balance operations.
+        """Shortcuts, returns the balance for this user, as a dynamic balance
+        beetween debiti (-) and credit (+) "Vente" objects flaged as balance
+        operations. It is read from the UserBalance of the user, or
+        calculated if it does not exist yet.
 
         Parameters:
             self (user instance): user to return infos
@@ -614,36 +679,23 @@ class User(
         Returns:
             solde (float) : The balance of the user.
         """
-        solde_objects = Paiement.objects.filter(is_balance=True)
-        somme_debit = (
-            Vente.objects.filter(
-                facture__in=Facture.objects.filter(
-                    user=self, paiement__in=solde_objects, valid=True
-                )
-            ).aggregate(
-                total=models.Sum(
-                    models.F("prix") * models.F("number"),
-                    output_field=models.DecimalField(),
-                )
-            )[
-                "total"
-            ]
-            or 0
-        )
-        somme_credit = (
-            Vente.objects.filter(
-                facture__in=Facture.objects.filter(user=self, valid=True), name="solde"
-            ).aggregate(
-                total=models.Sum(
-                    models.F("prix") * models.F("number"),
-                    output_field=models.DecimalField(),
-                )
-            )[
-                "total"
-            ]
-            or 0
-        )
-        return somme_credit - somme_debit
+        balance = self.stored_balance()
+        if balance is not None:
+            return balance.value
+        totals = UserBalance.with_totals(User.objects.filter(pk=self.pk)).get()
+        return (totals.credit_total or 0) - (totals.debit_total or 0)
+
+    def stored_balance(self):
+        """Methods, returns the materialized balance of this user.
+
+        Returns:
+            balance (UserBalance) : The balance, None if it has not been
+            computed yet.
+        """
+        try:
+            return self.balance_totals
+        except UserBalance.DoesNotExist:
+            return None
 
     @cached_property
     def email_address(self):
@@ -665,6 +717,34 @@ class User(
             return self.emailaddress_set.all()
         return EMailAddress.objects.none()
 
+    def access_state_date(self):
+        """Methods, returns the date at which the access of this user is
+        evaluated: now, unless the user was fetched with
+        UserManager.with_access_state(at=...).
+
+        Returns:
+            date (datetime) : The date to compare the end dates with.
+        """
+        return getattr(self, "access_state_at", None) or timezone.now()
+
+    @memoize_access
+    def stored_access_state(self):
+        """Methods, returns the materialized access state of this user.
+
+        The state is read from the database: the access_state relation
+        cached on this instance is not updated when the state of the user is
+        refreshed through another instance (e.g. by the signals of a
+        cotisation).
+
+        Returns:
+            access_state (UserAccessState) : The access state, None if it
+            has not been computed yet.
+        """
+        if self.pk is None:
+            return None
+        return UserAccessState.objects.filter(user_id=self.pk).first()
+
+    @memoize_access
     def end_adhesion(self):
         """Methods, calculate and returns the end of membership value date of
         this user with aggregation of Cotisation objects linked to user
@@ -676,6 +756,11 @@ class User(
         Returns:
             end_adhesion (date) : Date of the end of the membership.
         """
+        if hasattr(self, "end_adhesion_date"):
+            return self.end_adhesion_date
+        access_state = self.stored_access_state()
+        if access_state is not None:
+            return access_state.end_adhesion
         date_max = (
             Cotisation.objects.filter(
                 vente__in=Vente.objects.filter(
@@ -686,6 +771,7 @@ class User(
         )
         return date_max
 
+    @memoize_access
     def end_connexion(self):
         """Methods, calculate and returns the end of connection subscription value date
         of this user with aggregation of Cotisation objects linked to user instance.
@@ -696,6 +782,11 @@ class User(
         Returns:
             end_adhesion (date) : Date of the end of the connection subscription.
         """
+        if hasattr(self, "end_connexion_date"):
+            return self.end_connexion_date
+        access_state = self.stored_access_state()
+        if access_state is not None:
+            return access_state.end_connexion
         date_max = (
             Cotisation.objects.filter(
                 vente__in=Vente.objects.filter(
@@ -706,6 +797,7 @@ class User(
         )
         return date_max
 
+    @memoize_access
     def is_adherent(self):
         """Methods, calculate and returns if the user has a valid membership by testing
         if end_adherent is after now or not.
@@ -719,7 +811,7 @@ class User(
         end = self.end_adhesion()
         if not end:
             return False
-        elif end < timezone.now():
+        elif end < self.access_state_date():
             return False
         else:
             return True
@@ -728,6 +820,7 @@ class User(
         # in case the user purshased a cotisation starting in the futur
         # somehow
 
+    @memoize_access
     def is_connected(self):
         """Methods, calculate and returns if the user has a valid membership AND a
         valid connection subscription by testing if end_connexion is after now or not.
@@ -742,7 +835,7 @@ class User(
         end = self.end_connexion()
         if not end:
             return False
-        elif end < timezone.now():
+        elif end < self.access_state_date():
             return False
         else:
             return self.is_adherent()
@@ -751,6 +844,7 @@ class User(
         # in case the user purshased a cotisation starting in the futur
         # somehow
 
+    @memoize_access
     def end_ban(self):
         """Methods, calculate and returns the end of a ban value date
         of this user with aggregation of ban objects linked to user instance.
@@ -761,11 +855,17 @@ class User(
         Returns:
             end_ban (date) : Date of the end of the bans objects.
         """
+        if hasattr(self, "end_ban_date"):
+            return self.end_ban_date
+        access_state = self.stored_access_state()
+        if access_state is not None:
+            return access_state.end_ban
         date_max = Ban.objects.filter(user=self).aggregate(models.Max("date_end"))[
             "date_end__max"
         ]
         return date_max
 
+    @memoize_access
     def end_whitelist(self):
         """Methods, calculate and returns the end of a whitelist value date
         of this user with aggregation of whitelists objects linked to user instance.
@@ -776,11 +876,17 @@ class User(
         Returns:
             end_whitelist (date) : Date of the end of the whitelists objects.
         """
+        if hasattr(self, "end_whitelist_date"):
+            return self.end_whitelist_date
+        access_state = self.stored_access_state()
+        if access_state is not None:
+            return access_state.end_whitelist
         date_max = Whitelist.objects.filter(user=self).aggregate(
             models.Max("date_end")
         )["date_end__max"]
         return date_max
 
+    @memoize_access
     def is_ban(self):
         """Methods, calculate and returns if the user is banned by testing
         if end_ban is after now or not.
@@ -794,11 +900,12 @@ class User(
         end = self.end_ban()
         if not end:
             return False
-        elif end < timezone.now():
+        elif end < self.access_state_date():
             return False
         else:
             return True
 
+    @memoize_access
     def is_whitelisted(self):
         """Methods, calculate and returns if the user has a whitelist free connection
         if end_whitelist is after now or not.
@@ -812,11 +919,12 @@ class User(
         end = self.end_whitelist()
         if not end:
             return False
-        elif end < timezone.now():
+        elif end < self.access_state_date():
             return False
         else:
             return True
 
+    @memoize_access
     def has_access(self):
         """Methods, returns if the user has an internet access.
         Return True if user is active and has a verified email, is not under a ban
@@ -835,6 +943,7 @@ class User(
             and (self.is_connected() or self.is_whitelisted())
         ) or self == AssoOption.get_cached_value("utilisateur_asso")
 
+    @memoize_access
     def end_access(self):
         """Methods, returns the date of the end of the connection for this user,
         as the maximum date beetween connection (membership objects) and whitelists.
@@ -1008,8 +1117,7 @@ class User(
             account to disable.
 
         """
-        queryset_users.update(local_email_enabled=False)
-        queryset_users.update(local_email_redirect=False)
+        queryset_users.update(local_email_enabled=False, local_email_redirect=False)
 
     def delete_data(self):
         """Method, delete non mandatory data, delete machine,
@@ -1047,22 +1155,71 @@ class User(
         """
         self.unassign_ips()
 
+    @classmethod
+    def archive_candidates(cls, full_archive=False):
+        """Class method, returns the users which may be archived, by their
+        state: those which are not already (fully) archived.
+
+        Parameters:
+            full_archive (boolean): If true, include the archived users
+
+        Returns:
+            users (queryset): Queryset of the users which may be archived
+        """
+        users = User.objects.exclude(state=User.STATE_NOT_YET_ACTIVE).exclude(
+            state=User.STATE_FULL_ARCHIVE
+        )
+        if not full_archive:
+            users = users.exclude(state=User.STATE_ARCHIVE)
+        return users
+
+    @classmethod
+    def archive_targets(cls, date, full_archive=False):
+        """Class method, returns the users to archive: the users without
+        access now and at date, among archive_candidates.
+
+        Parameters:
+            date (datetime): date of the end of the access
+            full_archive (boolean): If true, include the archived users
+
+        Returns:
+            users (queryset): Queryset of the users to archive
+        """
+        from re2o.utils import all_has_access_exists
+
+        return (
+            cls.archive_candidates(full_archive)
+            .exclude(id__in=all_has_access_exists().values("pk"))
+            .exclude(id__in=all_has_access_exists(search_time=date).values("pk"))
+        )
+
     @classmethod
     def mass_archive(cls, users_list):
         """Class method, mass archive a queryset of users.
         Called during archive process, unassign ip and set to
-        archive state.
+        archive state. The users are fetched once and archived by chunks
+        of ARCHIVE_CHUNK users, one transaction each, then the services
+        are regenerated once.
 
         Parameters:
             users_list (list of users queryset): users to perform
             mass archive.
 
-        """
-        # Force eval of queryset
-        bool(users_list)
-        users_list = users_list.all()
-        cls.mass_unassign_ips(users_list)
-        users_list.update(state=User.STATE_ARCHIVE)
+        Returns:
+            count (int): The number of archived users
+        """
+        user_ids = list(users_list.values_list("pk", flat=True))
+        for start in range(0, len(user_ids), cls.ARCHIVE_CHUNK):
+            chunk = User.objects.filter(pk__in=user_ids[start : start + cls.ARCHIVE_CHUNK])
+            with transaction.atomic():
+                cls.mass_unassign_ips(chunk)
+                InterfaceChange.record_users(chunk)
+                chunk.update(state=User.STATE_ARCHIVE)
+        if user_ids:
+            regen("dhcp")
+            regen("mac_ip_list")
+            regen("dns")
+        return len(user_ids)
 
     def full_archive(self):
         """Method, full archive an user by unassigning ips, deleting data
@@ -1080,19 +1237,33 @@ class User(
     def mass_full_archive(cls, users_list):
         """Class method, mass full archive a queryset of users.
         Called during full archive process, unassign ip, delete
-        non mandatory data and set to full archive state.
+        non mandatory data and set to full archive state. The users are
+        fetched once and archived by chunks of ARCHIVE_CHUNK users, one
+        transaction each followed by their removal from the LDAP, then the
+        services are regenerated once.
 
         Parameters:
             users_list (list of users queryset): users to perform
             mass full archive.
 
-        """
-        # Force eval of queryset
-        bool(users_list)
-        users_list = users_list.all()
-        cls.mass_unassign_ips(users_list)
-        cls.mass_delete_data(users_list)
-        users_list.update(state=User.STATE_FULL_ARCHIVE)
+        Returns:
+            count (int): The number of archived users
+        """
+        user_ids = list(users_list.values_list("pk", flat=True))
+        for start in range(0, len(user_ids), cls.ARCHIVE_CHUNK):
+            chunk = User.objects.filter(pk__in=user_ids[start : start + cls.ARCHIVE_CHUNK])
+            with transaction.atomic():
+                cls.mass_unassign_ips(chunk)
+                cls.mass_disable_email(chunk)
+                Machine.mass_delete(Machine.objects.filter(user__in=chunk))
+                chunk.update(state=User.STATE_FULL_ARCHIVE)
+            signals.remove_mass.send(sender=cls, queryset=chunk)
+        if user_ids:
+            regen("dhcp")
+            regen("mac_ip_list")
+            regen("dns")
+            regen("mailing")
+        return len(user_ids)
 
     def unarchive(self):
         """Method, unarchive an user by assigning ips, and recreating
@@ -1107,12 +1278,18 @@ class User(
 
     def state_sync(self):
         """Master Method, call unarchive, full_archive or archive method
-        on an user when state is changed, based on previous state.
+        on an user when state is changed, based on previous state. Record a
+        change of the interfaces of the user if the state or the suspension
+        of the email address changed its access.
 
         Parameters:
             self (user instance): user to sync state.
 
         """
+        if self.__original_state != self.state or (
+            self.__original_email_state == self.EMAIL_STATE_UNVERIFIED
+        ) != (self.email_state == self.EMAIL_STATE_UNVERIFIED):
+            InterfaceChange.record_users([self])
         if (
             self.__original_state != self.STATE_ACTIVE
             and self.state == self.STATE_ACTIVE
@@ -1131,19 +1308,21 @@ class User(
 
     ###### Send mail functions ######
 
-    def notif_inscription(self, request=None):
-        """Method/function, send an email 'welcome' to user instance, after
-        successfull register.
+    def welcome_mail(self, mailmessageoptions=None):
+        """Method/function, returns the subject and the html body of the
+        'welcome' email of user instance.
 
         Parameters:
             self (user instance): user to send the welcome email
-            request (optional request): Specify request
+            mailmessageoptions (optional): MailMessageOption instance, to
+                avoid fetching it for each user
 
         Returns:
-            email: Welcome email after user register
+            (subject, html_message): The welcome email
         """
         template = loader.get_template("users/email_welcome")
-        mailmessageoptions, _created = MailMessageOption.objects.get_or_create()
+        if mailmessageoptions is None:
+            mailmessageoptions, _created = MailMessageOption.objects.get_or_create()
         context = {
             "nom": self.get_full_name(),
             "asso_name": AssoOption.get_cached_value("name"),
@@ -1152,28 +1331,45 @@ class User(
             "welcome_mail_en": mailmessageoptions.welcome_mail_en,
             "pseudo": self.pseudo,
         }
+        return (
+            "Bienvenue au %(name)s / Welcome to %(name)s"
+            % {"name": AssoOption.get_cached_value("name")},
+            template.render(context),
+        )
 
+    def notif_inscription(self, request=None):
+        """Method/function, send an email 'welcome' to user instance, after
+        successfull register.
+
+        Parameters:
+            self (user instance): user to send the welcome email
+            request (optional request): Specify request
+
+        Returns:
+            email: Welcome email after user register
+        """
+        subject, html_message = self.welcome_mail()
         send_mail(
             request,
-            "Bienvenue au %(name)s / Welcome to %(name)s"
-            % {"name": AssoOption.get_cached_value("name")},
+            subject,
             "",
             GeneralOption.get_cached_value("email_from"),
             [self.email],
-            html_message=template.render(context),
+            html_message=html_message,
         )
 
-    def reset_passwd_mail(self, request):
-        """Method/function, makes a Request class instance, and send
-        an email to user instance for password change in case of initial
-        password set or forget password form.
+    def reset_passwd_message(self, build_absolute_uri):
+        """Method/function, makes a Request class instance, and returns the
+        subject and the body of the email to user instance for password
+        change.
 
         Parameters:
-            self (user instance): user to send the welcome email
-            request: Specify request, mandatory to build the reset link
+            self (user instance): user to send the email
+            build_absolute_uri: function building the absolute URL of a
+                path, e.g. request.build_absolute_uri
 
         Returns:
-            email: Reset password email for user instance
+            (subject, message): Reset password email for user instance
         """
         req = Request()
         req.type = Request.PASSWD
@@ -1185,19 +1381,36 @@ class User(
             "asso": AssoOption.get_cached_value("name"),
             "asso_mail": AssoOption.get_cached_value("contact"),
             "site_name": GeneralOption.get_cached_value("site_name"),
-            "url": request.build_absolute_uri(
+            "url": build_absolute_uri(
                 reverse("users:process", kwargs={"token": req.token})
             ),
             "expire_in": str(GeneralOption.get_cached_value("req_expire_hrs")),
         }
-
-        send_mail(
-            request,
+        return (
             "Changement de mot de passe de %(name)s / Password change for "
             "%(name)s" % {"name": AssoOption.get_cached_value("name")},
             template.render(context),
+        )
+
+    def reset_passwd_mail(self, request):
+        """Method/function, makes a Request class instance, and send
+        an email to user instance for password change in case of initial
+        password set or forget password form.
+
+        Parameters:
+            self (user instance): user to send the welcome email
+            request: Specify request, mandatory to build the reset link
+
+        Returns:
+            email: Reset password email for user instance
+        """
+        subject, message = self.reset_passwd_message(request.build_absolute_uri)
+        send_mail(
+            request,
+            subject,
+            message,
             GeneralOption.get_cached_value("email_from"),
-            [req.user.email],
+            [self.email],
             fail_silently=False,
         )
 
@@ -1324,51 +1537,69 @@ class User(
         )
         return
 
-    def autoregister_machine(self, mac_address, nas_type, request=None):
+    def autoregister_machine(self, mac_address, nas_type, request=None, notify=True):
         """Function, register a new interface on the user instance account.
-        Called automaticaly mainly by freeradius python backend, for autoregister.
+        Called by the process_autoregister command, for the MAC addresses
+        captured by the freeradius python backend (see AutoregisterRequest).
 
         Parameters:
             self (user instance): user to register new interface
             mac_address (string): New mac address to add on the new interface
             nas_type (Django Nas object instance): The nas object calling
             request: Optional django request
+            notify (boolean): If false, the notification email is not sent,
+            the caller is expected to send it (see auto_newmachine_mail)
 
         Returns:
-            interface (Interface instance): The new interface registered
+            (interface, reason, code): The new interface registered (False
+            if the registration failed), a message and the failure code,
+            one of the AUTOREGISTER_* constants (None on success)
 
         """
         allowed, _message, _rights = Machine.can_create(self, self.id)
         if not allowed:
-            return False, _("Maximum number of registered machines reached.")
+            return (
+                False,
+                _("Maximum number of registered machines reached."),
+                self.AUTOREGISTER_MAX_MACHINES,
+            )
         if not nas_type:
-            return False, _("Re2o doesn't know wich machine type to assign.")
+            return (
+                False,
+                _("Re2o doesn't know wich machine type to assign."),
+                self.AUTOREGISTER_NO_MACHINE_TYPE,
+            )
         machine_type_cible = nas_type.machine_type
         try:
-            machine_parent = Machine()
-            machine_parent.user = self
-            interface_cible = Interface()
-            interface_cible.mac_address = mac_address
-            interface_cible.machine_type = machine_type_cible
-            interface_cible.clean()
-            machine_parent.clean()
-            domain = Domain()
-            domain.name = self.get_next_domain_name()
-            domain.interface_parent = interface_cible
-            domain.clean()
-            machine_parent.save()
-            interface_cible.machine = machine_parent
-            interface_cible.save()
-            domain.interface_parent = interface_cible
-            domain.clean()
-            domain.save()
-            self.notif_auto_newmachine(interface_cible)
+            with transaction.atomic():
+                # Serialize the registrations of this user, so that
+                # concurrent ones do not pick the same domain name
+                User.objects.select_for_update().get(pk=self.pk)
+                machine_parent = Machine()
+                machine_parent.user = self
+                interface_cible = Interface()
+                interface_cible.mac_address = mac_address
+                interface_cible.machine_type = machine_type_cible
+                interface_cible.clean()
+                machine_parent.clean()
+                domain = Domain()
+                domain.name = self.get_next_domain_name()
+                domain.interface_parent = interface_cible
+                domain.clean()
+                machine_parent.save()
+                interface_cible.machine = machine_parent
+                interface_cible.save()
+                domain.interface_parent = interface_cible
+                domain.clean()
+                domain.save()
+            if notify:
+                self.notif_auto_newmachine(interface_cible)
         except Exception as error:
-            return False, traceback.format_exc()
-        return interface_cible, _("OK")
+            return False, traceback.format_exc(), self.AUTOREGISTER_ERROR
+        return interface_cible, _("OK"), None
 
-    def notif_auto_newmachine(self, interface):
-        """Function/method, send an email to notify the new interface
+    def auto_newmachine_mail(self, interface):
+        """Function/method, build the email notifying the new interface
         registered on user instance account.
 
         Parameters:
@@ -1376,7 +1607,7 @@ class User(
             interface (interface instance): new interface registered
 
         Returns:
-            boolean: True if a confirmation of the mail is needed
+            email: The notification email, not yet sent
         """
         template = loader.get_template("users/email_auto_newmachine")
         context = {
@@ -1387,15 +1618,24 @@ class User(
             "asso_email": AssoOption.get_cached_value("contact"),
             "pseudo": self.pseudo,
         }
-
-        send_mail(
-            None,
+        mail = EmailMultiAlternatives(
             "Ajout automatique d'une machine / New machine autoregistered",
             "",
             GeneralOption.get_cached_value("email_from"),
             [self.email],
-            html_message=template.render(context),
         )
+        mail.attach_alternative(template.render(context), "text/html")
+        return mail
+
+    def notif_auto_newmachine(self, interface):
+        """Function/method, send an email to notify the new interface
+        registered on user instance account.
+
+        Parameters:
+            self (user instance): user to notify new registration
+            interface (interface instance): new interface registered
+        """
+        send_mail_object(self.auto_newmachine_mail(interface), None)
         return
 
     def notif_disable(self, request=None):
@@ -1433,22 +1673,27 @@ class User(
         Parameters:
             self (user instance): user to get a new domain name
 
+        The names <pseudo>N already used are fetched in one query, and the
+        smallest free N is returned. To allocate it safely against
+        concurrent registrations, lock the user row first (see
+        autoregister_machine).
+
         Returns:
            domain name (string): String of new domain name
         """
-
-        def simple_pseudo():
-            """Renvoie le pseudo sans underscore (compat dns)"""
-            return self.pseudo.replace("_", "-").lower()
-
-        def composed_pseudo(name):
-            """Renvoie le resultat de simplepseudo et rajoute le nom"""
-            return simple_pseudo() + str(name)
-
+        # Pseudo without underscore (compat dns)
+        prefix = self.pseudo.replace("_", "-").lower()
+        used = set()
+        for name in Domain.objects.filter(name__istartswith=prefix).values_list(
+            "name", flat=True
+        ):
+            suffix = name.lower()[len(prefix) :]
+            if suffix.isdigit() and str(int(suffix)) == suffix:
+                used.add(int(suffix))
         num = 0
-        while Domain.objects.filter(name=composed_pseudo(num)):
+        while num in used:
             num += 1
-        return composed_pseudo(num)
+        return prefix + str(num)
 
     def can_edit(self, user_request, *_args, **_kwargs):
         """Check if a user can edit a user object.
@@ -1793,6 +2038,7 @@ class User(
         }
         self.__original_state = self.state
         self.__original_email = self.email
+        self.__original_email_state = self.email_state
 
     def clean_pseudo(self, *args, **kwargs):
         """Method, clean the pseudo value. The pseudo must be unique, but also
@@ -1881,6 +2127,9 @@ class Adherent(User):
     )
     gpg_fingerprint = models.CharField(max_length=49, blank=True, null=True)
 
+    # The managers of a concrete parent model are not inherited
+    objects = UserManager()
+
     class Meta(User.Meta):
         verbose_name = _("member")
         verbose_name_plural = _("members")
@@ -2020,6 +2269,9 @@ class Club(User):
     )
     mailing = models.BooleanField(default=False)
 
+    # The managers of a concrete parent model are not inherited
+    objects = UserManager()
+
     class Meta(User.Meta):
         verbose_name = _("club")
         verbose_name_plural = _("clubs")
@@ -2093,9 +2345,13 @@ def user_post_save(**kwargs):
     """
     is_created = kwargs["created"]
     user = kwargs["instance"]
+    forget_access(user.pk)
     EMailAddress.objects.get_or_create(local_part=user.pseudo.lower(), user=user)
 
     if is_created:
+        UserAccessState.refresh(user)
+        # A new user has no invoices, so that solde never has to compute it
+        UserBalance.objects.get_or_create(user=user)
         user.notif_inscription(user.request)
         user.set_active()
     user.state_sync()
@@ -2382,6 +2638,20 @@ class Ban(RevMixin, AclMixin, models.Model):
         verbose_name = _("ban")
         verbose_name_plural = _("bans")
 
+    def __init__(self, *args, **kwargs):
+        super(Ban, self).__init__(*args, **kwargs)
+        self.__original_user_id = self.user_id
+
+    def previous_user(self):
+        """Get the user the ban belonged to before it was edited.
+
+        Returns:
+            user: the previous owner, None if the owner did not change.
+        """
+        if self.__original_user_id in (None, self.user_id):
+            return None
+        return User.objects.filter(pk=self.__original_user_id).first()
+
     def notif_ban(self, request=None):
         """Function/method, send an email to notify that a ban has been
         decided and internet access disabled.
@@ -2453,6 +2723,11 @@ def ban_post_save(**kwargs):
     ban = kwargs["instance"]
     is_created = kwargs["created"]
     user = ban.user
+    UserAccessState.refresh(user)
+    previous_user = ban.previous_user()
+    if previous_user is not None:
+        UserAccessState.refresh(previous_user)
+        signals.synchronise.send(sender=User, instance=previous_user, base=False, access_refresh=True, mac_refresh=False)
     signals.synchronise.send(sender=User, instance=user, base=False, access_refresh=True, mac_refresh=False)
     regen("mailing")
     if is_created:
@@ -2471,6 +2746,7 @@ def ban_post_delete(**kwargs):
 
     """
     user = kwargs["instance"].user
+    UserAccessState.refresh(user, create=False)
     signals.synchronise.send(sender=User, instance=user, base=False, access_refresh=True, mac_refresh=False)
     regen("mailing")
     regen("dhcp")
@@ -2499,6 +2775,20 @@ class Whitelist(RevMixin, AclMixin, models.Model):
         verbose_name = _("whitelist (free of charge access)")
         verbose_name_plural = _("whitelists (free of charge access)")
 
+    def __init__(self, *args, **kwargs):
+        super(Whitelist, self).__init__(*args, **kwargs)
+        self.__original_user_id = self.user_id
+
+    def previous_user(self):
+        """Get the user the whitelist belonged to before it was edited.
+
+        Returns:
+            user: the previous owner, None if the owner did not change.
+        """
+        if self.__original_user_id in (None, self.user_id):
+            return None
+        return User.objects.filter(pk=self.__original_user_id).first()
+
     def is_active(self):
         """Method, returns if the whitelist is active now or not.
 
@@ -2543,6 +2833,11 @@ def whitelist_post_save(**kwargs):
     """
     whitelist = kwargs["instance"]
     user = whitelist.user
+    UserAccessState.refresh(user)
+    previous_user = whitelist.previous_user()
+    if previous_user is not None:
+        UserAccessState.refresh(previous_user)
+        signals.synchronise.send(sender=User, instance=previous_user, base=False, access_refresh=True, mac_refresh=False)
     signals.synchronise.send(sender=User, instance=user, base=False, access_refresh=True, mac_refresh=False)
     is_created = kwargs["created"]
     regen("mailing")
@@ -2561,6 +2856,7 @@ def whitelist_post_delete(**kwargs):
 
     """
     user = kwargs["instance"].user
+    UserAccessState.refresh(user, create=False)
     signals.synchronise.send(sender=User, instance=user, base=False, access_refresh=True, mac_refresh=False)
     regen("mailing")
     regen("dhcp")
@@ -2600,6 +2896,383 @@ class Request(models.Model):
         super(Request, self).save()
 
 
+class AutoregisterRequest(models.Model):
+    """A MAC address captured by the freeradius backend, waiting to be
+    registered on the account of a user. The freeradius backend only stores
+    the request so that the RADIUS answer is not delayed by the registration,
+    which is done by the process_autoregister management command.
+    A MAC address is stored only once, however many times it is captured.
+    A request which failed for a transient reason is kept and tried again
+    later, with a delay doubling at each attempt.
+
+    Attributes:
+        user: the user on whose account the machine will be registered
+        mac_address: the captured MAC address
+        nas: the NAS device which captured the MAC address
+        created_at: Date of the first capture of the MAC address
+        attempts: Number of failed attempts of registration
+        last_error: Reason of the last failure
+        next_attempt: Date before which the request is not tried again,
+            None to try it as soon as possible
+    """
+
+    # Delay before the first retry, doubled at each failure
+    RETRY_DELAY = datetime.timedelta(minutes=1)
+    # The request is dropped after that many failures
+    MAX_ATTEMPTS = 10
+
+    user = models.ForeignKey("User", on_delete=models.CASCADE)
+    mac_address = MACAddressField(integer=False, unique=True)
+    nas = models.ForeignKey("machines.Nas", on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = _("machine autoregistration request")
+        verbose_name_plural = _("machine autoregistration requests")
+
+    @classmethod
+    def enqueue(cls, user, mac_address, nas_type):
+        """Class method, store a request to register mac_address on the
+        account of user, unless this MAC address is already waiting.
+
+        Parameters:
+            user (user instance): user who will own the new machine
+            mac_address (string): captured MAC address
+            nas_type (Nas instance): NAS device which captured the MAC address
+
+        Returns:
+            created (boolean): False if the MAC address was already waiting
+        """
+        _request, created = cls.objects.get_or_create(
+            mac_address=mac_address, defaults={"user": user, "nas": nas_type}
+        )
+        return created
+
+    @classmethod
+    def due(cls, now=None):
+        """Class method, the requests to process, the new ones and those
+        whose retry delay has passed."""
+        now = now or timezone.now()
+        return cls.objects.filter(
+            Q(next_attempt__isnull=True) | Q(next_attempt__lte=now)
+        )
+
+    def is_permanent_failure(self, code):
+        """Method, check if the registration failed for a reason which will
+        not go away by trying again: the user reached the maximum number of
+        machines, the NAS has no machine type, or the MAC address is already
+        registered.
+
+        Parameters:
+            code: the failure code returned by User.autoregister_machine
+        """
+        return (
+            code
+            in (User.AUTOREGISTER_MAX_MACHINES, User.AUTOREGISTER_NO_MACHINE_TYPE)
+            or Interface.objects.filter(mac_address=self.mac_address).exists()
+        )
+
+    def process(self):
+        """Method, register the machine and delete the request. If the
+        registration fails for a transient reason, the request is kept and
+        will be tried again after a delay, until MAX_ATTEMPTS failures.
+
+        Returns:
+            result: The new interface (or False) and the reason, as returned
+            by User.autoregister_machine. The request is deleted unless its
+            pk is still set.
+        """
+        with transaction.atomic():
+            result, reason, code = self.user.autoregister_machine(
+                self.mac_address, self.nas, notify=False
+            )
+            if not result:
+                transaction.set_rollback(True)
+        if result or self.is_permanent_failure(code):
+            self.delete()
+            return result, reason
+        self.attempts += 1
+        if self.attempts >= self.MAX_ATTEMPTS:
+            self.delete()
+            return result, reason
+        self.last_error = str(reason)
+        self.next_attempt = timezone.now() + self.RETRY_DELAY * 2 ** (
+            self.attempts - 1
+        )
+        self.save()
+        return result, reason
+
+    def __str__(self):
+        return str(self.user) + " " + str(self.mac_address)
+
+
+class UserAccessState(models.Model):
+    """The access state of a user, materialized so that end_adhesion,
+    end_connexion, end_ban and end_whitelist (and thus is_ban, is_connected,
+    has_access...) are attribute reads. It is refreshed by the Cotisation,
+    Facture, Ban and Whitelist signals, and can be rebuilt for all the users
+    with the rebuild_access_state management command.
+
+    Attributes:
+        user: the user whose access state it is
+        end_adhesion: Date of the end of the membership
+        end_connexion: Date of the end of the connection subscription
+        end_ban: Date of the end of the bans
+        end_whitelist: Date of the end of the whitelists
+        access: True if the user was not banned and was connected or
+            whitelisted when the state was computed
+        next_change: Date until which access holds, the next end date
+        updated_at: Date of the last computation of the state
+    """
+
+    user = models.OneToOneField(
+        "User", on_delete=models.CASCADE, primary_key=True, related_name="access_state"
+    )
+    end_adhesion = models.DateTimeField(blank=True, null=True)
+    end_connexion = models.DateTimeField(blank=True, null=True)
+    end_ban = models.DateTimeField(blank=True, null=True)
+    end_whitelist = models.DateTimeField(blank=True, null=True)
+    access = models.BooleanField(default=False)
+    next_change = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("user access state")
+        verbose_name_plural = _("user access states")
+
+    def compute(self, now=None):
+        """Method, compute access and next_change from the end dates.
+
+        Parameters:
+            now (datetime): Date of the computation, defaults to now
+        """
+        now = now or timezone.now()
+
+        def running(end):
+            return end is not None and end >= now
+
+        self.access = not running(self.end_ban) and (
+            (running(self.end_connexion) and running(self.end_adhesion))
+            or running(self.end_whitelist)
+        )
+        ends = (self.end_adhesion, self.end_connexion, self.end_ban, self.end_whitelist)
+        self.next_change = min((end for end in ends if running(end)), default=None)
+
+    def set_end_dates(self, user):
+        """Method, copy the end dates annotated by
+        UserManager.with_access_state on user."""
+        self.end_adhesion = user.end_adhesion_date
+        self.end_connexion = user.end_connexion_date
+        self.end_ban = user.end_ban_date
+        self.end_whitelist = user.end_whitelist_date
+        self.compute()
+
+    @classmethod
+    def refresh(cls, user, create=True):
+        """Class method, compute the access state of user from its
+        cotisations, bans and whitelists and store it. The state row is
+        locked during the computation so that concurrent refreshes are
+        serialized.
+
+        Parameters:
+            user (user instance): user whose access state is refreshed
+            create (boolean): create the state if it does not exist. The
+                post_delete signals do not, as the user may be being deleted.
+
+        Returns:
+            access_state: The new UserAccessState of the user, None if it
+            does not exist and create is False
+        """
+        forget_access(user.pk)
+        with transaction.atomic():
+            if create:
+                access_state, _created = cls.objects.select_for_update().get_or_create(
+                    user_id=user.pk
+                )
+            else:
+                access_state = (
+                    cls.objects.select_for_update().filter(user_id=user.pk).first()
+                )
+                if access_state is None:
+                    return None
+            access = access_state.access
+            access_state.set_end_dates(
+                User.objects.with_access_state().get(pk=user.pk)
+            )
+            access_state.save()
+            if access_state.access != access:
+                InterfaceChange.record_users([user])
+        return access_state
+
+    @classmethod
+    def rebuild(cls, users):
+        """Class method, compute the access states of a queryset of users
+        from their cotisations, bans and whitelists and store them, in bulk.
+
+        Returns:
+            access_states: The list of the new UserAccessState
+        """
+        access_states = []
+        annotated = User.objects.with_access_state().filter(pk__in=users.values("pk"))
+        for user in annotated.order_by("pk").iterator():
+            access_state = cls(user_id=user.pk)
+            access_state.set_end_dates(user)
+            access_states.append(access_state)
+        with transaction.atomic():
+            previous = set(
+                cls.objects.filter(user__in=users.values("pk"), access=True)
+                .values_list("user_id", flat=True)
+            )
+            changed = previous.symmetric_difference(
+                access_state.user_id
+                for access_state in access_states
+                if access_state.access
+            )
+            cls.objects.filter(user__in=users.values("pk")).delete()
+            cls.objects.bulk_create(access_states, batch_size=1000)
+            InterfaceChange.record_users(changed)
+        return access_states
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class UserBalance(models.Model):
+    """The balance of a user, as running totals of its credit and debit
+    purchases, so that User.solde is an attribute read. It is refreshed by
+    the Facture, Vente and Paiement signals, and can be checked against the
+    invoices with the check_balances management command.
+
+    Attributes:
+        user: the user whose balance it is
+        credit: Total of the "solde" purchases of the valid invoices
+        debit: Total of the purchases of the valid invoices paid with a
+            balance payment method
+        updated_at: Date of the last computation of the totals
+    """
+
+    user = models.OneToOneField(
+        "User", on_delete=models.CASCADE, primary_key=True, related_name="balance_totals"
+    )
+    credit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    debit = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("user balance")
+        verbose_name_plural = _("user balances")
+
+    @property
+    def value(self):
+        """The balance, credit minus debit."""
+        return self.credit - self.debit
+
+    @staticmethod
+    def with_totals(queryset):
+        """Annotate a User queryset with the credit_total and debit_total
+        of the users, computed from their invoices with subqueries."""
+
+        def total(purchases):
+            return models.Subquery(
+                purchases.filter(facture__facture__user=models.OuterRef("pk"))
+                .order_by()
+                .values("facture__facture__user")
+                .annotate(
+                    total=models.Sum(
+                        models.F("prix") * models.F("number"),
+                        output_field=models.DecimalField(),
+                    )
+                )
+                .values("total")[:1],
+                output_field=models.DecimalField(),
+            )
+
+        purchases = Vente.objects.filter(facture__facture__valid=True)
+        return queryset.annotate(
+            credit_total=total(purchases.filter(name="solde")),
+            debit_total=total(
+                purchases.filter(facture__facture__paiement__is_balance=True)
+            ),
+        )
+
+    def set_totals(self, user):
+        """Method, copy the totals annotated by with_totals on user."""
+        self.credit = user.credit_total or 0
+        self.debit = user.debit_total or 0
+
+    @classmethod
+    def refresh(cls, user, create=True):
+        """Class method, compute the balance of user from its invoices and
+        store it. The user row is locked during the computation so that
+        concurrent refreshes and rebuilds are serialized.
+
+        Parameters:
+            user (user instance): user whose balance is refreshed
+            create (boolean): create the balance if it does not exist. The
+                post_delete signals do not, as the user may be being deleted.
+
+        Returns:
+            balance: The new UserBalance of the user, None if it does not
+            exist and create is False
+        """
+        with transaction.atomic():
+            # Lock the user row, rebuild locks it too: the balance row may not
+            # exist yet
+            list(
+                User.objects.select_for_update()
+                .filter(pk=user.pk)
+                .values_list("pk", flat=True)
+            )
+            if create:
+                balance, _created = cls.objects.select_for_update().get_or_create(
+                    user_id=user.pk
+                )
+            else:
+                balance = cls.objects.select_for_update().filter(user_id=user.pk).first()
+                if balance is None:
+                    return None
+            balance.set_totals(cls.with_totals(User.objects.filter(pk=user.pk)).get())
+            balance.save()
+        # Do not let the user instance use a previous balance
+        user.balance_totals = balance
+        user.__dict__.pop("solde", None)
+        return balance
+
+    @classmethod
+    def rebuild(cls, users):
+        """Class method, compute the balances of a queryset of users from
+        their invoices and store them, in bulk. The users rows are locked
+        until the balances are stored, so that a concurrent refresh waits for
+        the rebuild instead of inserting the same balance.
+
+        Returns:
+            balances: The list of the new UserBalance
+        """
+        with transaction.atomic():
+            user_ids = list(
+                User.objects.select_for_update()
+                .filter(pk__in=users.values("pk"))
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+            balances = []
+            for user in cls.with_totals(User.objects.filter(pk__in=user_ids)).order_by(
+                "pk"
+            ).iterator():
+                balance = cls(user_id=user.pk)
+                balance.set_totals(user)
+                balances.append(balance)
+            cls.objects.filter(user_id__in=user_ids).delete()
+            cls.objects.bulk_create(balances, batch_size=1000)
+        return balances
+
+    def __str__(self):
+        return str(self.user_id)
+
+
 class EMailAddress(RevMixin, AclMixin, models.Model):
     """ A class representing an EMailAddress, for local emailaccounts
     support. Each emailaddress belongs to a user.
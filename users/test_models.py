@@ -3,7 +3,10 @@ from django.test import TestCase
 import datetime
 from django.utils import timezone
 
-from users.models import User
+from re2o.base import access_memo
+from re2o.timeline import AccessScheduler, AccessTimeline, sample_dates
+from re2o.utils import all_has_access
+from users.models import AutoregisterRequest, Ban, User, UserAccessState
 from cotisations.models import Vente, Facture, Paiement
 
 
@@ -42,3 +45,139 @@ class UserModelTests(TestCase):
             datetime.timedelta(days=2),
             delta=datetime.timedelta(seconds=1),
         )
+
+    def test_mass_archive_of_users_without_access(self):
+        User.objects.filter(pk=self.user.pk).update(state=User.STATE_ACTIVE)
+        targets = User.archive_targets(timezone.now())
+        self.assertIn(self.user.pk, targets.values_list("pk", flat=True))
+        self.assertEqual(User.mass_archive(targets.filter(pk=self.user.pk)), 1)
+        self.assertEqual(User.objects.get(pk=self.user.pk).state, User.STATE_ARCHIVE)
+        self.assertNotIn(
+            self.user.pk,
+            User.archive_targets(timezone.now()).values_list("pk", flat=True),
+        )
+
+
+class UserAccessStateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(pseudo="testUserAccess")
+        paiement = Paiement.objects.create(moyen="test payment")
+        self.invoice = Facture.objects.create(
+            user=self.user, paiement=paiement, valid=True
+        )
+        Vente.objects.create(
+            facture=self.invoice,
+            number=1,
+            name="Test purchase",
+            duration_connection=0,
+            duration_days_connection=1,
+            duration_membership=0,
+            duration_days_membership=1,
+            prix=0,
+        )
+        self.invoice.reorder_purchases()
+
+    def tearDown(self):
+        self.user.facture_set.all().delete()
+        self.user.ban_set.all().delete()
+        self.user.delete()
+
+    def test_with_access_state_matches_aggregates(self):
+        annotated = User.objects.with_access_state().get(pk=self.user.pk)
+        self.assertEqual(annotated.end_adhesion_date, self.user.end_adhesion())
+        self.assertEqual(annotated.end_connexion_date, self.user.end_connexion())
+        self.assertIsNone(annotated.end_ban_date)
+        self.assertIsNone(annotated.end_whitelist_date)
+        self.assertEqual(annotated.is_connected(), self.user.is_connected())
+
+    def test_access_state_is_refreshed_by_signals(self):
+        access_state = UserAccessState.objects.get(user=self.user)
+        self.assertEqual(access_state.end_connexion, self.user.end_connexion())
+        self.assertTrue(access_state.access)
+        self.assertEqual(
+            access_state.next_change,
+            min(access_state.end_adhesion, access_state.end_connexion),
+        )
+        ban = Ban.objects.create(
+            user=self.user,
+            raison="Test ban",
+            date_end=timezone.now() + datetime.timedelta(days=1),
+        )
+        access_state.refresh_from_db()
+        self.assertEqual(access_state.end_ban, ban.date_end)
+        self.assertFalse(access_state.access)
+        ban.delete()
+        access_state.refresh_from_db()
+        self.assertIsNone(access_state.end_ban)
+        self.assertTrue(access_state.access)
+
+    def test_with_access_state_at_date(self):
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        annotated = User.objects.with_access_state(at=yesterday).get(pk=self.user.pk)
+        self.assertIsNone(annotated.end_connexion_date)
+        self.assertFalse(annotated.has_access())
+        self.assertIsNone(annotated.end_access())
+
+    def test_access_timeline_matches_all_has_access(self):
+        now = timezone.now()
+        dates = sample_dates(
+            now - datetime.timedelta(days=2), now + datetime.timedelta(days=2)
+        )
+        timeline = AccessTimeline(dates, including_asso=False)
+        for index, date in enumerate(dates):
+            self.assertEqual(
+                self.user.pk in timeline.users("has_access", index),
+                all_has_access(search_time=date, including_asso=False)
+                .filter(pk=self.user.pk)
+                .exists(),
+            )
+        self.assertEqual(timeline.counts("has_access", {self.user.pk}), [0, 0, 1, 0, 0])
+
+    def test_access_scheduler_handles_the_end_of_a_ban(self):
+        Ban.objects.create(
+            user=self.user,
+            raison="Test ban",
+            date_end=timezone.now() + datetime.timedelta(seconds=1),
+        )
+        scheduler = AccessScheduler(since=timezone.now())
+        self.assertEqual(scheduler.run_pending(), (set(), set()))
+        membership, access = scheduler.run_pending(
+            timezone.now() + datetime.timedelta(seconds=2)
+        )
+        self.assertEqual(membership, set())
+        self.assertEqual(access, {self.user.pk})
+
+    def test_access_is_memoized_until_it_changes(self):
+        user = User.objects.get(pk=self.user.pk)
+        with access_memo():
+            self.assertTrue(user.has_access())
+            with self.assertNumQueries(0):
+                self.assertTrue(user.has_access())
+                self.assertTrue(user.end_access())
+            Ban.objects.create(
+                user=self.user,
+                raison="Test ban",
+                date_end=timezone.now() + datetime.timedelta(days=1),
+            )
+            self.assertFalse(User.objects.get(pk=self.user.pk).has_access())
+
+
+class AutoregisterRequestTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            pseudo="testUserAutoregister", state=User.STATE_ACTIVE, is_superuser=True
+        )
+
+    def tearDown(self):
+        self.user.delete()
+
+    def test_failures_are_classified_by_code(self):
+        result, _reason, code = self.user.autoregister_machine(
+            "02:00:00:00:00:01", None, notify=False
+        )
+        self.assertFalse(result)
+        self.assertEqual(code, User.AUTOREGISTER_NO_MACHINE_TYPE)
+        request = AutoregisterRequest(user=self.user, mac_address="02:00:00:00:00:01")
+        self.assertTrue(request.is_permanent_failure(code))
+        self.assertTrue(request.is_permanent_failure(User.AUTOREGISTER_MAX_MACHINES))
+        self.assertFalse(request.is_permanent_failure(User.AUTOREGISTER_ERROR))
@@ -79,7 +79,7 @@ from importlib import import_module
 from django.conf import settings
 from re2o.settings import LOCAL_APPS, OPTIONNAL_APPS_RE2O
 from re2o.views import form
-from re2o.utils import all_has_access, permission_tree
+from re2o.utils import permission_tree
 from re2o.base import re2o_paginator, SortTable
 from re2o.acl import (
     can_create,
@@ -1084,22 +1084,13 @@ def mass_archive(request):
     if to_archive_form.is_valid():
         date = to_archive_form.cleaned_data["date"]
         full_archive = to_archive_form.cleaned_data["full_archive"]
-        to_archive_list = (
-            User.objects.exclude(id__in=all_has_access())
-            .exclude(id__in=all_has_access(search_time=date))
-            .exclude(state=User.STATE_NOT_YET_ACTIVE)
-            .exclude(state=User.STATE_FULL_ARCHIVE)
-        )
-        if not full_archive:
-            to_archive_list = to_archive_list.exclude(state=User.STATE_ARCHIVE)
+        to_archive_list = User.archive_targets(date, full_archive=full_archive)
         if "valider" in request.POST:
             if full_archive:
-                User.mass_full_archive(to_archive_list)
+                count = User.mass_full_archive(to_archive_list)
             else:
-                User.mass_archive(to_archive_list)
-            messages.success(
-                request, _("%s users were archived.") % to_archive_list.count()
-            )
+                count = User.mass_archive(to_archive_list)
+            messages.success(request, _("%s users were archived.") % count)
             return redirect(reverse("users:index"))
         to_archive_list = re2o_paginator(request, to_archive_list, pagination_number)
     return form(